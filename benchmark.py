@@ -0,0 +1,233 @@
+from pandas import read_csv, read_parquet
+
+from time import perf_counter
+from datetime import timedelta
+from json import dump, load
+from os import makedirs
+from os.path import exists
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from utils import (
+    REQUIRED_COLUMNS,
+    parse_data,
+    format_keys,
+    keep_required_columns,
+    get_zip_mapping,
+    build_zip_lookup,
+    assign_commuting_zones,
+    process_crosswalk,
+)
+from concentration import (
+    get_concentration_statistics,
+    get_market_shares,
+    get_herfindahl_from_statistics,
+)
+from instrumentation import measure, get_rows
+from synthetic import SYNTHETIC_SIZES, get_synthetic_paths, generate_synthetic_data
+from config import BENCHMARK_DIR
+
+
+def measure_stage(
+    results: Dict[str, Dict[str, Any]],
+    name: str,
+    function: Callable[..., Any],
+    *args: Any,
+    rows: Optional[int] = None,
+) -> Any:
+    """
+    Call function with args, measured by measure() as a production run is, and keep the measurement in results
+    under name. Rows default to the rows of the result.
+    Returns result of function.
+    """
+    with measure(name) as record:
+        result = function(*args)
+        record["rows_out"] = get_rows(result) if rows is None else rows
+    results[name] = record
+    print(
+        f"Benchmark {name}: {record['wall_seconds']:.2f} s, {record['peak_memory_mb'] or 0:.1f} MB peak, {record['rows_out']} rows.\n"
+    )
+    return result
+
+
+def run_benchmark(
+    paths: Dict[str, str], directory: str, num_rows: int
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Time and memory-profile each stage of the pipeline on synthetic data written by generate_synthetic_data():
+    parsing, ZIP mapping, trimming columns, merges on ZIP and on FIPS and D&B ID as after geocoding,
+    zero-filling keys, aggregation, Herfindahl Index and each writer.
+    Returns measurements by stage.
+    """
+    results = {}
+    parquet_path = f"{directory}d_and_b.parquet"
+    measure_stage(
+        results,
+        "parse",
+        parse_data,
+        paths["text"],
+        parquet_path,
+        None,
+        None,
+        True,
+        rows=num_rows,
+    )
+    df_mapped = measure_stage(
+        results, "zip_mapping", get_zip_mapping, paths["zip"], paths["crosswalk"]
+    )
+    zip_lookup = measure_stage(results, "zip_lookup", build_zip_lookup, df_mapped)
+    df_processed = measure_stage(
+        results,
+        "trim",
+        lambda: keep_required_columns(
+            read_parquet(parquet_path, columns=REQUIRED_COLUMNS)
+        ),
+    )
+    df_ready = measure_stage(
+        results, "merge_zip", assign_commuting_zones, df_processed, zip_lookup
+    )
+    measure_stage(
+        results,
+        "merge_geocoded",
+        lambda: df_processed.merge(
+            df_ready[["DUNS", "FIPS"]].merge(
+                process_crosswalk(read_csv(paths["crosswalk"])),
+                how="inner",
+                on=["FIPS"],
+            ),
+            how="inner",
+            on=["DUNS"],
+        ),
+    )
+    measure_stage(results, "zero_fill", format_keys, df_ready)
+    df_statistics, cell_codes = measure_stage(
+        results,
+        "aggregate_statistics",
+        get_concentration_statistics,
+        df_ready,
+        rows=len(df_ready),
+    )
+    df_complete = measure_stage(
+        results,
+        "aggregate_market_shares",
+        get_market_shares,
+        df_ready,
+        df_statistics,
+        cell_codes,
+    )
+    measure_stage(results, "herfindahl", get_herfindahl_from_statistics, df_statistics)
+    df_export = format_keys(df_complete)
+    measure_stage(
+        results,
+        "write_parquet",
+        lambda: df_complete.to_parquet(
+            f"{directory}d_and_b_complete.parquet", index=False, compression="zstd"
+        ),
+        rows=len(df_complete),
+    )
+    measure_stage(
+        results,
+        "write_csv",
+        lambda: df_export.to_csv(f"{directory}d_and_b_complete.csv", index=False),
+        rows=len(df_export),
+    )
+    measure_stage(
+        results,
+        "write_stata",
+        lambda: df_export.to_stata(
+            f"{directory}d_and_b_complete.dta", write_index=False
+        ),
+        rows=len(df_export),
+    )
+    return results
+
+
+def compare_to_baseline(
+    results: Dict[str, Dict[str, Any]],
+    baseline: Dict[str, Dict[str, Any]],
+    tolerance: float = 0.25,
+    min_seconds: float = 0.5,
+    min_memory_mb: float = 64.0,
+) -> List[str]:
+    """
+    Flag stages slower or using more peak memory than their baseline by more than tolerance,
+    ignoring time differences under min_seconds and memory differences under min_memory_mb, which are within noise.
+    Returns regression messages.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        seconds, baseline_seconds = (
+            result["wall_seconds"],
+            baseline[name]["wall_seconds"],
+        )
+        if (
+            seconds > baseline_seconds * (1 + tolerance)
+            and seconds - baseline_seconds > min_seconds
+        ):
+            regressions.append(
+                f"{name}: {seconds:.2f} s against baseline {baseline_seconds:.2f} s."
+            )
+        memory, baseline_memory = (
+            result["peak_memory_mb"],
+            baseline[name]["peak_memory_mb"],
+        )
+        baseline_memory = baseline_memory or 0
+        if (
+            memory is not None
+            and memory > baseline_memory * (1 + tolerance)
+            and memory - baseline_memory > min_memory_mb
+        ):
+            regressions.append(
+                f"{name}: {memory:.1f} MB peak against baseline {baseline_memory:.1f} MB."
+            )
+    return regressions
+
+
+def main(
+    sizes: Iterable[str] = ("1m",),
+    update_baseline: bool = False,
+    tolerance: float = 0.25,
+) -> List[str]:
+    """
+    Benchmark each stage on synthetic data of each size in SYNTHETIC_SIZES: 1m, 10m, 50m.
+    Synthetic data is generated once per size and reused. Results are saved as .json in BENCHMARK_DIR,
+    and compared to the stored baseline of the size, which is written by the first run or if update_baseline.
+    Returns regression messages across sizes.
+    """
+    regressions = []
+    for size in sizes:
+        directory = f"{BENCHMARK_DIR}synthetic_{size}/"
+        num_rows = SYNTHETIC_SIZES[size]
+        paths = get_synthetic_paths(directory)
+        if not exists(paths["text"]):
+            paths = generate_synthetic_data(directory, num_rows)
+
+        results = run_benchmark(paths, directory, num_rows)
+        makedirs(BENCHMARK_DIR, exist_ok=True)
+        with open(f"{BENCHMARK_DIR}results_{size}.json", "w") as file:
+            dump(results, file, indent=2)
+
+        baseline_path = f"{BENCHMARK_DIR}baseline_{size}.json"
+        if update_baseline or not exists(baseline_path):
+            with open(baseline_path, "w") as file:
+                dump(results, file, indent=2)
+            print(f"Baseline saved for {size} rows.\n")
+            continue
+        with open(baseline_path, "r") as file:
+            size_regressions = compare_to_baseline(results, load(file), tolerance)
+        for regression in size_regressions:
+            print(f"Regression at {size} rows in {regression}\n")
+        regressions.extend(f"{size} {regression}" for regression in size_regressions)
+    return regressions
+
+
+if __name__ == "__main__":
+
+    start_time = perf_counter()
+
+    main()
+
+    end_time = perf_counter()
+
+    print(f"Time: {str(timedelta(seconds=end_time - start_time))}\n")
@@ -0,0 +1,145 @@
+from pandas import DataFrame
+from numpy import (
+    arange,
+    array_split,
+    bincount,
+    concatenate,
+    cumsum,
+    empty,
+    float64,
+    int64,
+    ndarray,
+    percentile,
+    repeat,
+    searchsorted,
+)
+from numpy.random import SeedSequence, default_rng
+
+from multiprocessing import Pool, cpu_count
+from typing import List, Optional, Tuple
+
+from concentration import (
+    get_concentration_statistics,
+    get_herfindahl_from_statistics,
+    get_market_cells,
+    get_ratio,
+)
+from instrumentation import instrument
+
+
+def get_bootstrap_intervals(
+    args: Tuple[ndarray, ndarray, List[Tuple[SeedSequence, int, int]], int, int, float],
+) -> Tuple[ndarray, ndarray]:
+    """
+    Draw bootstrap replicates of employee Herfindahl Index for the cells of a block of commuting zones,
+    one commuting zone at a time, and reduce them to percentile intervals.
+    Establishments are resampled with replacement within each cell: every cell of n firms gets n uniform draws
+    among its own firms, so counts of each firm are multinomial, and resampled sums by cell are accumulated
+    with one bincount over all cells and replicates of a batch. Commuting zone totals of employees are
+    summed from resampled cell totals, as in get_concentration_statistics().
+    Batches hold at most max_draws draws, so memory is bounded by the largest commuting zone
+    rather than by the number of establishments, and only intervals are returned to the parent.
+    Each commuting zone has its own seed, so intervals do not depend on how blocks are split among workers.
+    Returns arrays of lower and upper bounds of HHI_EMP, one per cell of the block.
+    """
+    employees, cell_codes, czones, num_replicates, max_draws, alpha = args
+    lower, upper = [], []
+    for seed, start, end in czones:
+        rng = default_rng(seed)
+        czone_cell_codes = cell_codes[start:end] - cell_codes[start]
+        num_cells = int(czone_cell_codes[-1]) + 1
+        firms = bincount(czone_cell_codes, minlength=num_cells)
+        draw_starts = start + repeat(cumsum(firms) - firms, firms)
+        draw_firms = repeat(firms, firms)
+        batch_size = max(1, max_draws // (end - start))
+
+        replicates = empty((num_replicates, num_cells), dtype=float64)
+        for batch_start in range(0, num_replicates, batch_size):
+            num_batch = min(batch_size, num_replicates - batch_start)
+            draws = draw_starts + (
+                rng.random((num_batch, end - start)) * draw_firms
+            ).astype(int64)
+            cell_employees = bincount(
+                (arange(num_batch)[:, None] * num_cells + czone_cell_codes).ravel(),
+                weights=employees[draws].ravel(),
+                minlength=num_batch * num_cells,
+            ).reshape(num_batch, num_cells)
+            czone_employees = cell_employees.sum(axis=1, keepdims=True)
+            replicates[batch_start : batch_start + num_batch] = (
+                get_ratio(
+                    cell_employees.ravel(),
+                    repeat(czone_employees.ravel(), num_cells),
+                ).reshape(num_batch, num_cells)
+                / firms
+            )
+        czone_lower, czone_upper = percentile(
+            replicates, [100 * alpha, 100 * (1 - alpha)], axis=0
+        )
+        lower.append(czone_lower)
+        upper.append(czone_upper)
+    return concatenate(lower), concatenate(upper)
+
+
+@instrument
+def bootstrap_herfindahl(
+    df: DataFrame,
+    num_replicates: int = 1000,
+    confidence: float = 0.95,
+    seed: Optional[int] = None,
+    max_draws: int = 1 << 22,
+    num_processes: Optional[int] = None,
+) -> DataFrame:
+    """
+    Compute Herfindahl Index by commuting zone and industry with bootstrap percentile intervals of HHI_EMP,
+    since cells with few firms have noisy point estimates. Commuting zones are split into contiguous blocks
+    across a pool of workers, each returning only the intervals of its cells, and are reproducible for a given
+    seed whatever the number of workers. HHI_SALES has no interval: shares of sales are within the cell,
+    so they sum to one in every replicate and HHI_SALES is the constant 1 / firms unless all sales are zero.
+    Returns DataFrame of CZONE, SIC, HHI_EMP, HHI_EMP_LOWER, HHI_EMP_UPPER, HHI_SALES.
+    """
+    df_statistics, _ = get_concentration_statistics(df)
+    df_herfindahl = get_herfindahl_from_statistics(df_statistics)
+    cell_codes, czone_codes, _ = get_market_cells(df)
+
+    # Sort establishments by cell, so that those of each commuting zone are contiguous
+    order = cell_codes.argsort(kind="stable")
+    employees = df["DEMTLHER"].to_numpy(dtype=float64, na_value=0)[order]
+    cell_codes = cell_codes[order]
+    czone_codes = czone_codes[order]
+    bounds = searchsorted(czone_codes, arange(int(czone_codes.max(initial=-1)) + 2))
+    czones = list(
+        zip(SeedSequence(seed).spawn(len(bounds) - 1), bounds[:-1], bounds[1:])
+    )
+
+    alpha = (1 - confidence) / 2
+    num_processes = max(1, min(num_processes or cpu_count(), len(czones)))
+    tasks = []
+    for block in array_split(arange(len(czones)), num_processes):
+        block_start, block_end = czones[block[0]][1], czones[block[-1]][2]
+        tasks.append(
+            (
+                employees[block_start:block_end],
+                cell_codes[block_start:block_end],
+                [
+                    (czone_seed, start - block_start, end - block_start)
+                    for czone_seed, start, end in czones[block[0] : block[-1] + 1]
+                ],
+                num_replicates,
+                max_draws,
+                alpha,
+            )
+        )
+    with Pool(num_processes) as pool:
+        results = pool.map(get_bootstrap_intervals, tasks)
+
+    position = df_herfindahl.columns.get_loc("HHI_EMP") + 1
+    df_herfindahl.insert(
+        position, "HHI_EMP_LOWER", concatenate([result[0] for result in results])
+    )
+    df_herfindahl.insert(
+        position + 1, "HHI_EMP_UPPER", concatenate([result[1] for result in results])
+    )
+    print(
+        f"Bootstrapping Herfindahl Index complete for {num_replicates} replicates.\n\tDataFrame shape:{df_herfindahl.shape}.\n"
+    )
+    return df_herfindahl
@@ -0,0 +1,701 @@
+from pandas import DataFrame, Index, Series, factorize, concat, read_parquet
+from numpy import (
+    arange,
+    array,
+    bincount,
+    concatenate,
+    cumsum,
+    divide,
+    isin,
+    lexsort,
+    log,
+    unique,
+    zeros,
+    float64,
+    int64,
+    ndarray,
+)
+
+from typing import Any, Dict, Iterable, List, Tuple
+from os import makedirs
+
+from instrumentation import instrument, record_count
+
+
+def get_market_cells(
+    df: DataFrame, columns: Tuple[str, ...] = ("CZONE", "DPRIMSI")
+) -> Tuple[ndarray, ndarray, DataFrame]:
+    """
+    Factorize geography and industry of each establishment once into market cells,
+    sorted by columns with missing codes last. By default cells are commuting zone and industry.
+    Returns cell code of each establishment, code of the first column of each establishment,
+    and DataFrame of keys of each cell.
+    This lower-level function is called in get_concentration_statistics() and get_cube_statistics().
+    """
+    factorized = [
+        factorize(df[column], sort=True, use_na_sentinel=False) for column in columns
+    ]
+    combined_codes = zeros(len(df), dtype=int64)
+    for codes, uniques in factorized:
+        combined_codes = combined_codes * len(uniques) + codes
+    cell_codes, cells = factorize(combined_codes, sort=True)
+    keys = {}
+    for column, (_, uniques) in reversed(list(zip(columns, factorized))):
+        keys[column] = uniques.take(cells % len(uniques))
+        cells = cells // len(uniques)
+    df_cells = DataFrame({column: keys[column] for column in columns})
+    return cell_codes, factorized[0][0], df_cells
+
+
+@instrument
+def get_concentration_statistics(df: DataFrame) -> Tuple[DataFrame, ndarray]:
+    """
+    Accumulate sufficient statistics by commuting zone and industry in a single vectorized pass,
+    replacing separate groupbys and merges back onto the establishment table.
+    For each cell: number of firms, sum and sum of squares of employees on location and sales,
+    and total employees on location of the cell's commuting zone across all industries.
+    Missing employees and sales count as zero in sums, as in groupby sums.
+    Returns DataFrame of statistics by cell and cell code of each establishment.
+    """
+    cell_codes, czone_codes, df_statistics = get_market_cells(df)
+    num_cells = len(df_statistics)
+    cell_czone_codes = zeros(num_cells, dtype=int64)
+    cell_czone_codes[cell_codes] = czone_codes
+    employees = df["DEMTLHER"].to_numpy(dtype=float64, na_value=0)
+    sales = df["DSALESVO"].to_numpy(dtype=float64, na_value=0)
+    czone_employees = bincount(czone_codes, weights=employees).astype(int64)
+
+    df_statistics["FIRMSTOTCZI"] = bincount(cell_codes, minlength=num_cells)
+    df_statistics["DEMTLHERTOTCZI"] = bincount(
+        cell_codes, weights=employees, minlength=num_cells
+    ).astype(int64)
+    df_statistics["DEMTLHERSQTOTCZI"] = bincount(
+        cell_codes, weights=employees**2, minlength=num_cells
+    )
+    df_statistics["DEMTLHERTOTCZ"] = czone_employees[cell_czone_codes]
+    df_statistics["DSALESVOTOTCZI"] = bincount(
+        cell_codes, weights=sales, minlength=num_cells
+    ).astype(int64)
+    df_statistics["DSALESVOSQTOTCZI"] = bincount(
+        cell_codes, weights=sales**2, minlength=num_cells
+    )
+    print(
+        f"Computing concentration statistics complete.\n\tDataFrame shape:{df_statistics.shape}.\n"
+    )
+    return df_statistics, cell_codes
+
+
+@instrument
+def get_market_shares(
+    df: DataFrame, df_statistics: DataFrame, cell_codes: ndarray
+) -> DataFrame:
+    """
+    Add totals of each establishment's cell and its market shares for employees on location by commuting zone,
+    and for sales by commuting zone and industry. Totals are gathered by cell code instead of merged.
+    """
+    df_complete = df.copy()
+    for column in ["FIRMSTOTCZI", "DEMTLHERTOTCZ", "DSALESVOTOTCZI"]:
+        df_complete[column] = df_statistics[column].to_numpy()[cell_codes]
+    df_complete["EMPMKTSHAREZ"] = df_complete["DEMTLHER"] / df_complete["DEMTLHERTOTCZ"]
+    df_complete["SALESMKTSHAREZI"] = (
+        df_complete["DSALESVO"] / df_complete["DSALESVOTOTCZI"]
+    )
+    print(
+        f"Computing aggregates and market shares complete.\n\tDataFrame shape:{df_complete.shape}.\n"
+    )
+    return df_complete
+
+
+def get_ratio(numerator: ndarray, denominator: ndarray) -> ndarray:
+    """
+    Divide element-wise, where cells with a zero denominator get zero,
+    as shares of zero totals drop out of a groupby sum.
+    """
+    return divide(
+        numerator,
+        denominator,
+        out=zeros(len(numerator), dtype=float64),
+        where=denominator != 0,
+    )
+
+
+@instrument
+def get_herfindahl_from_statistics(df_statistics: DataFrame) -> DataFrame:
+    """
+    Compute weighted Herfindahl Index for labour market and sales concentration by commuting zone and industry,
+    directly from sufficient statistics, since summing each firm's share weighted by 1 / firms in cell
+    equals the cell's total share divided by its number of firms.
+    """
+    firms = df_statistics["FIRMSTOTCZI"].to_numpy()
+    df_herfindahl = df_statistics[["CZONE", "DPRIMSI"]].rename(
+        columns={"DPRIMSI": "SIC"}
+    )
+    df_herfindahl["HHI_EMP"] = (
+        get_ratio(
+            df_statistics["DEMTLHERTOTCZI"].to_numpy(),
+            df_statistics["DEMTLHERTOTCZ"].to_numpy(),
+        )
+        / firms
+    )
+    df_herfindahl["HHI_SALES"] = (
+        get_ratio(
+            df_statistics["DSALESVOTOTCZI"].to_numpy(),
+            df_statistics["DSALESVOTOTCZI"].to_numpy(),
+        )
+        / firms
+    )
+    print(
+        f"Computing Herfindahl Index by commuting zone and industry complete.\n\tDataFrame shape:{df_herfindahl.shape}.\n"
+    )
+    return df_herfindahl
+
+
+# Columns of statistics by cell kept in incremental state
+STATISTICS_COLUMNS = [
+    "FIRMSTOTCZI",
+    "DEMTLHERTOTCZI",
+    "DEMTLHERSQTOTCZI",
+    "DSALESVOTOTCZI",
+    "DSALESVOSQTOTCZI",
+]
+
+# Columns of establishments kept in incremental state, indexed by D&B ID
+ESTABLISHMENT_COLUMNS = ["CZONE", "DPRIMSI", "DEMTLHER", "DSALESVO"]
+
+# Tables of incremental state persisted by save_incremental_state()
+STATE_TABLES = ["establishments", "statistics", "czones", "herfindahl"]
+
+# Establishments inserted and deleted since the establishments table of incremental state was rebuilt,
+# as a fraction of the table, above which apply_deltas() rebuilds it with compact_incremental_state()
+COMPACTION_FRACTION = 1 / 16
+
+
+def get_cell_keys(czones: Series, sics: Series) -> ndarray:
+    """
+    Encode commuting zone and industry into one integer key per cell, where missing codes are encoded as 0.
+    Cell keys are used to index incremental state in build_incremental_state() and apply_deltas().
+    """
+    czone_keys = czones.to_numpy(dtype=int64, na_value=-1) + 1
+    sic_keys = sics.to_numpy(dtype=int64, na_value=-1) + 1
+    return (czone_keys << 16) | sic_keys
+
+
+def get_czone_keys(keys: ndarray) -> ndarray:
+    """
+    Decode commuting zone key from cell keys encoded by get_cell_keys().
+    """
+    return keys >> 16
+
+
+def get_czone_cells(keys: ndarray) -> Dict[int, List[int]]:
+    """
+    Index of cell keys by commuting zone key, to find cells of commuting zones whose total changed without a scan.
+    """
+    czone_cells = {}
+    for key, czone_key in zip(keys.tolist(), get_czone_keys(keys).tolist()):
+        czone_cells.setdefault(czone_key, []).append(key)
+    return czone_cells
+
+
+def drop_invalid_duns(df: DataFrame, keep: str = "first") -> DataFrame:
+    """
+    Drop establishments with missing D&B IDs, and all but the first or last establishment of duplicate D&B IDs
+    according to keep, which can't be maintained by D&B ID. Skipped establishments are counted in metrics.
+    """
+    valid = df["DUNS"].notna().to_numpy() & ~df["DUNS"].duplicated(keep=keep).to_numpy()
+    if not valid.all():
+        record_count("skipped_establishments", int((~valid).sum()))
+        print(
+            f"Skipped {(~valid).sum()} establishments with missing or duplicate D&B IDs.\n"
+        )
+    return df[valid]
+
+
+def index_incremental_state(state: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Add to tables of incremental state the structures kept in memory by apply_deltas():
+    establishments inserted and D&B IDs deleted since the establishments table was rebuilt,
+    and index of cell keys by commuting zone key.
+    """
+    state["inserted"] = {}
+    state["deleted"] = set()
+    state["czone_cells"] = get_czone_cells(state["statistics"].index.to_numpy())
+    return state
+
+
+@instrument
+def build_incremental_state(df: DataFrame) -> Dict[str, Any]:
+    """
+    Build state for maintaining Herfindahl Index incrementally from a full computation:
+    establishments by D&B ID, sufficient statistics by cell, employees on location by commuting zone,
+    and Herfindahl Index by cell, where cells and commuting zones are indexed by integer key.
+    Establishments with missing D&B IDs, and duplicates of a D&B ID but the first, are skipped and reported.
+    """
+    df = drop_invalid_duns(df, keep="first")
+    df_statistics, _ = get_concentration_statistics(df)
+    keys = get_cell_keys(df_statistics["CZONE"], df_statistics["DPRIMSI"])
+    df_herfindahl = get_herfindahl_from_statistics(df_statistics)
+    czones = df_statistics[["CZONE", "DEMTLHERTOTCZ"]].set_axis(get_czone_keys(keys))
+    return index_incremental_state(
+        {
+            "establishments": df[ESTABLISHMENT_COLUMNS].set_axis(
+                Index(df["DUNS"].to_numpy(dtype=int64), name="DUNS")
+            ),
+            "statistics": df_statistics[
+                ["CZONE", "DPRIMSI", *STATISTICS_COLUMNS]
+            ].set_axis(keys),
+            "czones": czones[~czones.index.duplicated()],
+            "herfindahl": df_herfindahl.set_axis(keys),
+        }
+    )
+
+
+def get_inserted_establishments(state: Dict[str, Any], duns: List[int]) -> DataFrame:
+    """
+    Establishments of D&B IDs inserted since the establishments table of incremental state was rebuilt,
+    with the dtypes of the table.
+    """
+    establishments = state["establishments"]
+    return DataFrame(
+        [state["inserted"][id] for id in duns],
+        index=Index(duns, dtype=int64, name="DUNS"),
+        columns=ESTABLISHMENT_COLUMNS,
+    ).astype(establishments.dtypes.to_dict())
+
+
+def compact_incremental_state(state: Dict[str, Any]) -> None:
+    """
+    Rebuild establishments table of incremental state with establishments inserted and without D&B IDs deleted
+    since it was last rebuilt, and drop cells left without firms. Called by apply_deltas() once they exceed
+    COMPACTION_FRACTION of the table, so the cost of rebuilding is spread over as many changed records,
+    and by save_incremental_state().
+    """
+    establishments = state["establishments"]
+    if state["deleted"]:
+        establishments = establishments.drop(index=list(state["deleted"]))
+    if state["inserted"]:
+        establishments = concat(
+            [
+                establishments,
+                get_inserted_establishments(state, list(state["inserted"])),
+            ]
+        )
+    statistics = state["statistics"]
+    statistics = statistics[statistics["FIRMSTOTCZI"].to_numpy() > 0]
+    state["establishments"] = establishments
+    state["statistics"] = statistics
+    state["herfindahl"] = state["herfindahl"].loc[statistics.index]
+    index_incremental_state(state)
+
+
+def save_incremental_state(state: Dict[str, Any], directory: str) -> None:
+    """
+    Persist incremental state as one Parquet file per table in directory, after compacting it.
+    """
+    compact_incremental_state(state)
+    makedirs(directory, exist_ok=True)
+    for name in STATE_TABLES:
+        state[name].to_parquet(f"{directory}{name}.parquet", compression="zstd")
+
+
+def load_incremental_state(directory: str) -> Dict[str, Any]:
+    """
+    Load incremental state persisted by save_incremental_state().
+    """
+    return index_incremental_state(
+        {name: read_parquet(f"{directory}{name}.parquet") for name in STATE_TABLES}
+    )
+
+
+def get_establishments(state: Dict[str, Any], duns: ndarray) -> DataFrame:
+    """
+    Current establishments of D&B IDs in incremental state, found by hash lookups in the establishments table,
+    unless deleted, and among establishments inserted since the table was rebuilt. D&B IDs not found are left out.
+    """
+    establishments = state["establishments"]
+    deleted = state["deleted"]
+    rows = establishments.index.get_indexer(duns)
+    in_table = (rows >= 0) & array(
+        [id not in deleted for id in duns.tolist()], dtype=bool
+    )
+    return concat(
+        [
+            establishments.iloc[rows[in_table]],
+            get_inserted_establishments(
+                state, [id for id in duns.tolist() if id in state["inserted"]]
+            ),
+        ]
+    )
+
+
+def upsert_establishments(state: Dict[str, Any], df_upserts: DataFrame) -> None:
+    """
+    Write establishments of df_upserts, indexed by D&B ID, into incremental state: in place in the establishments
+    table for D&B IDs in it, otherwise among inserted establishments.
+    """
+    establishments = state["establishments"]
+    duns = df_upserts.index.to_numpy(dtype=int64)
+    rows = establishments.index.get_indexer(duns)
+    in_table = rows >= 0
+    for i, column in enumerate(ESTABLISHMENT_COLUMNS):
+        establishments.iloc[rows[in_table], i] = df_upserts[column].array[in_table]
+    state["deleted"].difference_update(duns[in_table].tolist())
+    state["inserted"].update(
+        zip(
+            duns[~in_table].tolist(),
+            df_upserts[~in_table].itertuples(index=False, name=None),
+        )
+    )
+
+
+def delete_establishments(state: Dict[str, Any], duns: ndarray) -> None:
+    """
+    Delete establishments of D&B IDs from incremental state, by marking them deleted in the establishments table,
+    or removing them from inserted establishments.
+    """
+    in_table = state["establishments"].index.get_indexer(duns) >= 0
+    state["deleted"].update(duns[in_table].tolist())
+    for id in duns[~in_table].tolist():
+        state["inserted"].pop(id, None)
+
+
+@instrument
+def apply_deltas(
+    state: Dict[str, Any], df_upserts: DataFrame, deletes: Iterable[int]
+) -> DataFrame:
+    """
+    Apply record-level deltas to incremental state without rescanning establishments:
+    inserts and updates of establishments keyed by D&B ID in df_upserts, and deletes of D&B IDs.
+    Contributions of previous records are subtracted from and new records added to statistics,
+    then Herfindahl Index is recomputed only for affected cells, which are the cells changed
+    and, since employee shares are by commuting zone, other cells in commuting zones whose total changed.
+    Sums of employees and sales are exact integers, so results match a full recomputation exactly.
+    Tables are updated in place by hash lookups and only new cells and commuting zones are appended,
+    so the cost is proportional to the deltas and affected cells rather than to the whole state.
+    Upserts with missing D&B IDs are skipped, and of duplicate D&B IDs the last is applied.
+    Returns Herfindahl Index of affected cells still present: CZONE, SIC, HHI_EMP, HHI_SALES.
+    """
+    df_upserts = drop_invalid_duns(df_upserts, keep="last")
+    df_upserts = df_upserts.set_index(
+        Index(df_upserts["DUNS"].to_numpy(dtype=int64), name="DUNS")
+    )[ESTABLISHMENT_COLUMNS]
+    upsert_duns = df_upserts.index.to_numpy()
+    delete_duns = unique(array(list(deletes), dtype=int64))
+    delete_duns = delete_duns[~isin(delete_duns, upsert_duns)]
+    df_removed = get_establishments(state, concatenate([upsert_duns, delete_duns]))
+    num_deletes = len(df_removed) - int(isin(df_removed.index, upsert_duns).sum())
+
+    df_deltas = concat(
+        [df_removed.assign(SIGN=-1), df_upserts.assign(SIGN=1)], ignore_index=True
+    )
+    employees = df_deltas["DEMTLHER"].to_numpy(dtype=int64, na_value=0)
+    sales = df_deltas["DSALESVO"].to_numpy(dtype=int64, na_value=0)
+    signs = df_deltas["SIGN"].to_numpy(dtype=int64)
+    df_deltas = DataFrame(
+        {
+            "KEY": get_cell_keys(df_deltas["CZONE"], df_deltas["DPRIMSI"]),
+            "CZONE": df_deltas["CZONE"],
+            "DPRIMSI": df_deltas["DPRIMSI"],
+            "FIRMSTOTCZI": signs,
+            "DEMTLHERTOTCZI": signs * employees,
+            "DEMTLHERSQTOTCZI": signs * employees.astype(float64) ** 2,
+            "DSALESVOTOTCZI": signs * sales,
+            "DSALESVOSQTOTCZI": signs * sales.astype(float64) ** 2,
+        }
+    )
+    df_cell_deltas = df_deltas.groupby("KEY").agg(
+        {
+            "CZONE": "first",
+            "DPRIMSI": "first",
+            **{column: "sum" for column in STATISTICS_COLUMNS},
+        }
+    )
+    df_czone_deltas = df_cell_deltas.groupby(
+        get_czone_keys(df_cell_deltas.index.to_numpy())
+    ).agg({"CZONE": "first", "DEMTLHERTOTCZI": "sum"})
+
+    # Update establishments by D&B ID
+    upsert_establishments(state, df_upserts)
+    delete_establishments(state, delete_duns)
+
+    # Update statistics of changed cells in place, appending new cells with zero statistics first,
+    # cells left without firms are kept until the state is compacted
+    statistics = state["statistics"]
+    new_keys = df_cell_deltas.index.difference(statistics.index)
+    if len(new_keys):
+        df_new = df_cell_deltas.loc[new_keys, ["CZONE", "DPRIMSI"]].astype(
+            statistics[["CZONE", "DPRIMSI"]].dtypes.to_dict()
+        )
+        for column in STATISTICS_COLUMNS:
+            df_new[column] = zeros(len(new_keys), dtype=statistics[column].dtype)
+        statistics = state["statistics"] = concat([statistics, df_new])
+        for key in new_keys.tolist():
+            state["czone_cells"].setdefault(key >> 16, []).append(key)
+    statistics.loc[df_cell_deltas.index, STATISTICS_COLUMNS] += df_cell_deltas[
+        STATISTICS_COLUMNS
+    ].astype(statistics[STATISTICS_COLUMNS].dtypes.to_dict())
+
+    # Update employees on location by commuting zone in place, appending new commuting zones
+    czones = state["czones"]
+    new_czone_keys = df_czone_deltas.index.difference(czones.index)
+    if len(new_czone_keys):
+        df_new = df_czone_deltas.loc[new_czone_keys, ["CZONE"]].astype(
+            czones[["CZONE"]].dtypes.to_dict()
+        )
+        df_new["DEMTLHERTOTCZ"] = zeros(len(new_czone_keys), dtype=int64)
+        czones = state["czones"] = concat([czones, df_new])
+    czones.loc[df_czone_deltas.index, "DEMTLHERTOTCZ"] += df_czone_deltas[
+        "DEMTLHERTOTCZI"
+    ].to_numpy(dtype=int64)
+
+    # Recompute Herfindahl Index of cells with firms in commuting zones whose cells changed
+    affected = Index(
+        [
+            key
+            for czone_key in df_czone_deltas.index.tolist()
+            for key in state["czone_cells"][czone_key]
+        ],
+        dtype=int64,
+    )
+    affected = affected[statistics.loc[affected, "FIRMSTOTCZI"].to_numpy() > 0]
+    df_affected = statistics.loc[affected].copy()
+    df_affected["DEMTLHERTOTCZ"] = czones.loc[
+        get_czone_keys(affected.to_numpy()), "DEMTLHERTOTCZ"
+    ].to_numpy()
+    df_herfindahl_affected = get_herfindahl_from_statistics(df_affected)
+    herfindahl = state["herfindahl"]
+    is_new = df_herfindahl_affected.index.isin(new_keys)
+    existing = df_herfindahl_affected.index[~is_new]
+    herfindahl.loc[existing, ["HHI_EMP", "HHI_SALES"]] = df_herfindahl_affected.loc[
+        existing, ["HHI_EMP", "HHI_SALES"]
+    ]
+    if is_new.any():
+        state["herfindahl"] = concat([herfindahl, df_herfindahl_affected[is_new]])
+
+    # Rebuild establishments table once changes since it was last rebuilt are a large enough fraction of it
+    if len(state["inserted"]) + len(state["deleted"]) > COMPACTION_FRACTION * len(
+        state["establishments"]
+    ):
+        compact_incremental_state(state)
+
+    print(
+        f"Applied {len(df_upserts)} upserts and {num_deletes} deletes.\n\t{len(affected)} cells recomputed.\n"
+    )
+    return df_herfindahl_affected.reset_index(drop=True)
+
+
+def get_incremental_herfindahl(state: Dict[str, Any]) -> DataFrame:
+    """
+    Herfindahl Index of all cells with firms in incremental state, sorted by commuting zone and industry
+    with missing codes last, as computed by get_herfindahl_from_statistics().
+    """
+    herfindahl = state["herfindahl"]
+    firms = state["statistics"]["FIRMSTOTCZI"].reindex(herfindahl.index)
+    return (
+        herfindahl[firms.to_numpy() > 0]
+        .sort_values(by=["CZONE", "SIC"], na_position="last")
+        .reset_index(drop=True)
+    )
+
+
+# Geographies and SIC depths of the concentration cube, from finest to coarsest
+CUBE_GEOGRAPHIES = ("FIPS", "CZONE", "STATE")
+CUBE_SIC_DIGITS = (4, 3, 2)
+
+
+def get_cube_statistics(df: DataFrame) -> DataFrame:
+    """
+    Accumulate sufficient statistics once at the finest grain of the cube: county, commuting zone and 4-digit industry.
+    Counties nest in commuting zones and states, and 4-digit industries in 3- and 2-digit industries,
+    so statistics of every coarser cell are sums of statistics of finest cells.
+    Returns DataFrame of FIPS, CZONE, DPRIMSI, FIRMS, and sums and sums of squares of DEMTLHER and DSALESVO.
+    """
+    cell_codes, _, df_statistics = get_market_cells(df, ("FIPS", "CZONE", "DPRIMSI"))
+    num_cells = len(df_statistics)
+    employees = df["DEMTLHER"].to_numpy(dtype=float64, na_value=0)
+    sales = df["DSALESVO"].to_numpy(dtype=float64, na_value=0)
+
+    df_statistics["FIRMS"] = bincount(cell_codes, minlength=num_cells)
+    df_statistics["DEMTLHER"] = bincount(
+        cell_codes, weights=employees, minlength=num_cells
+    ).astype(int64)
+    df_statistics["DEMTLHERSQ"] = bincount(
+        cell_codes, weights=employees**2, minlength=num_cells
+    )
+    df_statistics["DSALESVO"] = bincount(
+        cell_codes, weights=sales, minlength=num_cells
+    ).astype(int64)
+    df_statistics["DSALESVOSQ"] = bincount(
+        cell_codes, weights=sales**2, minlength=num_cells
+    )
+    print(
+        f"Computing cube statistics complete.\n\tDataFrame shape:{df_statistics.shape}.\n"
+    )
+    return df_statistics
+
+
+def rollup_herfindahl(
+    df_cube_statistics: DataFrame, geography: str = "CZONE", sic_digits: int = 4
+) -> DataFrame:
+    """
+    Roll cube statistics up to geography (FIPS, CZONE or STATE) and SIC depth (2, 3 or 4 digits),
+    and compute Herfindahl Index as get_herfindahl_from_statistics() does, without rescanning establishments.
+    Employee shares are by geography across all industries, sales shares by geography and industry.
+    Returns DataFrame of geography, SIC, HHI_EMP, HHI_SALES sorted with missing codes last.
+    """
+    if geography not in CUBE_GEOGRAPHIES or sic_digits not in CUBE_SIC_DIGITS:
+        raise ValueError(
+            f"Cube is defined for geographies {CUBE_GEOGRAPHIES} and SIC digits {CUBE_SIC_DIGITS}."
+        )
+    df = df_cube_statistics.assign(
+        STATE=df_cube_statistics["FIPS"] // 1000,
+        SIC=df_cube_statistics["DPRIMSI"] // 10 ** (4 - sic_digits),
+    )
+    df_cells = (
+        df.groupby([geography, "SIC"], sort=True, dropna=False)[
+            ["FIRMS", "DEMTLHER", "DSALESVO"]
+        ]
+        .sum()
+        .reset_index()
+    )
+    geography_employees = (
+        df_cells.groupby(geography, sort=False, dropna=False)["DEMTLHER"]
+        .transform("sum")
+        .to_numpy()
+    )
+    firms = df_cells["FIRMS"].to_numpy()
+    employees = df_cells["DEMTLHER"].to_numpy()
+    sales = df_cells["DSALESVO"].to_numpy()
+
+    df_herfindahl = df_cells[[geography, "SIC"]].copy()
+    df_herfindahl["HHI_EMP"] = get_ratio(employees, geography_employees) / firms
+    df_herfindahl["HHI_SALES"] = get_ratio(sales, sales) / firms
+    return df_herfindahl
+
+
+@instrument
+def get_concentration_cube(
+    df: DataFrame,
+    geographies: Iterable[str] = CUBE_GEOGRAPHIES,
+    sic_digits: Iterable[int] = CUBE_SIC_DIGITS,
+) -> Dict[Tuple[str, int], DataFrame]:
+    """
+    Compute Herfindahl Index for every requested combination of geography and SIC depth in a single run,
+    scanning establishments once in get_cube_statistics() and rolling statistics up for each combination.
+    Returns dictionary of Herfindahl datasets keyed by (geography, SIC digits).
+    """
+    df_cube_statistics = get_cube_statistics(df)
+    cube = {
+        (geography, digits): rollup_herfindahl(df_cube_statistics, geography, digits)
+        for geography in geographies
+        for digits in sic_digits
+    }
+    print(f"Computing Herfindahl Index cube complete.\n\t{len(cube)} datasets.\n")
+    return cube
+
+
+# Variables whose concentration is measured, and labels of their measure columns
+CONCENTRATION_VARIABLES = {"DEMTLHER": "EMP", "DSALESVO": "SALES"}
+
+# Concentration measures computed by get_concentration_measures(), where CRk is any concentration ratio of top k firms
+CONCENTRATION_MEASURES = ("HHI_SQ", "CR4", "CR8", "ENTROPY", "THEIL", "GINI")
+
+
+def get_concentration_ratio_k(measure: str) -> int:
+    """
+    Number of top firms k of concentration ratio measure CRk, e.g. 4 for CR4.
+    Raises ValueError if measure isn't in CONCENTRATION_MEASURES or a concentration ratio.
+    """
+    if measure.startswith("CR") and measure[2:].isdigit() and int(measure[2:]) > 0:
+        return int(measure[2:])
+    if measure not in CONCENTRATION_MEASURES:
+        raise ValueError(
+            f"Measures must be among {CONCENTRATION_MEASURES} or CRk for any k."
+        )
+    return 0
+
+
+def get_sorted_shares(
+    values: ndarray, cell_codes: ndarray, num_cells: int
+) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+    """
+    Sort establishments once by cell and by descending value within cell, and compute their shares of the cell total,
+    where shares of cells with a zero total are zero.
+    Returns cell of each sorted establishment, its share, its 0-based rank within cell, and number of firms by cell.
+    This lower-level function is called in get_concentration_measures().
+    """
+    order = lexsort((-values, cell_codes))
+    cells = cell_codes[order]
+    firms = bincount(cell_codes, minlength=num_cells)
+    totals = bincount(cell_codes, weights=values, minlength=num_cells)
+    shares = get_ratio(values[order], totals[cells])
+    starts = cumsum(firms) - firms
+    ranks = arange(len(cells)) - starts[cells]
+    return cells, shares, ranks, firms
+
+
+@instrument
+def get_concentration_measures(
+    df: DataFrame,
+    measures: Iterable[str] = CONCENTRATION_MEASURES,
+    variables: Iterable[str] = tuple(CONCENTRATION_VARIABLES),
+) -> DataFrame:
+    """
+    Compute concentration measures of employees on location and sales by commuting zone and industry,
+    from shares of each firm in its cell sorted once per variable, with segmented sums over cells by bincount:
+    1. HHI_SQ: Herfindahl-Hirschman Index, the sum of squared shares.
+    2. CRk, e.g. CR4 and CR8: concentration ratio, the sum of shares of the k largest firms.
+    3. ENTROPY: Theil entropy, minus the sum of shares times log shares, 0 for a monopoly.
+    4. THEIL: Theil index, log of number of firms minus entropy, 0 for firms of equal size.
+    5. GINI: Gini coefficient of firm sizes, 0 for firms of equal size.
+    -----------------------------
+    NB: unlike HHI_EMP of get_herfindahl_from_statistics(), shares of both variables are of the cell total.
+        Missing employees and sales count as zero, and cells with a zero total have zero for every measure.
+
+    Returns one wide DataFrame of CZONE, SIC and a column per variable and measure,
+    e.g. HHI_SQ_EMP, CR4_EMP, ..., GINI_SALES, sorted by CZONE and SIC with missing codes last.
+    """
+    measures = list(measures)
+    ks = [get_concentration_ratio_k(measure) for measure in measures]
+    cell_codes, _, df_cells = get_market_cells(df)
+    num_cells = len(df_cells)
+    df_measures = df_cells.rename(columns={"DPRIMSI": "SIC"})
+
+    for variable in variables:
+        values = df[variable].to_numpy(dtype=float64, na_value=0)
+        cells, shares, ranks, firms = get_sorted_shares(values, cell_codes, num_cells)
+        positive = bincount(cells, weights=shares, minlength=num_cells) > 0
+        entropy = bincount(
+            cells,
+            weights=-shares * log(shares, out=zeros(len(shares)), where=shares > 0),
+            minlength=num_cells,
+        )
+        columns = {}
+        for measure, k in zip(measures, ks):
+            if measure == "HHI_SQ":
+                columns[measure] = bincount(
+                    cells, weights=shares**2, minlength=num_cells
+                )
+            elif k:
+                columns[measure] = bincount(
+                    cells, weights=shares * (ranks < k), minlength=num_cells
+                )
+            elif measure == "ENTROPY":
+                columns[measure] = entropy
+            elif measure == "THEIL":
+                columns[measure] = (log(firms) - entropy) * positive
+            elif measure == "GINI":
+                # Gini of sizes sorted ascending, where ascending position is firms minus descending rank:
+                # 2 * sum of position times share / firms - (firms + 1) / firms
+                weighted = bincount(
+                    cells, weights=shares * (firms[cells] - ranks), minlength=num_cells
+                )
+                columns[measure] = (2 * weighted - firms - 1) / firms * positive
+        for measure in measures:
+            df_measures[
+                f"{measure}_{CONCENTRATION_VARIABLES.get(variable, variable)}"
+            ] = columns[measure]
+    print(
+        f"Computing concentration measures complete.\n\tDataFrame shape:{df_measures.shape}.\n"
+    )
+    return df_measures
@@ -3,20 +3,56 @@ D_AND_B_DIR = "D&B/"
 D_AND_B_TEXT = f"{D_AND_B_DIR}MGNTFIS3.I9Q5VOQI.DMI.1990.TXT"
 D_AND_B_CSV = f"{D_AND_B_DIR}MGNTFIS3.I9Q5VOQI.DMI.1990.csv"
 D_AND_B_STATA = f"{D_AND_B_DIR}MGNTFIS3.I9Q5VOQI.DMI.1990.dta"
+D_AND_B_PARQUET = f"{D_AND_B_DIR}MGNTFIS3.I9Q5VOQI.DMI.1990.parquet"
+D_AND_B_RECORDS_DIR = f"{D_AND_B_DIR}d_and_b_records/"
+D_AND_B_PROCESSED_PARQUET = f"{D_AND_B_DIR}d_and_b_processed.parquet"
+PIPELINE_ZIP_CACHE_JSON = f"{D_AND_B_DIR}pipeline_zip_cache.json"
+PIPELINE_GEOCODE_CACHE_JSON = f"{D_AND_B_DIR}pipeline_geocode_cache.json"
+D_AND_B_PARTITIONS_DIR = f"{D_AND_B_DIR}d_and_b_partitions/"
+D_AND_B_PANEL_PATTERN = f"{D_AND_B_DIR}*.DMI.*.TXT"
 GEOCODED_RESPONSES_JSON = f"{D_AND_B_DIR}d_and_b_geocoded.json"
 GEOCODED_RESPONSES_TEXT = f"{D_AND_B_DIR}d_and_b_geocoded.txt"
+GEOCODED_SHARDS_DIR = f"{D_AND_B_DIR}geocoded_shards/"
+GEOCODE_CACHE_DB = f"{D_AND_B_DIR}d_and_b_geocode_cache.sqlite"
 D_AND_B_FIPS_CSV = f"{D_AND_B_DIR}d_and_b_fips.csv"
 D_AND_B_FIPS_STATA = f"{D_AND_B_DIR}d_and_b_fips.dta"
+D_AND_B_FIPS_PARQUET = f"{D_AND_B_DIR}d_and_b_fips.parquet"
 CZONE_DIR = "commuting_zones/"
 CZONE_CSV = f"{CZONE_DIR}cw_cty_czone.csv"
+CZONE_PARQUET = f"{CZONE_DIR}cw_cty_czone.parquet"
 MAPPING_DIR = "mapping/"
 D_AND_B_CZONE_CSV = f"{MAPPING_DIR}d_and_b_czone_mapping.csv"
 D_AND_B_CZONE_STATA = f"{MAPPING_DIR}d_and_b_czone_mapping.dta"
+D_AND_B_CZONE_PARQUET = f"{MAPPING_DIR}d_and_b_czone_mapping.parquet"
+ZIP_LOOKUP_NPY = f"{MAPPING_DIR}zip_czone_lookup.npy"
+ZIP_COUNTY_LOOKUP_NPY = f"{MAPPING_DIR}zip_county_lookup.npy"
 MARKET_DIR = "market_concentration/"
 D_AND_B_ANALYSIS_CSV = f"{MARKET_DIR}d_and_b_czone.csv"
 D_AND_B_ANALYSIS_STATA = f"{MARKET_DIR}d_and_b_czone.dta"
+D_AND_B_ANALYSIS_PARQUET = f"{MARKET_DIR}d_and_b_czone.parquet"
 D_AND_B_COMPLETE_CSV = f"{MARKET_DIR}d_and_b_complete.csv"
 D_AND_B_COMPLETE_STATA = f"{MARKET_DIR}d_and_b_complete.dta"
+D_AND_B_COMPLETE_PARQUET = f"{MARKET_DIR}d_and_b_complete.parquet"
+D_AND_B_COMPLETE_PARTITIONS_DIR = f"{MARKET_DIR}d_and_b_complete_partitions/"
 D_AND_B_HERFINDAHL_CSV = f"{MARKET_DIR}d_and_b_herfindahl.csv"
 D_AND_B_HERFINDAHL_STATA = f"{MARKET_DIR}d_and_b_herfindahl.dta"
+D_AND_B_HERFINDAHL_PARQUET = f"{MARKET_DIR}d_and_b_herfindahl.parquet"
+D_AND_B_BOOTSTRAP_CSV = f"{MARKET_DIR}d_and_b_herfindahl_bootstrap.csv"
+D_AND_B_BOOTSTRAP_STATA = f"{MARKET_DIR}d_and_b_herfindahl_bootstrap.dta"
+D_AND_B_BOOTSTRAP_PARQUET = f"{MARKET_DIR}d_and_b_herfindahl_bootstrap.parquet"
+D_AND_B_MEASURES_PARQUET = f"{MARKET_DIR}d_and_b_concentration_measures.parquet"
+HHI_STATE_DIR = f"{MARKET_DIR}hhi_state/"
+D_AND_B_CUBE_PATTERN = f"{MARKET_DIR}d_and_b_herfindahl_{{geography}}_sic{{digits}}"
+D_AND_B_PANEL_CSV = f"{MARKET_DIR}d_and_b_herfindahl_panel.csv"
+D_AND_B_PANEL_STATA = f"{MARKET_DIR}d_and_b_herfindahl_panel.dta"
+D_AND_B_PANEL_PARQUET = f"{MARKET_DIR}d_and_b_herfindahl_panel.parquet"
 ZIP_CODE_CSV = "zips/ZipCodesDeluxe2009.csv"
+BENCHMARK_DIR = "benchmarks/"
+METRICS_ZIP_JSON = "log/metrics_zip.json"
+METRICS_GEOCODE_JSON = "log/metrics_geocode.json"
+
+# Census Geocoder endpoints
+GEOCODER_ADDRESS_URL = "https://geocoding.geo.census.gov/geocoder/geographies/address"
+GEOCODER_BATCH_URL = (
+    "https://geocoding.geo.census.gov/geocoder/geographies/addressbatch"
+)
@@ -0,0 +1,604 @@
+from pandas import DataFrame
+from numpy import frombuffer, int8, int32, int64
+from aiohttp import (
+    ClientSession,
+    ClientConnectionError,
+    ClientResponseError,
+    ClientTimeout,
+    TCPConnector,
+    FormData,
+)
+
+from asyncio import run, gather, sleep, Semaphore, Condition
+from asyncio import TimeoutError as AsyncTimeoutError
+from array import array
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+from csv import reader, writer
+from io import StringIO
+from contextlib import closing
+from json import dumps, loads
+from time import time, time_ns, monotonic
+from os import makedirs, replace, listdir
+import gzip
+import sqlite3
+
+from config import GEOCODER_ADDRESS_URL, GEOCODER_BATCH_URL
+from utils import (
+    apply_schema,
+    extract_fips,
+    get_match_count,
+    is_retryable_status,
+    get_retry_backoff,
+)
+from instrumentation import instrument, record_latency
+
+# Query parameters of US Census Geocoder shared by all requests
+GEOCODER_PARAMETERS = {
+    "benchmark": "Public_AR_Census2020",
+    "vintage": "Census2020_Census2020",
+    "layers": "82",
+    "format": "json",
+}
+
+
+class RateController:
+    """
+    Rate limiter and concurrency controller shared by all requests to US Census Geocoder.
+    A token bucket caps requests per second at rate, with bursts of up to burst requests.
+    The limit on requests in flight is adjusted AIMD-style: it grows by about one per round of successful requests,
+    and is halved at most once per round on throttling (429), server errors (5xx), timeouts,
+    or responses slower than latency_target seconds.
+    """
+
+    def __init__(
+        self,
+        rate: float = 100,
+        burst: int = 100,
+        max_in_flight: int = 64,
+        initial_in_flight: int = 8,
+        latency_target: float = 10,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.limit = float(min(initial_in_flight, max_in_flight))
+        self.latency_target = latency_target
+        self.tokens = float(burst)
+        self.updated = monotonic()
+        self.decreased = 0.0
+        self.in_flight = 0
+        self.throttled = 0
+        self.condition = Condition()
+
+    async def acquire(self) -> float:
+        """
+        Wait for a free slot under the in-flight limit and a token from the bucket.
+        Returns start time of request.
+        """
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        while True:
+            now = monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return now
+            await sleep((1 - self.tokens) / self.rate)
+
+    async def release(self, start: float, throttled: bool) -> None:
+        """
+        Free slot of request started at start, and adjust in-flight limit on its outcome.
+        """
+        now = monotonic()
+        async with self.condition:
+            self.in_flight -= 1
+            if throttled or now - start > self.latency_target:
+                self.throttled += 1
+                if start > self.decreased:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.decreased = now
+            else:
+                self.limit = min(self.max_in_flight, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+async def get_data_async(
+    session: ClientSession,
+    controller: RateController,
+    url: str,
+    params: Dict[str, str],
+) -> Dict[str, Dict[str, str]]:
+    """
+    Send HTTP GET request over pooled keep-alive connection of session, paced by controller.
+    Throttled requests (429), server errors (5xx), timeouts, connection errors and malformed JSON are retried
+    after jittered exponential backoff, honouring Retry-After, while other client errors fail at once.
+    This lower-level function is called by geocode_worker().
+    """
+    for attempt in range(10):
+        start = await controller.acquire()
+        throttled, retry_after = False, None
+        try:
+            async with session.get(url, params=params) as response:
+                throttled = is_retryable_status(response.status)
+                retry_after = response.headers.get("Retry-After")
+                response.raise_for_status()
+                return await response.json(content_type=None)
+        except ClientResponseError as e:
+            if not throttled:
+                print(f"Request failed with exception: {str(e)}. Not retrying.\n")
+                return {"error": f"Request failed with status {e.status}."}
+            print(f"Attempt failed with exception: {str(e)}. Retrying...\n")
+        except (ClientConnectionError, AsyncTimeoutError, ValueError) as e:
+            throttled = isinstance(e, AsyncTimeoutError)
+            print(f"Attempt failed with exception: {str(e)}. Retrying...\n")
+        finally:
+            record_latency("geocoder_request", monotonic() - start)
+            await controller.release(start, throttled)
+        await sleep(
+            get_retry_backoff(attempt, retry_after)
+        )  # wait with jittered backoff before trying again
+    return {"error": "Unable to fetch data after 10 attempts."}
+
+
+async def geocode_worker(
+    session: ClientSession,
+    controller: RateController,
+    records: Iterator[Dict[str, str]],
+    results: Dict[str, Dict[str, str]],
+    url: str,
+) -> None:
+    """
+    Take records from shared iterator and geocode them one at a time until it's exhausted.
+    The number of workers caps the number of requests in flight, below which controller adapts the limit.
+    This lower-level function is called in geocode_records().
+    """
+    for record in records:
+        if record["DSTREET"] is not None:
+            params = {
+                "street": record["DSTREET"],
+                "city": record["DCITY"],
+                "state": record["DSTATEAB"],
+                "zip": record["DZIP5"],
+                **GEOCODER_PARAMETERS,
+            }
+            results[record["DUNS"]] = await get_data_async(
+                session, controller, url, params
+            )
+
+
+async def geocode_records(
+    data: List[Dict[str, str]],
+    controller: RateController,
+    timeout: float,
+    url: str,
+) -> Dict[str, Dict[str, str]]:
+    """
+    Geocode records with as many concurrent workers as controller's maximum requests in flight sharing one session,
+    whose connector pools and reuses keep-alive connections. Each request times out after timeout seconds.
+    """
+    results = {}
+    records = iter(data)
+    connector = TCPConnector(limit=controller.max_in_flight)
+    async with ClientSession(
+        connector=connector, timeout=ClientTimeout(total=timeout)
+    ) as session:
+        await gather(
+            *(
+                geocode_worker(session, controller, records, results, url)
+                for _ in range(controller.max_in_flight)
+            )
+        )
+    return results
+
+
+@instrument
+def async_geocode_data(
+    data: List[Dict[str, str]],
+    max_in_flight: int = 64,
+    rate: float = 100,
+    timeout: float = 30,
+    url: str = GEOCODER_ADDRESS_URL,
+) -> Dict[str, Dict[str, str]]:
+    """
+    Drop-in alternative to multi_geocode_data() which sends requests to US Census Geocoder from a single event loop,
+    keeping up to max_in_flight requests in flight over pooled keep-alive connections,
+    instead of one blocking request at a time per core.
+    Requests are paced by a RateController at up to rate requests per second,
+    which lowers the requests in flight when the geocoder throttles or slows down.
+    Each request times out after timeout seconds, and url can point to a local stand-in server.
+    """
+    controller = RateController(rate=rate, burst=int(rate), max_in_flight=max_in_flight)
+    results = run(geocode_records(data, controller, timeout, url))
+
+    print(
+        f"Geocoding complete for {len(results)} observations.\n\t{controller.throttled} throttled or slow responses, final in-flight limit {controller.limit:.1f}.\n"
+    )
+
+    return results
+
+
+def get_batch_csv(records: List[Dict[str, str]]) -> str:
+    """
+    Pack records into Census batch geocoding CSV format without header:
+    unique ID, street address, city, state and ZIP code, where D&B ID is the unique ID.
+    """
+    buffer = StringIO()
+    csv_writer = writer(buffer)
+    for record in records:
+        if record["DSTREET"] is not None:
+            csv_writer.writerow(
+                [
+                    record["DUNS"],
+                    record["DSTREET"],
+                    record["DCITY"],
+                    record["DSTATEAB"],
+                    record["DZIP5"],
+                ]
+            )
+    return buffer.getvalue()
+
+
+def parse_batch_response(text: str) -> Dict[str, Dict[str, str]]:
+    """
+    Parse Census batch geocoding CSV response into responses keyed by unique ID, shaped like responses
+    of the single address endpoint, so they are cached and extracted with extract_fips() alike.
+    Rows are: ID, input address, match indicator, match type, matched address, coordinates,
+    TIGER line ID, side, state code, county code, tract and block. Matched rows have one address match
+    with the state and county code, unmatched and tied rows have none.
+    """
+    results = {}
+    for row in reader(StringIO(text)):
+        if len(row) >= 10 and row[2] == "Match":
+            matches = [
+                {
+                    "matchedAddress": row[4],
+                    "geographies": {"Counties": [{"STATE": row[8], "COUNTY": row[9]}]},
+                }
+            ]
+        elif len(row) >= 3:
+            matches = []
+        else:
+            continue
+        results[row[0]] = {"result": {"addressMatches": matches}}
+    return results
+
+
+async def post_batch_async(
+    session: ClientSession, url: str, batch_csv: str
+) -> Dict[str, Dict[str, str]]:
+    """
+    Upload batch of addresses as multipart form file and parse CSV response.
+    This lower-level function is called by geocode_batch().
+    """
+    for attempt in range(10):
+        form = FormData()
+        form.add_field(
+            "addressFile",
+            batch_csv.encode(),
+            filename="addresses.csv",
+            content_type="text/csv",
+        )
+        form.add_field("benchmark", GEOCODER_PARAMETERS["benchmark"])
+        form.add_field("vintage", GEOCODER_PARAMETERS["vintage"])
+        form.add_field("layers", GEOCODER_PARAMETERS["layers"])
+        start = monotonic()
+        retry_after = None
+        try:
+            async with session.post(url, data=form) as response:
+                retry_after = response.headers.get("Retry-After")
+                response.raise_for_status()
+                return parse_batch_response(await response.text())
+        except ClientResponseError as e:
+            if not is_retryable_status(e.status):
+                print(f"Batch failed with exception: {str(e)}. Not retrying.\n")
+                return {}
+            print(f"Batch attempt failed with exception: {str(e)}. Retrying...\n")
+        except (ClientConnectionError, AsyncTimeoutError) as e:
+            print(f"Batch attempt failed with exception: {str(e)}. Retrying...\n")
+        finally:
+            record_latency("geocoder_batch_request", monotonic() - start)
+        await sleep(
+            get_retry_backoff(attempt, retry_after)
+        )  # wait with jittered backoff before trying again
+    print("Unable to geocode batch after 10 attempts.\n")
+    return {}
+
+
+async def geocode_batch(
+    session: ClientSession, semaphore: Semaphore, url: str, batch_csv: str
+) -> Dict[str, Dict[str, str]]:
+    """
+    Upload batch once semaphore allows another batch in flight.
+    This lower-level function is called in geocode_batches().
+    """
+    async with semaphore:
+        return await post_batch_async(session, url, batch_csv)
+
+
+async def geocode_batches(
+    batches: List[str], max_in_flight: int, timeout: float, url: str
+) -> List[Dict[str, Dict[str, str]]]:
+    """
+    Submit batches in parallel, with at most max_in_flight batches uploading at any time.
+    """
+    semaphore = Semaphore(max_in_flight)
+    connector = TCPConnector(limit=max_in_flight)
+    async with ClientSession(
+        connector=connector, timeout=ClientTimeout(total=timeout)
+    ) as session:
+        return await gather(
+            *(
+                geocode_batch(session, semaphore, url, batch_csv)
+                for batch_csv in batches
+            )
+        )
+
+
+@instrument
+def batch_geocode_data(
+    data: List[Dict[str, str]],
+    batch_size: int = 10000,
+    max_in_flight: int = 4,
+    timeout: float = 1800,
+    url: str = GEOCODER_BATCH_URL,
+) -> Dict[str, Dict[str, str]]:
+    """
+    Geocode records with US Census batch geocoder, which accepts up to 10,000 addresses per uploaded file,
+    instead of one GET request per establishment. Batches of batch_size records are submitted in parallel.
+    Returns responses keyed by D&B ID, as async_geocode_data() does, so it can be used as geocode
+    of cached_geocode_data(), and D&B IDs and FIPS codes are extracted with extract_dandbid_fips().
+    """
+    batches = [
+        get_batch_csv(data[i : i + batch_size]) for i in range(0, len(data), batch_size)
+    ]
+    results = run(geocode_batches(batches, max_in_flight, timeout, url))
+    results = {k: v for batch_results in results for k, v in batch_results.items()}
+
+    print(f"Batch geocoding complete for {len(results)} observations.\n")
+
+    return results
+
+
+def normalize_address(record: Dict[str, str]) -> str:
+    """
+    Normalize street address, city, state abbreviation and ZIP code of record into cache key,
+    upper-casing and collapsing whitespace so equivalent spellings share one key.
+    """
+    return "|".join(
+        " ".join(str(record[column]).upper().split())
+        for column in ["DSTREET", "DCITY", "DSTATEAB", "DZIP5"]
+    )
+
+
+def open_geocode_cache(file_path: str) -> sqlite3.Connection:
+    """
+    Open SQLite geocode cache, creating table of responses keyed by normalized address if needed.
+    """
+    connection = sqlite3.connect(file_path)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS geocodes (address TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)"
+    )
+    return connection
+
+
+def read_geocode_cache(
+    connection: sqlite3.Connection, addresses: List[str], ttl: Optional[float]
+) -> Dict[str, Dict[str, str]]:
+    """
+    Look up cached responses of addresses, in chunks within SQLite's limit on query parameters.
+    Responses older than ttl seconds are treated as misses.
+    """
+    oldest = time() - ttl if ttl is not None else 0
+    responses = {}
+    for i in range(0, len(addresses), 900):
+        chunk = addresses[i : i + 900]
+        rows = connection.execute(
+            f"SELECT address, response FROM geocodes WHERE created >= ? AND address IN ({', '.join('?' * len(chunk))})",
+            [oldest, *chunk],
+        )
+        responses.update((address, loads(response)) for address, response in rows)
+    return responses
+
+
+def evict_geocode_cache(
+    connection: sqlite3.Connection,
+    ttl: Optional[float] = None,
+    max_entries: Optional[int] = None,
+) -> None:
+    """
+    Delete responses older than ttl seconds, then oldest responses beyond max_entries.
+    """
+    if ttl is not None:
+        connection.execute("DELETE FROM geocodes WHERE created < ?", [time() - ttl])
+    if max_entries is not None:
+        connection.execute(
+            "DELETE FROM geocodes WHERE address NOT IN (SELECT address FROM geocodes ORDER BY created DESC LIMIT ?)",
+            [max_entries],
+        )
+    connection.commit()
+
+
+@instrument
+def cached_geocode_data(
+    data: List[Dict[str, str]],
+    cache_path: str,
+    geocode: Callable = async_geocode_data,
+    ttl: Optional[float] = None,
+    max_entries: Optional[int] = None,
+    **kwargs,
+) -> Dict[str, Dict[str, str]]:
+    """
+    Geocode records through persistent cache keyed by normalized address.
+    Records are deduplicated by address first, so establishments sharing an address are geocoded once,
+    and only addresses missing from cache are sent to geocode, e.g. async_geocode_data() or multi_geocode_data(),
+    called with kwargs. Successful responses are stored in cache, then evicted according to ttl and max_entries.
+    Returns responses keyed by D&B ID, as geocode does.
+    """
+    duns_by_address = {}
+    records_by_address = {}
+    for record in data:
+        if record["DSTREET"] is not None:
+            address = normalize_address(record)
+            duns_by_address.setdefault(address, []).append(record["DUNS"])
+            records_by_address.setdefault(address, {**record, "DUNS": address})
+
+    with closing(open_geocode_cache(cache_path)) as connection:
+        responses = read_geocode_cache(connection, list(duns_by_address), ttl)
+        misses = [
+            record
+            for address, record in records_by_address.items()
+            if address not in responses
+        ]
+        print(
+            f"Geocode cache:\n\t{len(duns_by_address)} unique addresses for {len(data)} observations."
+            f"\n\t{len(responses)} hits, {len(misses)} misses.\n"
+        )
+        if misses:
+            new_responses = geocode(misses, **kwargs)
+            created = time()
+            connection.executemany(
+                "INSERT OR REPLACE INTO geocodes (address, response, created) VALUES (?, ?, ?)",
+                [
+                    (address, dumps(response), created)
+                    for address, response in new_responses.items()
+                    if "error" not in response
+                ],
+            )
+            connection.commit()
+            responses.update(new_responses)
+        evict_geocode_cache(connection, ttl, max_entries)
+
+    return {
+        duns: responses[address]
+        for address, duns_list in duns_by_address.items()
+        if address in responses
+        for duns in duns_list
+    }
+
+
+def get_shard_record(
+    duns: str, response: Dict[str, str], keep_raw: bool = False
+) -> Dict[str, Any]:
+    """
+    Compact shard record of response: D&B ID, FIPS code of first address match or None if not matched,
+    and match quality, the number of address matches or -1 if request failed, with raw response only if keep_raw.
+    """
+    record = {
+        "DUNS": duns,
+        "FIPS": extract_fips(response),
+        "MATCHES": get_match_count(response),
+    }
+    if keep_raw:
+        record["response"] = response
+    return record
+
+
+def write_shard(
+    shard_dir: str, responses: Dict[str, Dict[str, str]], keep_raw: bool = False
+) -> None:
+    """
+    Write responses to new gzip-compressed JSONL shard, one compact record of get_shard_record() per line.
+    Shard is written to temporary file and then renamed, so a crash never leaves a partial shard.
+    """
+    shard_path = f"{shard_dir}shard-{time_ns()}.jsonl.gz"
+    with gzip.open(f"{shard_path}.tmp", "wt") as shard:
+        for duns, response in responses.items():
+            shard.write(f"{dumps(get_shard_record(duns, response, keep_raw))}\n")
+    replace(f"{shard_path}.tmp", shard_path)
+
+
+def iter_shards(shard_dir: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield compact record of each response in shards, reading one line at a time.
+    Lines of raw responses, as written by earlier versions, are converted to compact records.
+    """
+    for file_name in sorted(listdir(shard_dir)):
+        if file_name.endswith(".jsonl.gz"):
+            with gzip.open(f"{shard_dir}{file_name}", "rt") as shard:
+                for line in shard:
+                    record = loads(line)
+                    if "MATCHES" not in record:
+                        record = get_shard_record(record["DUNS"], record["response"])
+                    yield record
+
+
+def read_completed_duns(shard_dir: str) -> Set[str]:
+    """
+    Read D&B IDs with successful responses in shards of previous runs,
+    records whose requests failed after all attempts are geocoded again.
+    """
+    return {
+        record["DUNS"] for record in iter_shards(shard_dir) if record["MATCHES"] >= 0
+    }
+
+
+@instrument
+def stream_geocode_data(
+    data: List[Dict[str, str]],
+    shard_dir: str,
+    cache_path: Optional[str] = None,
+    chunk_size: int = 10000,
+    keep_raw: bool = False,
+    **kwargs,
+) -> None:
+    """
+    Geocode records in chunks of chunk_size with async_geocode_data() called with kwargs,
+    through persistent geocode cache if cache_path is given, and stream each chunk's responses to a new shard,
+    so only one chunk of responses is kept in memory and a crash loses at most one chunk.
+    FIPS codes and match quality are extracted from each chunk as it arrives, and shards hold only
+    these compact records, with raw responses only if keep_raw is True.
+    D&B IDs completed in shards of previous runs are skipped, so rerunning resumes where a run stopped.
+    Records without D&B ID, which couldn't be told apart in shards, are skipped.
+    """
+    makedirs(shard_dir, exist_ok=True)
+    completed = read_completed_duns(shard_dir)
+    pending = [
+        record
+        for record in data
+        if record["DSTREET"] is not None
+        and record["DUNS"]
+        and record["DUNS"] not in completed
+    ]
+    print(
+        f"Streaming geocoding:\n\t{len(completed)} observations completed in previous runs, {len(pending)} pending.\n"
+    )
+    for i in range(0, len(pending), chunk_size):
+        chunk = pending[i : i + chunk_size]
+        if cache_path is not None:
+            responses = cached_geocode_data(chunk, cache_path, **kwargs)
+        else:
+            responses = async_geocode_data(chunk, **kwargs)
+        write_shard(shard_dir, responses, keep_raw)
+
+
+@instrument
+def extract_shards_fips(shard_dir: str) -> DataFrame:
+    """
+    Read compact records of shards, one record at a time, into packed arrays of D&B IDs, FIPS codes and match quality,
+    so memory grows by 13 bytes per record rather than by a response.
+    Returns DataFrame with columns DUNS, FIPS (missing if not matched) and MATCHES,
+    with one row per D&B ID, the last geocoded, skipping records without D&B ID.
+    """
+    duns, fips, matches = array("q"), array("i"), array("b")
+    for record in iter_shards(shard_dir):
+        if record["DUNS"] and record["DUNS"].isdigit():
+            duns.append(int(record["DUNS"]))
+            fips.append(int(record["FIPS"] or -1))
+            matches.append(record["MATCHES"])
+    df = DataFrame(
+        {
+            "DUNS": frombuffer(duns, dtype=int64),
+            "FIPS": frombuffer(fips, dtype=int32),
+            "MATCHES": frombuffer(matches, dtype=int8),
+        }
+    ).drop_duplicates(subset="DUNS", keep="last", ignore_index=True)
+    df["FIPS"] = df["FIPS"].mask(df["FIPS"] < 0)
+    df = apply_schema(df)
+    print(
+        f"Extracting complete.\n\t{df['FIPS'].notna().sum()} of {len(df)} observations mapped to FIPS.\n"
+    )
+    return df
@@ -0,0 +1,275 @@
+from pandas import DataFrame
+from numpy import ndarray, searchsorted
+
+from contextlib import contextmanager
+from functools import wraps
+from json import dump
+from os import getpid, makedirs, register_at_fork, scandir, sysconf
+from os.path import dirname
+from threading import Condition, Lock, Thread
+from time import perf_counter, process_time, sleep
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Upper bounds in seconds of latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+# Metrics recorded in this process: measurements of each call of instrumented functions by name,
+# latency histograms by name, and counts by name
+METRICS: Dict[str, Dict[str, Any]] = {"functions": {}, "latencies": {}, "counts": {}}
+METRICS_LOCK = Lock()
+
+
+# Interval in seconds between samples of resident memory by the sampler thread of measure()
+SAMPLE_SECONDS = 0.01
+
+# Peak resident memory of each open measure() scope by id, raised by one sampler thread per process
+# shared by all scopes, including nested ones, which waits while no scope is open
+SAMPLER: Dict[str, Any] = {"peaks": {}, "thread": None}
+SAMPLER_CONDITION = Condition()
+
+
+def read_statm(pid: str) -> List[int]:
+    """
+    Resident and shared memory in pages of process pid from /proc.
+    """
+    with open(f"/proc/{pid}/statm", "r") as file:
+        return [int(field) for field in file.read().split()[1:3]]
+
+
+def get_child_pids() -> List[str]:
+    """
+    IDs of child processes of this process, such as pool workers, found by parent ID in /proc
+    rather than with multiprocessing.active_children(), which reaps finished children as a side effect.
+    """
+    pid = str(getpid())
+    child_pids = []
+    for entry in scandir("/proc"):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry.name}/stat", "r") as file:
+                fields = file.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if fields[1] == pid:
+            child_pids.append(entry.name)
+    return child_pids
+
+
+def get_memory() -> Optional[int]:
+    """
+    Resident memory in bytes of this process, plus memory not shared with it of its child processes,
+    such as pool workers parsing byte ranges. Read from /proc, so None if not on Linux.
+    """
+    try:
+        resident, _ = read_statm("self")
+    except OSError:
+        return None
+    for child_pid in get_child_pids():
+        try:
+            child_resident, child_shared = read_statm(child_pid)
+            resident += child_resident - child_shared
+        except (OSError, ValueError):
+            continue
+    return resident * sysconf("SC_PAGE_SIZE")
+
+
+def sample_memory() -> None:
+    """
+    Sample resident memory every SAMPLE_SECONDS while any measure() scope is open,
+    raising the peak of every open scope. Target of the sampler thread.
+    """
+    while True:
+        with SAMPLER_CONDITION:
+            while not SAMPLER["peaks"]:
+                SAMPLER_CONDITION.wait()
+        memory = get_memory()
+        with SAMPLER_CONDITION:
+            for peak in SAMPLER["peaks"].values():
+                peak[0] = max(peak[0], memory)
+        sleep(SAMPLE_SECONDS)
+
+
+def reset_sampler() -> None:
+    """
+    Reset sampler state in a forked child process, where the sampler thread doesn't exist
+    and its condition may have been held by it at the time of the fork.
+    """
+    global SAMPLER_CONDITION
+    SAMPLER_CONDITION = Condition()
+    SAMPLER["peaks"], SAMPLER["thread"] = {}, None
+
+
+register_at_fork(after_in_child=reset_sampler)
+
+
+def open_sampler_scope(peak: List[int]) -> None:
+    """
+    Register peak of a measure() scope with the sampler, starting its thread on first use in this process.
+    """
+    with SAMPLER_CONDITION:
+        SAMPLER["peaks"][id(peak)] = peak
+        if SAMPLER["thread"] is None:
+            SAMPLER["thread"] = Thread(target=sample_memory, daemon=True)
+            SAMPLER["thread"].start()
+        SAMPLER_CONDITION.notify()
+
+
+def close_sampler_scope(peak: List[int]) -> None:
+    """
+    Unregister peak of a measure() scope from the sampler.
+    """
+    with SAMPLER_CONDITION:
+        SAMPLER["peaks"].pop(id(peak), None)
+
+
+def get_rows(value: Any) -> Optional[int]:
+    """
+    Number of rows of a DataFrame, array, list or dictionary of records, otherwise None.
+    For tuples such as statistics and cell codes, rows of the first element.
+    """
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    if isinstance(value, (DataFrame, ndarray, list, dict)):
+        return len(value)
+    return None
+
+
+@contextmanager
+def measure(name: str, rows_in: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Measure wall time, CPU time of this process and peak memory of the block, and record them in METRICS under name,
+    with rows in and rows out set on the yielded record, and rows per second.
+    Peak memory is the highest resident memory above that at the start of the block,
+    sampled every SAMPLE_SECONDS by the sampler thread shared by all open scopes,
+    so allocations of Arrow and of pool workers are counted.
+    """
+    record = {"rows_in": rows_in, "rows_out": None}
+    start_memory = get_memory()
+    peak_memory = [start_memory]
+    if start_memory is not None:
+        open_sampler_scope(peak_memory)
+    start_time, start_cpu_time = perf_counter(), process_time()
+    try:
+        yield record
+    finally:
+        seconds = perf_counter() - start_time
+        record["wall_seconds"] = seconds
+        record["cpu_seconds"] = process_time() - start_cpu_time
+        if start_memory is not None:
+            close_sampler_scope(peak_memory)
+            peak = max(peak_memory[0], get_memory())
+            record["peak_memory_mb"] = (peak - start_memory) / 2**20
+        else:
+            record["peak_memory_mb"] = None
+        rows = record["rows_out"] if record["rows_out"] is not None else rows_in
+        record["rows_per_second"] = (
+            rows / seconds if rows is not None and seconds > 0 else None
+        )
+        with METRICS_LOCK:
+            METRICS["functions"].setdefault(name, []).append(record)
+
+
+def instrument(function: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Decorator measuring each call of a pipeline function with measure(),
+    where rows in are rows of the first argument and rows out are rows of the result.
+    """
+
+    @wraps(function)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with measure(function.__name__, get_rows(args[0]) if args else None) as record:
+            result = function(*args, **kwargs)
+            record["rows_out"] = get_rows(result)
+        return result
+
+    return wrapper
+
+
+def record_latency(name: str, seconds: float) -> None:
+    """
+    Add latency of one request to histogram name in METRICS, with buckets bounded by LATENCY_BUCKETS.
+    """
+    with METRICS_LOCK:
+        histogram = METRICS["latencies"].setdefault(
+            name,
+            {
+                "buckets": LATENCY_BUCKETS,
+                "counts": [0] * (len(LATENCY_BUCKETS) + 1),
+                "count": 0,
+                "sum_seconds": 0.0,
+                "max_seconds": 0.0,
+            },
+        )
+        histogram["counts"][int(searchsorted(LATENCY_BUCKETS, seconds))] += 1
+        histogram["count"] += 1
+        histogram["sum_seconds"] += seconds
+        histogram["max_seconds"] = max(histogram["max_seconds"], seconds)
+
+
+def record_count(name: str, count: int) -> None:
+    """
+    Add count to counter name in METRICS, such as establishments resolved by each route.
+    """
+    with METRICS_LOCK:
+        METRICS["counts"][name] = METRICS["counts"].get(name, 0) + int(count)
+
+
+def get_metrics(reset: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    Metrics recorded in this process, emptied if reset, so a worker process can send back the metrics of one task.
+    """
+    with METRICS_LOCK:
+        metrics = dict(METRICS)
+        if reset:
+            METRICS["functions"], METRICS["latencies"], METRICS["counts"] = {}, {}, {}
+    return metrics
+
+
+def merge_metrics(metrics: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Add metrics recorded in another process, such as a pipeline stage, to METRICS of this process.
+    """
+    with METRICS_LOCK:
+        for name, records in metrics["functions"].items():
+            METRICS["functions"].setdefault(name, []).extend(records)
+        for name, histogram in metrics["latencies"].items():
+            merged = METRICS["latencies"].get(name)
+            if merged is None:
+                METRICS["latencies"][name] = {
+                    **histogram,
+                    "counts": list(histogram["counts"]),
+                }
+                continue
+            merged["counts"] = [
+                count + other
+                for count, other in zip(merged["counts"], histogram["counts"])
+            ]
+            merged["count"] += histogram["count"]
+            merged["sum_seconds"] += histogram["sum_seconds"]
+            merged["max_seconds"] = max(merged["max_seconds"], histogram["max_seconds"])
+        for name, count in metrics["counts"].items():
+            METRICS["counts"][name] = METRICS["counts"].get(name, 0) + count
+
+
+def write_metrics_report(file_path: str, **report: Any) -> None:
+    """
+    Write JSON report of METRICS with summary by function and any extra sections of report,
+    such as pipeline stages.
+    """
+    metrics = get_metrics()
+    summary = {
+        name: {
+            "calls": len(records),
+            "wall_seconds": sum(record["wall_seconds"] for record in records),
+            "cpu_seconds": sum(record["cpu_seconds"] for record in records),
+            "peak_memory_mb": max(
+                (record["peak_memory_mb"] or 0 for record in records), default=0
+            ),
+        }
+        for name, records in metrics["functions"].items()
+    }
+    makedirs(dirname(file_path) or ".", exist_ok=True)
+    with open(file_path, "w") as file:
+        dump({**report, "summary": summary, **metrics}, file, indent=2)
+    print(f"Metrics report saved to {file_path}.\n")
@@ -1,112 +1,248 @@
-from pandas import read_csv, DataFrame
+from pandas import read_csv, read_parquet, DataFrame, concat
 
+from concurrent.futures import Future
 from time import perf_counter
+from os.path import exists
 from datetime import timedelta
+from typing import Iterable, List
 
 from utils import (
-    parse_data,
-    keep_required_columns,
-    fill_leading_zeros,
+    save_data,
+    apply_schema,
     df_to_dict,
-    multi_geocode_data,
-    save_geocoded_responses,
-    extract_dandbid_fips,
     process_crosswalk,
-    get_aggregates_and_market_share,
-    get_herfindahl_index,
+    build_county_lookup,
+    save_zip_lookup,
+    load_zip_lookup,
+    resolve_single_county_zips,
+    extract_dandbid_fips,
+)
+from geocoder import (
+    batch_geocode_data,
+    cached_geocode_data,
+    stream_geocode_data,
+    extract_shards_fips,
 )
+from pipeline import (
+    Stage,
+    run_pipeline,
+    parse_stage,
+    trim_stage,
+    aggregate_stage,
+    herfindahl_stage,
+)
+from sinks import ExportSink
+from instrumentation import write_metrics_report
 from config import (
     D_AND_B_TEXT,
-    D_AND_B_CSV,
-    D_AND_B_STATA,
-    GEOCODED_RESPONSES_JSON,
-    GEOCODED_RESPONSES_TEXT,
-    D_AND_B_FIPS_CSV,
-    D_AND_B_FIPS_STATA,
+    D_AND_B_PARQUET,
+    D_AND_B_RECORDS_DIR,
+    D_AND_B_PROCESSED_PARQUET,
+    PIPELINE_GEOCODE_CACHE_JSON,
+    METRICS_GEOCODE_JSON,
+    GEOCODED_SHARDS_DIR,
+    GEOCODE_CACHE_DB,
+    D_AND_B_FIPS_PARQUET,
     CZONE_CSV,
-    D_AND_B_CZONE_CSV,
-    D_AND_B_CZONE_STATA,
-    D_AND_B_ANALYSIS_CSV,
-    D_AND_B_ANALYSIS_STATA,
-    D_AND_B_COMPLETE_CSV,
-    D_AND_B_COMPLETE_STATA,
-    D_AND_B_HERFINDAHL_CSV,
-    D_AND_B_HERFINDAHL_STATA,
+    CZONE_PARQUET,
+    D_AND_B_CZONE_PARQUET,
+    D_AND_B_ANALYSIS_PARQUET,
+    D_AND_B_COMPLETE_PARQUET,
+    D_AND_B_HERFINDAHL_PARQUET,
+    ZIP_CODE_CSV,
+    ZIP_COUNTY_LOOKUP_NPY,
 )
 
 
-def main() -> None:
+def county_stage() -> None:
+
+    # Build and save dense lookup index of ZIPs lying within one county: FIPS by integer ZIP
+    save_zip_lookup(build_county_lookup(ZIP_CODE_CSV), ZIP_COUNTY_LOOKUP_NPY)
 
-    # Parse D&B data according to guideline to .csv and .dta, uses all available cores
-    # parse_data(D_AND_B_TEXT, D_AND_B_CSV, D_AND_B_STATA)
 
-    # Read D&B data
-    df = read_csv(D_AND_B_CSV)
+def geocode_stage(batch: bool = False, hybrid: bool = True) -> None:
 
-    # Keep columns for geo-locating addresses to FIPS codes
-    df_dropped = keep_required_columns(df)
+    df_processed = read_parquet(D_AND_B_PROCESSED_PARQUET)
 
-    # Fill leading zeros for D&B IDs and ZIP columns
-    df_processed = fill_leading_zeros(df_dropped)
+    if hybrid:
+        # Assign FIPS codes locally to D&B processed in ZIPs lying within one county by a vectorized gather on ZIP,
+        # only establishments in ZIPs spanning several counties, or with unknown or missing ZIPs, are geocoded
+        df_resolved, df_processed = resolve_single_county_zips(
+            df_processed, load_zip_lookup(ZIP_COUNTY_LOOKUP_NPY)
+        )
 
     # Convert DataFrame to list of dictionaries each representing a row
     data_geolocating = df_to_dict(df_processed)
 
-    # Use multiprocessing to send requests to geo-coder to get FIPS codes
-    # Uses all available cores to send requests in parallel
-    geocoder_responses = multi_geocode_data(data_geolocating)
+    if batch:
+        # Upload unique addresses missing from the persistent geocode cache to batch geo-coder
+        # in files of up to 10,000 records, with 4 batches in flight
+        responses = cached_geocode_data(
+            data_geolocating,
+            GEOCODE_CACHE_DB,
+            geocode=batch_geocode_data,
+            max_in_flight=4,
+        )
 
-    # Write API responses to JSON file, outer keys are D&B IDs
-    save_geocoded_responses(
-        geocoder_responses, GEOCODED_RESPONSES_JSON, GEOCODED_RESPONSES_TEXT
-    )
+        # Extract D&B IDs and state and county codes from responses,
+        # then combined into FIPS column, and convert into DataFrame
+        df_mapping = apply_schema(
+            DataFrame(extract_dandbid_fips(responses), columns=["DUNS", "FIPS"])
+        )
+    else:
+        # Send requests to geo-coder to get FIPS codes from a single event loop,
+        # keeping up to 64 requests in flight over pooled keep-alive connections,
+        # only for unique addresses missing from the persistent geocode cache,
+        # and stream D&B IDs, FIPS codes and match quality extracted from each chunk of responses
+        # to compressed JSONL shards, skipping D&B IDs completed in previous runs
+        stream_geocode_data(
+            data_geolocating, GEOCODED_SHARDS_DIR, GEOCODE_CACHE_DB, max_in_flight=64
+        )
 
-    # Extract outer D&B IDs key as D&B column and,
-    # state and county codes then combined into FIPS column
-    extracted_result = extract_dandbid_fips(geocoder_responses)
+        # Read D&B IDs and FIPS codes of matched addresses from shards into packed arrays
+        df_shards = extract_shards_fips(GEOCODED_SHARDS_DIR)
+        df_mapping = df_shards.loc[df_shards["FIPS"].notna(), ["DUNS", "FIPS"]]
 
-    # Covert list of dictionaries containing D&B IDs and FIPS codes into DataFrame
-    df_mapping = DataFrame(extracted_result)
+    if hybrid:
+        # Combine establishments resolved locally and geocoded, keeping only geocoded establishments
+        # sent to the geocoder in this run, since shards of previous runs may hold others
+        df_mapping = concat(
+            [df_resolved, df_mapping[df_mapping["DUNS"].isin(df_processed["DUNS"])]],
+            ignore_index=True,
+        )
 
     # Save geocoded responses data
-    df_mapping.to_csv(D_AND_B_FIPS_CSV, index=False)
-    df_mapping.to_stata(D_AND_B_FIPS_STATA, write_index=False)
+    save_data(df_mapping, D_AND_B_FIPS_PARQUET)
+
 
-    # Read FIPS commuting zone crosswalk data
-    df_crosswalk = read_csv(CZONE_CSV)
+def crosswalk_stage() -> None:
 
-    # Process crosswalk file
-    df_crosswalk_processed = process_crosswalk(df_crosswalk)
+    # Read FIPS commuting zone crosswalk data and process crosswalk file
+    df_crosswalk_processed = process_crosswalk(read_csv(CZONE_CSV))
+    df_crosswalk_processed.to_parquet(CZONE_PARQUET, compression="zstd")
+
+
+def merge_stage() -> None:
 
     # Merge D&B IDs and commuting zones on FIPS
+    df_mapping = read_parquet(D_AND_B_FIPS_PARQUET)
+    df_crosswalk_processed = read_parquet(CZONE_PARQUET)
     df_mapped = df_mapping.merge(df_crosswalk_processed, how="inner", on=["FIPS"])
 
     # Save D&B to commuting zone mapping
-    df_mapped.to_csv(D_AND_B_CZONE_CSV, index=False)
-    df_mapped.to_stata(D_AND_B_CZONE_STATA, write_index=False)
+    save_data(df_mapped, D_AND_B_CZONE_PARQUET)
 
     # Merge D&B processed and D&B commuting zone mapped on DUNS
+    df_processed = read_parquet(D_AND_B_PROCESSED_PARQUET)
     df_ready = df_processed.merge(df_mapped, how="inner", on=["DUNS"])
 
     # Save D&B data with FIPS and CZONE
-    df_ready.to_csv(D_AND_B_ANALYSIS_CSV, index=False)
-    df_ready.to_stata(D_AND_B_ANALYSIS_STATA, write_index=False)
+    save_data(df_ready, D_AND_B_ANALYSIS_PARQUET)
+
+
+def main(
+    export: bool = False,
+    batch: bool = False,
+    hybrid: bool = True,
+    export_formats: Iterable[str] = ("csv", "stata"),
+) -> List[Future]:
+
+    stages = [
+        # Keep columns for geo-locating addresses to FIPS codes,
+        # D&B IDs, ZIP and SIC codes are stored as integers and only zero-filled on output
+        Stage(
+            "trim",
+            trim_stage,
+            [D_AND_B_PARQUET],
+            [D_AND_B_PROCESSED_PARQUET],
+            {
+                "read_file_path": D_AND_B_PARQUET,
+                "write_file_path": D_AND_B_PROCESSED_PARQUET,
+            },
+        ),
+        # Build lookup index of ZIPs lying within one county, concurrently with D&B preprocessing
+        Stage("county", county_stage, [ZIP_CODE_CSV], [ZIP_COUNTY_LOOKUP_NPY]),
+        # Geocode addresses of D&B processed to FIPS codes, if hybrid only of establishments
+        # whose ZIP doesn't lie within one county, others are resolved locally by ZIP
+        Stage(
+            "geocode",
+            geocode_stage,
+            [D_AND_B_PROCESSED_PARQUET, ZIP_COUNTY_LOOKUP_NPY],
+            [D_AND_B_FIPS_PARQUET],
+            {"batch": batch, "hybrid": hybrid},
+            [D_AND_B_FIPS_PARQUET],
+        ),
+        # Process FIPS commuting zone crosswalk, concurrently with D&B preprocessing and geocoding
+        Stage("crosswalk", crosswalk_stage, [CZONE_CSV], [CZONE_PARQUET]),
+        # Merge geocoded D&B IDs with commuting zones on FIPS, and with D&B processed on DUNS
+        Stage(
+            "merge",
+            merge_stage,
+            [D_AND_B_FIPS_PARQUET, CZONE_PARQUET, D_AND_B_PROCESSED_PARQUET],
+            [D_AND_B_CZONE_PARQUET, D_AND_B_ANALYSIS_PARQUET],
+            exports=[D_AND_B_CZONE_PARQUET, D_AND_B_ANALYSIS_PARQUET],
+        ),
+        # Compute total firms, employees and sales by commuting zone and industry
+        # in a single pass, and market shares of participants
+        Stage(
+            "aggregate",
+            aggregate_stage,
+            [D_AND_B_ANALYSIS_PARQUET],
+            [D_AND_B_COMPLETE_PARQUET],
+            {
+                "read_file_path": D_AND_B_ANALYSIS_PARQUET,
+                "write_file_path": D_AND_B_COMPLETE_PARQUET,
+            },
+            [D_AND_B_COMPLETE_PARQUET],
+        ),
+        # Compute Herfindahl Index by commuting zone and industry,
+        # for employees and sales
+        Stage(
+            "herfindahl",
+            herfindahl_stage,
+            [D_AND_B_ANALYSIS_PARQUET],
+            [D_AND_B_HERFINDAHL_PARQUET],
+            {
+                "read_file_path": D_AND_B_ANALYSIS_PARQUET,
+                "write_file_path": D_AND_B_HERFINDAHL_PARQUET,
+            },
+            [D_AND_B_HERFINDAHL_PARQUET],
+        ),
+    ]
+
+    # Parse D&B data according to guideline to Parquet, and to record store with DUNS and ZIP and SIC indexes,
+    # only if the raw file is available, otherwise the persisted Parquet file is the source
+    if exists(D_AND_B_TEXT):
+        stages.append(
+            Stage(
+                "parse",
+                parse_stage,
+                [D_AND_B_TEXT],
+                [D_AND_B_PARQUET, D_AND_B_RECORDS_DIR],
+                {
+                    "read_file_path": D_AND_B_TEXT,
+                    "write_file_path": D_AND_B_PARQUET,
+                    "write_directory_records": D_AND_B_RECORDS_DIR,
+                },
+                [D_AND_B_PARQUET],
+            )
+        )
 
-    # Compute total firms by commuting zone and industry,
-    # and market shares of participants
-    df_complete = get_aggregates_and_market_share(df_ready)
+    # Write .csv, compressed .csv or .dta exports of chosen formats only if exporting,
+    # in a background pool of processes as soon as each stage is done, off the critical path
+    sink = ExportSink(export_formats) if export else None
 
-    # Save D&B data complete with market shares
-    df_complete.to_csv(D_AND_B_COMPLETE_CSV, index=False)
-    df_complete.to_stata(D_AND_B_COMPLETE_STATA, write_index=False)
+    # Run stages in dependency order, with independent stages running concurrently,
+    # skipping stages whose inputs and parameters are unchanged since their outputs were written
+    statuses = run_pipeline(stages, PIPELINE_GEOCODE_CACHE_JSON, sink=sink)
 
-    # Compute Herfindahl Index by commuting zone and industry,
-    # for employees and sales
-    df_herfindahl = get_herfindahl_index(df_complete)
+    # Save report of wall and CPU time, peak memory, row counts and throughput of each stage and function,
+    # and latency histograms of geocoder requests
+    write_metrics_report(METRICS_GEOCODE_JSON, stages=statuses)
 
-    # Save Herfindahl dataset: CZONE, DPRIMSI, HHI_EMP, HHI_SALES
-    df_herfindahl.to_csv(D_AND_B_HERFINDAHL_CSV, index=False)
-    df_herfindahl.to_stata(D_AND_B_HERFINDAHL_STATA, write_index=False)
+    # Return once Herfindahl Index is saved to Parquet, exports still queued are written in the background
+    # and waited for before the interpreter exits, wait on the returned futures to block until they are written
+    return sink.close() if sink is not None else []
 
 
 if __name__ == "__main__":
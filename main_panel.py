@@ -0,0 +1,65 @@
+from concurrent.futures import Future
+from time import perf_counter
+from datetime import timedelta
+from os.path import exists
+from typing import Iterable, List
+
+from utils import (
+    save_data,
+    get_zip_mapping,
+    build_zip_lookup,
+    save_zip_lookup,
+    get_panel_files,
+    multi_get_panel_herfindahl,
+)
+from config import (
+    D_AND_B_PANEL_PATTERN,
+    CZONE_CSV,
+    ZIP_LOOKUP_NPY,
+    D_AND_B_PANEL_PARQUET,
+    ZIP_CODE_CSV,
+)
+from sinks import ExportSink
+
+
+def main(
+    export: bool = False, export_formats: Iterable[str] = ("csv", "stata")
+) -> List[Future]:
+
+    # Build ZIP to commuting zone lookup index unless persisted by a previous run,
+    # delete ZIP_LOOKUP_NPY to rebuild it after changing ZIP or crosswalk data
+    if not exists(ZIP_LOOKUP_NPY):
+        save_zip_lookup(
+            build_zip_lookup(get_zip_mapping(ZIP_CODE_CSV, CZONE_CSV)), ZIP_LOOKUP_NPY
+        )
+
+    # Find D&B text files for each year
+    panel_files = get_panel_files(D_AND_B_PANEL_PATTERN)
+
+    # Compute Herfindahl Index by commuting zone and industry for each year,
+    # one year per worker, sharing memory-mapped ZIP lookup index read-only
+    df_panel = multi_get_panel_herfindahl(panel_files, ZIP_LOOKUP_NPY)
+
+    # Save Herfindahl panel dataset: YEAR, CZONE, SIC, HHI_EMP, HHI_SALES
+    save_data(df_panel, D_AND_B_PANEL_PARQUET)
+
+    # Write .csv, compressed .csv or .dta exports of chosen formats only if exporting,
+    # in a background pool of processes once the panel is saved, off the critical path
+    sink = ExportSink(export_formats) if export else None
+    if sink is not None:
+        sink.submit(D_AND_B_PANEL_PARQUET)
+
+    # Return once Herfindahl panel is saved to Parquet, exports still queued are written in the background
+    # and waited for before the interpreter exits, wait on the returned futures to block until they are written
+    return sink.close() if sink is not None else []
+
+
+if __name__ == "__main__":
+
+    start_time = perf_counter()
+
+    main()
+
+    end_time = perf_counter()
+
+    print(f"Time: {str(timedelta(seconds=end_time - start_time))}\n")
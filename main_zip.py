@@ -1,99 +1,258 @@
-from pandas import read_csv
+from pandas import read_parquet
 
+from concurrent.futures import Future
 from time import perf_counter
+from os.path import exists
 from datetime import timedelta
+from typing import Iterable, List
 
 from utils import (
-    parse_data,
-    keep_required_columns,
-    fill_leading_zeros,
-    fill_leading_zeros_zip,
-    zip_combine_state_and_county,
-    process_crosswalk,
-    get_aggregates_and_market_share,
-    get_herfindahl_index,
+    save_data,
+    get_zip_mapping,
+    build_zip_lookup,
+    save_zip_lookup,
+    load_zip_lookup,
+    assign_commuting_zones,
 )
+from pipeline import (
+    Stage,
+    run_pipeline,
+    parse_stage,
+    trim_stage,
+    aggregate_stage,
+    herfindahl_stage,
+    get_cube_paths,
+    cube_stage,
+    measures_stage,
+    bootstrap_stage,
+    state_stage,
+    partition_stage,
+    partitioned_herfindahl_stage,
+)
+from sinks import ExportSink
+from instrumentation import write_metrics_report
 from config import (
     D_AND_B_TEXT,
-    D_AND_B_CSV,
-    D_AND_B_STATA,
+    D_AND_B_PARQUET,
+    D_AND_B_RECORDS_DIR,
+    D_AND_B_PROCESSED_PARQUET,
+    D_AND_B_PARTITIONS_DIR,
+    PIPELINE_ZIP_CACHE_JSON,
+    METRICS_ZIP_JSON,
     CZONE_CSV,
-    D_AND_B_CZONE_CSV,
-    D_AND_B_CZONE_STATA,
-    D_AND_B_ANALYSIS_CSV,
-    D_AND_B_ANALYSIS_STATA,
-    D_AND_B_COMPLETE_CSV,
-    D_AND_B_COMPLETE_STATA,
-    D_AND_B_HERFINDAHL_CSV,
-    D_AND_B_HERFINDAHL_STATA,
+    D_AND_B_CZONE_PARQUET,
+    ZIP_LOOKUP_NPY,
+    D_AND_B_ANALYSIS_PARQUET,
+    D_AND_B_COMPLETE_PARQUET,
+    D_AND_B_COMPLETE_PARTITIONS_DIR,
+    D_AND_B_HERFINDAHL_PARQUET,
+    D_AND_B_BOOTSTRAP_PARQUET,
+    D_AND_B_MEASURES_PARQUET,
+    HHI_STATE_DIR,
     ZIP_CODE_CSV,
 )
 
 
-def main() -> None:
+def crosswalk_stage() -> None:
 
-    # Parse D&B data according to guideline to .csv and .dta, uses all available cores
-    # parse_data(D_AND_B_TEXT, D_AND_B_CSV, D_AND_B_STATA)
+    # Read Sampsa's ZIP code data and FIPS commuting zone crosswalk data,
+    # merge them on FIPS and drop duplicate ZIPs
+    df_mapped = get_zip_mapping(ZIP_CODE_CSV, CZONE_CSV)
 
-    # Read D&B data
-    df = read_csv(D_AND_B_CSV)
+    # Save mapping dataset: DZIP5, FIPS, CZONE
+    save_data(df_mapped, D_AND_B_CZONE_PARQUET)
 
-    # Keep columns for geo-locating addresses to FIPS codes
-    df_dropped = keep_required_columns(df)
+    # Build and save dense lookup index: FIPS and CZONE by integer ZIP
+    save_zip_lookup(build_zip_lookup(df_mapped), ZIP_LOOKUP_NPY)
 
-    # Fill leading zeros for D&B IDs and ZIP columns
-    df_processed = fill_leading_zeros(df_dropped)
 
-    # Read Sampsa's ZIP code data
-    df_zip = read_csv(
-        ZIP_CODE_CSV,
-        usecols=["zipcode", "statefips", "countyfips"],
-    )
+def merge_stage() -> None:
 
-    # Fill leading zeros for ZIPs
-    df_zip_filled = fill_leading_zeros_zip(df_zip)
+    # Memory-map ZIP lookup index
+    zip_lookup = load_zip_lookup(ZIP_LOOKUP_NPY)
 
-    # Combine state and county codes into FIPS
-    df_zip_processed = zip_combine_state_and_county(df_zip_filled)
+    # Assign FIPS and CZONE to D&B processed by a vectorized gather on ZIP
+    df_ready = assign_commuting_zones(
+        read_parquet(D_AND_B_PROCESSED_PARQUET), zip_lookup
+    )
 
-    # Read FIPS commuting zone crosswalk data
-    df_crosswalk = read_csv(CZONE_CSV)
+    # Save D&B data with FIPS and CZONE
+    save_data(df_ready, D_AND_B_ANALYSIS_PARQUET)
 
-    # Process crosswalk file
-    df_crosswalk_processed = process_crosswalk(df_crosswalk)
 
-    # Merge ZIP and crosswalk on FIPS
-    df_mapped = df_zip_processed.merge(df_crosswalk_processed, how="inner", on=["FIPS"])
+def main(
+    export: bool = False,
+    bootstrap: bool = False,
+    out_of_core: bool = False,
+    export_formats: Iterable[str] = ("csv", "stata"),
+) -> List[Future]:
 
-    # Drop duplicate rows using key DZIP5, multiple ZIPs in FIPS and CZONE
-    df_mapped.drop_duplicates(subset="DZIP5", inplace=True)
+    stages = [
+        # Keep columns for geo-locating addresses to FIPS codes,
+        # D&B IDs, ZIP and SIC codes are stored as integers and only zero-filled on output
+        Stage(
+            "trim",
+            trim_stage,
+            [D_AND_B_PARQUET],
+            [D_AND_B_PROCESSED_PARQUET],
+            {
+                "read_file_path": D_AND_B_PARQUET,
+                "write_file_path": D_AND_B_PROCESSED_PARQUET,
+            },
+        ),
+        # Build ZIP to commuting zone mapping and lookup index,
+        # concurrently with parsing and trimming D&B data
+        Stage(
+            "crosswalk",
+            crosswalk_stage,
+            [ZIP_CODE_CSV, CZONE_CSV],
+            [D_AND_B_CZONE_PARQUET, ZIP_LOOKUP_NPY],
+            exports=[D_AND_B_CZONE_PARQUET],
+        ),
+        # Merge D&B processed with commuting zones on ZIP
+        Stage(
+            "merge",
+            merge_stage,
+            [D_AND_B_PROCESSED_PARQUET, ZIP_LOOKUP_NPY],
+            [D_AND_B_ANALYSIS_PARQUET],
+            exports=[D_AND_B_ANALYSIS_PARQUET],
+        ),
+        # Compute total firms, employees and sales by commuting zone and industry
+        # in a single pass, and market shares of participants
+        Stage(
+            "aggregate",
+            aggregate_stage,
+            [D_AND_B_ANALYSIS_PARQUET],
+            [D_AND_B_COMPLETE_PARQUET],
+            {
+                "read_file_path": D_AND_B_ANALYSIS_PARQUET,
+                "write_file_path": D_AND_B_COMPLETE_PARQUET,
+            },
+            [D_AND_B_COMPLETE_PARQUET],
+        ),
+        # Compute Herfindahl Index by commuting zone and industry,
+        # for employees and sales
+        Stage(
+            "herfindahl",
+            herfindahl_stage,
+            [D_AND_B_ANALYSIS_PARQUET],
+            [D_AND_B_HERFINDAHL_PARQUET],
+            {
+                "read_file_path": D_AND_B_ANALYSIS_PARQUET,
+                "write_file_path": D_AND_B_HERFINDAHL_PARQUET,
+            },
+            [D_AND_B_HERFINDAHL_PARQUET],
+        ),
+        # Compute Herfindahl Index by county, commuting zone and state, and by 2-, 3- and 4-digit industry
+        Stage(
+            "cube",
+            cube_stage,
+            [D_AND_B_ANALYSIS_PARQUET],
+            [f"{file_path}.parquet" for file_path in get_cube_paths()],
+            {"read_file_path": D_AND_B_ANALYSIS_PARQUET},
+            [f"{file_path}.parquet" for file_path in get_cube_paths()],
+        ),
+        # Compute Herfindahl-Hirschman Index, concentration ratios, Theil entropy and Gini
+        # by commuting zone and industry, from shares sorted once within each cell
+        Stage(
+            "measures",
+            measures_stage,
+            [D_AND_B_ANALYSIS_PARQUET],
+            [D_AND_B_MEASURES_PARQUET],
+            {
+                "read_file_path": D_AND_B_ANALYSIS_PARQUET,
+                "write_file_path": D_AND_B_MEASURES_PARQUET,
+            },
+            [D_AND_B_MEASURES_PARQUET],
+        ),
+        # Persist incremental state for applying record-level deltas with apply_deltas()
+        Stage(
+            "state",
+            state_stage,
+            [D_AND_B_ANALYSIS_PARQUET],
+            [HHI_STATE_DIR],
+            {"read_file_path": D_AND_B_ANALYSIS_PARQUET, "directory": HHI_STATE_DIR},
+        ),
+    ]
 
-    # Save mapping dataset: DZIP5, FIPS, CZONE
-    df_mapped.to_csv(D_AND_B_CZONE_CSV, index=False)
-    df_mapped.to_stata(D_AND_B_CZONE_STATA, write_index=False)
+    # Parse D&B data according to guideline to Parquet, and to record store with DUNS and ZIP and SIC indexes,
+    # only if the raw file is available, otherwise the persisted Parquet file is the source
+    if exists(D_AND_B_TEXT):
+        stages.append(
+            Stage(
+                "parse",
+                parse_stage,
+                [D_AND_B_TEXT],
+                [D_AND_B_PARQUET, D_AND_B_RECORDS_DIR],
+                {
+                    "read_file_path": D_AND_B_TEXT,
+                    "write_file_path": D_AND_B_PARQUET,
+                    "write_directory_records": D_AND_B_RECORDS_DIR,
+                },
+                [D_AND_B_PARQUET],
+            )
+        )
 
-    # Merge D&B processed and ZIP to commuting zone mapping
-    df_ready = df_processed.merge(df_mapped, how="inner", on=["DZIP5"])
+    # Compute bootstrap percentile intervals of Herfindahl Index by commuting zone and industry
+    if bootstrap:
+        stages.append(
+            Stage(
+                "bootstrap",
+                bootstrap_stage,
+                [D_AND_B_ANALYSIS_PARQUET],
+                [D_AND_B_BOOTSTRAP_PARQUET],
+                {
+                    "read_file_path": D_AND_B_ANALYSIS_PARQUET,
+                    "write_file_path": D_AND_B_BOOTSTRAP_PARQUET,
+                },
+                [D_AND_B_BOOTSTRAP_PARQUET],
+            )
+        )
 
-    # Save D&B data with FIPS and CZONE
-    df_ready.to_csv(D_AND_B_ANALYSIS_CSV, index=False)
-    df_ready.to_stata(D_AND_B_ANALYSIS_STATA, write_index=False)
+    # Out-of-core mode for D&B files larger than memory: hash-partition D&B data by commuting zone
+    # into on-disk partitions while parsing the raw file, then aggregate partitions independently
+    # and in parallel into the same Herfindahl Index, with peak memory bounded by the largest partition
+    if out_of_core:
+        stages = [stage for stage in stages if stage.name == "crosswalk"] + [
+            Stage(
+                "partition",
+                partition_stage,
+                [D_AND_B_TEXT, ZIP_LOOKUP_NPY],
+                [D_AND_B_PARTITIONS_DIR],
+                {
+                    "read_file_path": D_AND_B_TEXT,
+                    "lookup_path": ZIP_LOOKUP_NPY,
+                    "directory": D_AND_B_PARTITIONS_DIR,
+                },
+            ),
+            Stage(
+                "partitioned_herfindahl",
+                partitioned_herfindahl_stage,
+                [D_AND_B_PARTITIONS_DIR],
+                [D_AND_B_COMPLETE_PARTITIONS_DIR, D_AND_B_HERFINDAHL_PARQUET],
+                {
+                    "read_directory": D_AND_B_PARTITIONS_DIR,
+                    "complete_directory": D_AND_B_COMPLETE_PARTITIONS_DIR,
+                    "write_file_path": D_AND_B_HERFINDAHL_PARQUET,
+                },
+                [D_AND_B_HERFINDAHL_PARQUET],
+            ),
+        ]
 
-    # Compute total firms by commuting zone and industry,
-    # and market shares of participants
-    df_complete = get_aggregates_and_market_share(df_ready)
+    # Write .csv, compressed .csv or .dta exports of chosen formats only if exporting,
+    # in a background pool of processes as soon as each stage is done, off the critical path
+    sink = ExportSink(export_formats) if export else None
 
-    # Save D&B data complete with market shares
-    df_complete.to_csv(D_AND_B_COMPLETE_CSV, index=False)
-    df_complete.to_stata(D_AND_B_COMPLETE_STATA, write_index=False)
+    # Run stages in dependency order, with independent stages running concurrently,
+    # skipping stages whose inputs and parameters are unchanged since their outputs were written
+    statuses = run_pipeline(stages, PIPELINE_ZIP_CACHE_JSON, sink=sink)
 
-    # Compute Herfindahl Index by commuting zone and industry,
-    # for employees and sales
-    df_herfindahl = get_herfindahl_index(df_complete)
+    # Save report of wall and CPU time, peak memory, row counts and throughput of each stage and function
+    write_metrics_report(METRICS_ZIP_JSON, stages=statuses)
 
-    # Save Herfindahl dataset: CZONE, DPRIMSI, HHI_EMP, HHI_SALES
-    df_herfindahl.to_csv(D_AND_B_HERFINDAHL_CSV, index=False)
-    df_herfindahl.to_stata(D_AND_B_HERFINDAHL_STATA, write_index=False)
+    # Return once Herfindahl Index is saved to Parquet, exports still queued are written in the background
+    # and waited for before the interpreter exits, wait on the returned futures to block until they are written
+    return sink.close() if sink is not None else []
 
 
 if __name__ == "__main__":
@@ -0,0 +1,195 @@
+from pandas import DataFrame, array, concat, read_parquet
+from numpy import ceil, int64, unique
+
+from multiprocessing import Pool, cpu_count
+from os import fstat, makedirs
+from os.path import basename, join, normpath
+from glob import glob
+from shutil import rmtree
+from typing import Any, Dict, Optional, Tuple
+
+from utils import (
+    D_AND_B_COLUMNS,
+    REQUIRED_COLUMNS,
+    parse_fixed_width,
+    get_byte_ranges,
+    apply_schema,
+    keep_required_columns,
+    load_zip_lookup,
+    assign_commuting_zones,
+)
+from concentration import (
+    get_concentration_statistics,
+    get_market_shares,
+    get_herfindahl_from_statistics,
+)
+from instrumentation import instrument, get_metrics, merge_metrics
+
+# Empty Herfindahl Index by commuting zone and industry with the columns and dtypes of
+# get_herfindahl_from_statistics(), the result of multi_get_partitioned_herfindahl() without partitions
+HERFINDAHL_SCHEMA = DataFrame(
+    {
+        "CZONE": array([], dtype="Int32"),
+        "SIC": array([], dtype="Int16"),
+        "HHI_EMP": array([], dtype="float64"),
+        "HHI_SALES": array([], dtype="float64"),
+    }
+)
+
+
+def get_partition_path(directory: str, partition: int) -> str:
+    """
+    Path of directory holding Parquet files of one partition of D&B data under directory.
+    """
+    return f"{directory}partition_{partition:03d}/"
+
+
+def partition_byte_range(args) -> Tuple[Dict[int, int], Dict[str, Any]]:
+    """
+    Parse a line-aligned byte range of D&B text file, keeping only required columns,
+    assign FIPS and CZONE codes by ZIP and write establishments of each partition,
+    CZONE modulo number of partitions, to its own Parquet file in the partition's directory.
+    Every worker writes separate files, so ranges are partitioned concurrently without locking.
+    Returns number of establishments by partition, and metrics recorded in the worker.
+    This lower-level function is called in partition_data().
+    """
+    read_file_path, start, end, lookup_path, directory, num_partitions, index = args
+    get_metrics(reset=True)  # drop metrics inherited from parent process
+    columns = [column for column in D_AND_B_COLUMNS if column[0] in REQUIRED_COLUMNS]
+    with open(read_file_path, "rb") as file:
+        file.seek(start)
+        df = apply_schema(parse_fixed_width(file.read(end - start), columns))
+    df_ready = assign_commuting_zones(
+        keep_required_columns(df), load_zip_lookup(lookup_path)
+    )
+    partitions = df_ready["CZONE"].to_numpy(dtype=int64) % num_partitions
+    counts = {}
+    for partition in unique(partitions):
+        selected = partitions == partition
+        df_ready[selected].to_parquet(
+            join(
+                get_partition_path(directory, int(partition)),
+                f"range_{index:05d}.parquet",
+            ),
+            index=False,
+            compression="zstd",
+        )
+        counts[int(partition)] = int(selected.sum())
+    return counts, get_metrics(reset=True)
+
+
+@instrument
+def partition_data(
+    read_file_path: str,
+    lookup_path: str,
+    directory: str,
+    num_partitions: int = 64,
+    chunk_bytes: int = 1 << 28,
+) -> Dict[int, int]:
+    """
+    Hash-partition D&B text file by commuting zone into num_partitions on-disk partitions under directory,
+    while parsing it, for D&B files larger than memory. The file is split into line-aligned byte ranges
+    of at most about chunk_bytes, parsed by a pool of workers using all available cores, so memory of each
+    worker is bounded by chunk_bytes. All establishments of a commuting zone land in the same partition,
+    which therefore holds complete cells and commuting zone totals. Establishments with unmapped ZIPs are
+    dropped, as in assign_commuting_zones(). Previous partitions under directory are removed.
+    Returns number of establishments by partition.
+    """
+    with open(read_file_path, "rb") as file:
+        size = fstat(file.fileno()).st_size
+    num_processes = cpu_count()
+    num_ranges = max(num_processes, int(ceil(size / chunk_bytes)))
+    byte_ranges = get_byte_ranges(read_file_path, num_ranges)
+
+    rmtree(directory, ignore_errors=True)
+    for partition in range(num_partitions):
+        makedirs(get_partition_path(directory, partition), exist_ok=True)
+
+    counts = {}
+    with Pool(num_processes) as pool:
+        for range_counts, metrics in pool.imap_unordered(
+            partition_byte_range,
+            [
+                (read_file_path, start, end, lookup_path, directory, num_partitions, i)
+                for i, (start, end) in enumerate(byte_ranges)
+            ],
+        ):
+            for partition, count in range_counts.items():
+                counts[partition] = counts.get(partition, 0) + count
+            merge_metrics(metrics)
+    print(
+        f"Partitioning by commuting zone complete for {len(byte_ranges)} byte ranges.\n\t{sum(counts.values())} observations in {len(counts)} partitions, largest {max(counts.values(), default=0)}.\n"
+    )
+    return counts
+
+
+def aggregate_partition(args) -> Tuple[DataFrame, Dict[str, Any]]:
+    """
+    Compute statistics by commuting zone and industry of one partition, save its establishments
+    complete with market shares to Parquet if a path is given, and compute its Herfindahl Index.
+    Only one partition is in memory in each worker.
+    Returns Herfindahl Index of partition, and metrics recorded in the worker.
+    This lower-level function is called in multi_get_partitioned_herfindahl().
+    """
+    partition_path, complete_file_path = args
+    get_metrics(reset=True)  # drop metrics inherited from parent process
+    df_ready = read_parquet(partition_path)
+    df_statistics, cell_codes = get_concentration_statistics(df_ready)
+    if complete_file_path is not None:
+        get_market_shares(df_ready, df_statistics, cell_codes).to_parquet(
+            complete_file_path, index=False, compression="zstd"
+        )
+    return get_herfindahl_from_statistics(df_statistics), get_metrics(reset=True)
+
+
+@instrument
+def multi_get_partitioned_herfindahl(
+    directory: str, complete_directory: Optional[str] = None
+) -> DataFrame:
+    """
+    Compute Herfindahl Index by commuting zone and industry from partitions written by partition_data(),
+    aggregating each partition independently with one partition per worker in a pool,
+    so peak memory is bounded by the largest partitions rather than the whole D&B data.
+    Since every commuting zone is within one partition, the concatenated result, sorted by CZONE and SIC
+    with missing SIC last, equals get_herfindahl_from_statistics() on the whole data: CZONE, SIC, HHI_EMP, HHI_SALES.
+    If complete_directory is given, establishments complete with market shares are saved there
+    with one Parquet file per partition, which can be read back as one dataset with read_parquet(complete_directory).
+    """
+    partition_paths = [
+        path for path in sorted(glob(f"{directory}partition_*/")) if glob(f"{path}*")
+    ]
+    if complete_directory is not None:
+        rmtree(complete_directory, ignore_errors=True)
+        makedirs(complete_directory, exist_ok=True)
+
+    num_processes = max(1, min(cpu_count(), len(partition_paths)))
+    with Pool(num_processes) as pool:
+        results = pool.map(
+            aggregate_partition,
+            [
+                (
+                    path,
+                    (
+                        None
+                        if complete_directory is None
+                        else join(
+                            complete_directory, f"{basename(normpath(path))}.parquet"
+                        )
+                    ),
+                )
+                for path in partition_paths
+            ],
+        )
+    for _, metrics in results:
+        merge_metrics(metrics)
+
+    df_herfindahl = concat(
+        [HERFINDAHL_SCHEMA, *[df_partition for df_partition, _ in results]],
+        ignore_index=True,
+    ).sort_values(
+        by=["CZONE", "SIC"], na_position="last", kind="stable", ignore_index=True
+    )
+    print(
+        f"Computing Herfindahl Index by commuting zone and industry complete for {len(partition_paths)} partitions.\n\tDataFrame shape:{df_herfindahl.shape}.\n"
+    )
+    return df_herfindahl
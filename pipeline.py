@@ -0,0 +1,405 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from ast import Import, ImportFrom, parse, walk as walk_tree
+from hashlib import sha256
+from json import dump, dumps, load
+from os import replace, stat, walk
+from os.path import abspath, basename, dirname, exists, isdir, join, relpath, splitext
+from sys import modules
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from pandas import read_parquet
+
+from utils import (
+    REQUIRED_COLUMNS,
+    parse_data,
+    save_data,
+    keep_required_columns,
+)
+from concentration import (
+    CUBE_GEOGRAPHIES,
+    CUBE_SIC_DIGITS,
+    get_concentration_statistics,
+    get_market_shares,
+    get_herfindahl_from_statistics,
+    get_concentration_cube,
+    get_concentration_measures,
+    build_incremental_state,
+    save_incremental_state,
+)
+from bootstrap import bootstrap_herfindahl
+from partition import partition_data, multi_get_partitioned_herfindahl
+from instrumentation import measure, get_metrics, merge_metrics
+from sinks import ExportSink
+from config import D_AND_B_CUBE_PATTERN
+
+
+class Stage(NamedTuple):
+    """
+    Stage of a pipeline: function called with parameters, which reads input paths and writes output paths.
+    A stage depends on the stages producing its inputs. Paths may be files or directories.
+    Exports are Parquet outputs written to .csv and .dta by an ExportSink once the stage is done.
+    """
+
+    name: str
+    function: Callable[..., None]
+    inputs: List[str]
+    outputs: List[str]
+    parameters: Dict[str, Any] = {}
+    exports: List[str] = []
+
+
+def hash_file(file_path: str, known_files: Dict[str, List[Any]]) -> str:
+    """
+    SHA-256 of file content, read in chunks. Hashes are remembered in known_files by size and modification time,
+    so unchanged files are not read again, including across runs when known_files is persisted.
+    """
+    file_stat = stat(file_path)
+    signature = [file_stat.st_size, file_stat.st_mtime_ns]
+    known = known_files.get(file_path)
+    if known is not None and known[:2] == signature:
+        return known[2]
+    digest = sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    known_files[file_path] = [*signature, digest.hexdigest()]
+    return digest.hexdigest()
+
+
+def hash_path(path: str, known_files: Dict[str, List[Any]]) -> Optional[str]:
+    """
+    Content hash of a file, or of the relative paths and contents of all files in a directory.
+    Returns None if path does not exist.
+    """
+    if not exists(path):
+        return None
+    if not isdir(path):
+        return hash_file(path, known_files)
+    digest = sha256()
+    for directory, _, file_names in sorted(walk(path)):
+        for file_name in sorted(file_names):
+            file_path = join(directory, file_name)
+            digest.update(relpath(file_path, path).encode())
+            digest.update(hash_file(file_path, known_files).encode())
+    return digest.hexdigest()
+
+
+# Directory of project modules, whose source is part of stage fingerprints
+PROJECT_DIRECTORY = dirname(abspath(__file__))
+
+
+def get_module_name(module_name: str) -> Optional[str]:
+    """
+    Stable name of a loaded project module, from its file name, so that a module run as __main__
+    has the same name as when imported. Returns None for modules outside the project directory.
+    """
+    file_path = getattr(modules.get(module_name), "__file__", None)
+    if file_path is None or dirname(abspath(file_path)) != PROJECT_DIRECTORY:
+        return None
+    return splitext(basename(file_path))[0]
+
+
+def get_imported_modules(file_path: str) -> List[str]:
+    """
+    Names of top-level modules imported by a Python source file.
+    """
+    with open(file_path) as file:
+        tree = parse(file.read(), filename=file_path)
+    names = []
+    for node in walk_tree(tree):
+        if isinstance(node, Import):
+            names.extend(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ImportFrom) and node.module and not node.level:
+            names.append(node.module.split(".")[0])
+    return names
+
+
+def hash_code(function: Callable[..., Any], known_files: Dict[str, List[Any]]) -> str:
+    """
+    Content hash of the source of the project module defining function and of project modules it imports,
+    transitively, so that editing code a stage runs invalidates its cached outputs.
+    """
+    module_hashes = {}
+    pending = [get_module_name(function.__module__)]
+    while pending:
+        name = pending.pop()
+        file_path = join(PROJECT_DIRECTORY, f"{name}.py")
+        if name is None or name in module_hashes or not exists(file_path):
+            continue
+        module_hashes[name] = hash_file(file_path, known_files)
+        pending.extend(get_imported_modules(file_path))
+    return sha256(dumps(module_hashes, sort_keys=True).encode()).hexdigest()
+
+
+def get_stage_fingerprint(stage: Stage, known_files: Dict[str, List[Any]]) -> str:
+    """
+    Fingerprint of a stage from its name, function, source of the project code it runs,
+    parameters and content hashes of its inputs.
+    """
+    input_hashes = {}
+    for input_path in stage.inputs:
+        input_hashes[input_path] = hash_path(input_path, known_files)
+        if input_hashes[input_path] is None:
+            raise FileNotFoundError(
+                f"Input {input_path} of stage {stage.name} does not exist."
+            )
+    fingerprint = dumps(
+        {
+            "name": stage.name,
+            "function": f"{get_module_name(stage.function.__module__)}.{stage.function.__qualname__}",
+            "code": hash_code(stage.function, known_files),
+            "parameters": stage.parameters,
+            "inputs": input_hashes,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return sha256(fingerprint.encode()).hexdigest()
+
+
+def is_stage_cached(stage: Stage, fingerprint: str, cache: Dict[str, Any]) -> bool:
+    """
+    A stage's cached outputs are valid if it last ran with the same fingerprint
+    and its outputs still exist with the content it wrote.
+    """
+    record = cache["stages"].get(stage.name)
+    return (
+        record is not None
+        and record["fingerprint"] == fingerprint
+        and all(
+            hash_path(output, cache["files"]) == record["outputs"].get(output)
+            for output in stage.outputs
+        )
+    )
+
+
+def read_pipeline_cache(file_path: str) -> Dict[str, Any]:
+    """
+    Read pipeline cache of stage fingerprints and known file hashes, empty if missing.
+    """
+    if not exists(file_path):
+        return {"stages": {}, "files": {}}
+    with open(file_path, "r") as file:
+        return load(file)
+
+
+def write_pipeline_cache(cache: Dict[str, Any], file_path: str) -> None:
+    """
+    Write pipeline cache to a temporary file and rename it, so an interrupted run leaves a valid cache.
+    """
+    with open(f"{file_path}.tmp", "w") as file:
+        dump(cache, file)
+    replace(f"{file_path}.tmp", file_path)
+
+
+def run_stage(stage: Stage) -> Dict[str, Dict[str, Any]]:
+    """
+    Run stage in a pool worker, measured as a whole under stage name.
+    Returns metrics recorded in the worker during the stage.
+    """
+    get_metrics(reset=True)  # drop metrics of previous tasks of worker
+    with measure(f"stage_{stage.name}"):
+        stage.function(**stage.parameters)
+    return get_metrics(reset=True)
+
+
+def submit_exports(stage: Stage, sink: Optional[ExportSink]) -> None:
+    """
+    Queue exports of stage's Parquet outputs to sink, if any.
+    """
+    if sink is not None:
+        for file_path_parquet in stage.exports:
+            sink.submit(file_path_parquet)
+
+
+def run_pipeline(
+    stages: List[Stage],
+    cache_path: str,
+    max_workers: Optional[int] = None,
+    sink: Optional[ExportSink] = None,
+) -> Dict[str, str]:
+    """
+    Run stages in dependency order, skipping stages whose cached outputs are still valid.
+    A stage runs once all stages producing its inputs are done, so independent branches
+    run concurrently in a pool of processes. A stage downstream of a stage that reran is only
+    rerun if its inputs changed content. The cache is updated after each completed stage,
+    and metrics recorded in workers are merged into metrics of this process.
+    If sink is given, exports of each stage are queued to it as soon as the stage is done or found cached,
+    so they are written in the background while downstream stages run.
+    Returns status of each stage: ran or cached.
+    """
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    dependencies = {
+        stage.name: {producers[path] for path in stage.inputs if path in producers}
+        for stage in stages
+    }
+    cache = read_pipeline_cache(cache_path)
+    pending = {stage.name: stage for stage in stages}
+    done = set()
+    running = {}
+    statuses = {}
+
+    with ProcessPoolExecutor(max_workers or len(stages)) as executor:
+        while pending or running:
+            while True:
+                ready = [
+                    stage
+                    for name, stage in pending.items()
+                    if dependencies[name] <= done
+                ]
+                if not ready:
+                    break
+                for stage in ready:
+                    del pending[stage.name]
+                    fingerprint = get_stage_fingerprint(stage, cache["files"])
+                    if is_stage_cached(stage, fingerprint, cache):
+                        print(
+                            f"Stage {stage.name} skipped, cached outputs are valid.\n"
+                        )
+                        done.add(stage.name)
+                        statuses[stage.name] = "cached"
+                        submit_exports(stage, sink)
+                    else:
+                        print(f"Stage {stage.name} started.\n")
+                        future = executor.submit(run_stage, stage)
+                        running[future] = (stage, fingerprint)
+            if not running:
+                if pending:
+                    raise ValueError(
+                        f"Stages {sorted(pending)} have circular dependencies."
+                    )
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage, fingerprint = running.pop(future)
+                merge_metrics(future.result())
+                cache["stages"][stage.name] = {
+                    "fingerprint": fingerprint,
+                    "outputs": {
+                        output: hash_path(output, cache["files"])
+                        for output in stage.outputs
+                    },
+                }
+                write_pipeline_cache(cache, cache_path)
+                done.add(stage.name)
+                statuses[stage.name] = "ran"
+                print(f"Stage {stage.name} complete.\n")
+                submit_exports(stage, sink)
+    return statuses
+
+
+def parse_stage(
+    read_file_path: str, write_file_path: str, write_directory_records: str
+) -> None:
+    """
+    Parse D&B data according to guideline to Parquet, and to memory-mapped record store
+    with DUNS and ZIP and SIC indexes, memory-mapping file and using all available cores on line-aligned byte ranges.
+    """
+    parse_data(
+        read_file_path,
+        write_file_path,
+        memory_map=True,
+        write_directory_records=write_directory_records,
+    )
+
+
+def trim_stage(read_file_path: str, write_file_path: str) -> None:
+    """
+    Keep required columns of D&B data. D&B IDs, ZIP and SIC codes are stored as integers,
+    and only zero-filled on output by exports, so there is no separate zero-filling stage.
+    """
+    df = read_parquet(read_file_path, columns=REQUIRED_COLUMNS)
+    keep_required_columns(df).to_parquet(write_file_path, compression="zstd")
+
+
+def aggregate_stage(read_file_path: str, write_file_path: str) -> None:
+    """
+    Compute total firms, employees and sales by commuting zone and industry in a single pass,
+    and save D&B data complete with market shares of participants.
+    """
+    df_ready = read_parquet(read_file_path)
+    df_statistics, cell_codes = get_concentration_statistics(df_ready)
+    save_data(get_market_shares(df_ready, df_statistics, cell_codes), write_file_path)
+
+
+def herfindahl_stage(read_file_path: str, write_file_path: str) -> None:
+    """
+    Compute and save Herfindahl Index by commuting zone and industry: CZONE, SIC, HHI_EMP, HHI_SALES.
+    """
+    df_statistics, _ = get_concentration_statistics(read_parquet(read_file_path))
+    save_data(get_herfindahl_from_statistics(df_statistics), write_file_path)
+
+
+def get_cube_paths() -> List[str]:
+    """
+    Paths of Herfindahl Index cube datasets written by cube_stage(), without extension.
+    """
+    return [
+        D_AND_B_CUBE_PATTERN.format(geography=geography.lower(), digits=digits)
+        for geography in CUBE_GEOGRAPHIES
+        for digits in CUBE_SIC_DIGITS
+    ]
+
+
+def cube_stage(read_file_path: str) -> None:
+    """
+    Compute and save Herfindahl Index by county, commuting zone and state, and by 2-, 3- and 4-digit industry,
+    rolled up from statistics accumulated once at the finest grain.
+    """
+    cube = get_concentration_cube(read_parquet(read_file_path))
+    for df_cube, file_path in zip(cube.values(), get_cube_paths()):
+        save_data(df_cube, f"{file_path}.parquet")
+
+
+def measures_stage(read_file_path: str, write_file_path: str) -> None:
+    """
+    Compute and save suite of concentration measures by commuting zone and industry, for employees and sales,
+    as one wide table: Herfindahl-Hirschman Index, CR4 and CR8 concentration ratios, entropy, Theil index and Gini coefficient.
+    """
+    save_data(get_concentration_measures(read_parquet(read_file_path)), write_file_path)
+
+
+def bootstrap_stage(read_file_path: str, write_file_path: str) -> None:
+    """
+    Compute and save bootstrap percentile intervals of Herfindahl Index by commuting zone and industry,
+    with a fixed seed so intervals are reproducible.
+    """
+    save_data(
+        bootstrap_herfindahl(read_parquet(read_file_path), num_replicates=1000, seed=0),
+        write_file_path,
+    )
+
+
+def state_stage(read_file_path: str, directory: str) -> None:
+    """
+    Persist sufficient statistics by commuting zone and industry and establishments by D&B ID,
+    so record-level deltas can be applied with apply_deltas() without a full rerun.
+    """
+    save_incremental_state(
+        build_incremental_state(read_parquet(read_file_path)), directory
+    )
+
+
+def partition_stage(
+    read_file_path: str, lookup_path: str, directory: str, num_partitions: int = 64
+) -> None:
+    """
+    Parse D&B text file in byte ranges and hash-partition establishments by commuting zone
+    into on-disk partitions, for D&B files larger than memory.
+    """
+    partition_data(read_file_path, lookup_path, directory, num_partitions)
+
+
+def partitioned_herfindahl_stage(
+    read_directory: str, complete_directory: str, write_file_path: str
+) -> None:
+    """
+    Aggregate each partition of D&B data independently and in parallel, saving establishments complete with
+    market shares by partition, and save Herfindahl Index by commuting zone and industry, which is the same
+    as computed by herfindahl_stage() from the whole data: CZONE, SIC, HHI_EMP, HHI_SALES.
+    """
+    save_data(
+        multi_get_partitioned_herfindahl(read_directory, complete_directory),
+        write_file_path,
+    )
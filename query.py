@@ -0,0 +1,303 @@
+from pandas import read_parquet
+from numpy import argsort, float64, int64, isnan, ndarray, searchsorted
+
+from functools import lru_cache
+from os.path import exists
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps
+from threading import Lock, Thread
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from concentration import CUBE_GEOGRAPHIES, CUBE_SIC_DIGITS
+from config import D_AND_B_HERFINDAHL_PARQUET, D_AND_B_CUBE_PATTERN
+
+# Code of missing geography or SIC codes in market keys, which sorts before all codes
+MISSING_CODE = -1
+
+# Largest geography or SIC code that can be encoded in market keys
+MAX_CODE = 99998
+
+
+def get_market_keys(codes: ndarray, other_codes: ndarray) -> ndarray:
+    """
+    Encode pairs of codes, geography and SIC or SIC and geography, into one integer key per market,
+    sorted by first then second code, where missing codes sort first.
+    """
+    return (codes.astype(int64) + 1) * 100000 + other_codes.astype(int64) + 1
+
+
+def check_codes(*codes: int) -> None:
+    """
+    Raise ValueError unless codes of a query are MISSING_CODE or from 0 to MAX_CODE,
+    so they can be encoded in market keys.
+    """
+    for code in codes:
+        if not MISSING_CODE <= code <= MAX_CODE:
+            raise ValueError(f"Codes must be from {MISSING_CODE} to {MAX_CODE}.")
+
+
+def get_cube_file_path(geography: str, sic_digits: int) -> str:
+    """
+    Path of Herfindahl Index dataset of geography and SIC digits: d_and_b_herfindahl.parquet for commuting zones
+    and 4-digit industries, written by both main files, otherwise the cube dataset written by cube_stage().
+    """
+    if (geography, sic_digits) == ("CZONE", 4):
+        return D_AND_B_HERFINDAHL_PARQUET
+    return f"{D_AND_B_CUBE_PATTERN.format(geography=geography.lower(), digits=sic_digits)}.parquet"
+
+
+def load_indexed_cube(file_path: str) -> Dict[str, Any]:
+    """
+    Load Herfindahl Index dataset with columns geography, SIC and measures into arrays indexed for queries:
+    keys sorted by geography then SIC for point lookups and geography range scans, keys sorted by SIC then geography
+    with row numbers for SIC range scans, and row numbers by descending value of each measure for top-k queries.
+    Missing codes are MISSING_CODE.
+    """
+    df = read_parquet(file_path)
+    geography, sic, *measures = df.columns
+    geographies = df[geography].to_numpy(dtype=int64, na_value=MISSING_CODE)
+    sics = df[sic].to_numpy(dtype=int64, na_value=MISSING_CODE)
+    values = {measure: df[measure].to_numpy(dtype=float64) for measure in measures}
+    keys = get_market_keys(geographies, sics)
+    order = argsort(keys, kind="stable")
+    sic_keys = get_market_keys(sics, geographies)
+    sic_order = argsort(sic_keys, kind="stable")
+    return {
+        "geography": geography,
+        "keys": keys[order],
+        "geographies": geographies[order],
+        "sics": sics[order],
+        "values": {measure: value[order] for measure, value in values.items()},
+        "sic_keys": sic_keys[sic_order],
+        "sic_rows": argsort(order)[sic_order],
+        "ranks": {
+            measure: argsort(-value[order], kind="stable")  # NaN sorts last
+            for measure, value in values.items()
+        },
+    }
+
+
+class HerfindahlQuery:
+    """
+    Query layer over Herfindahl Index by geography and industry, answering point lookups, geography or SIC range scans
+    and top-k most concentrated markets with binary searches and slices of arrays, without pandas.
+    Datasets of each geography and SIC digits are loaded and indexed lazily on their first query,
+    and results of the last cache_size queries are kept in an LRU cache, so repeated queries are dictionary lookups.
+    Results are tuples of dictionaries shared through the cache, which shouldn't be modified.
+    Safe to use from many threads, as by the HTTP endpoint of serve().
+    """
+
+    def __init__(self, cache_size: int = 4096) -> None:
+        self.cubes: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        self.lock = Lock()
+        self.cached_query = lru_cache(maxsize=cache_size)(self.query)
+
+    def get_cube(self, geography: str, sic_digits: int) -> Dict[str, Any]:
+        """
+        Indexed dataset of geography and SIC digits, loaded on first use.
+        Raises FileNotFoundError if the dataset wasn't written, e.g. cube datasets when running out of core.
+        """
+        if geography not in CUBE_GEOGRAPHIES or sic_digits not in CUBE_SIC_DIGITS:
+            raise ValueError(
+                f"Geography must be one of {CUBE_GEOGRAPHIES} and SIC digits one of {CUBE_SIC_DIGITS}."
+            )
+        with self.lock:
+            if (geography, sic_digits) not in self.cubes:
+                file_path = get_cube_file_path(geography, sic_digits)
+                if not exists(file_path):
+                    raise FileNotFoundError(
+                        f"No Herfindahl Index dataset of {geography} and {sic_digits}-digit SIC at {file_path}."
+                    )
+                self.cubes[(geography, sic_digits)] = load_indexed_cube(file_path)
+            return self.cubes[(geography, sic_digits)]
+
+    def get_markets(
+        self, cube: Dict[str, Any], rows: Any
+    ) -> Tuple[Dict[str, Any], ...]:
+        """
+        Markets at rows of indexed dataset as dictionaries of geography, SIC and measures,
+        with missing codes and values as None.
+        """
+        geographies, sics = cube["geographies"][rows], cube["sics"][rows]
+        values = {measure: value[rows] for measure, value in cube["values"].items()}
+        return tuple(
+            {
+                cube["geography"]: (
+                    None if geographies[i] == MISSING_CODE else int(geographies[i])
+                ),
+                "SIC": None if sics[i] == MISSING_CODE else int(sics[i]),
+                **{
+                    measure: None if isnan(value[i]) else float(value[i])
+                    for measure, value in values.items()
+                },
+            }
+            for i in range(len(geographies))
+        )
+
+    def query(
+        self, kind: str, geography: str, sic_digits: int, *args: Any
+    ) -> Tuple[Dict[str, Any], ...]:
+        """
+        Answer query of kind get, scan, scan_sic or top with args, see methods of the same name.
+        This lower-level method is called through the LRU cache.
+        """
+        cube = self.get_cube(geography, sic_digits)
+        keys = cube["keys"]
+        if kind in ["get", "scan", "scan_sic"]:
+            check_codes(*args)
+        if kind == "get":
+            code, sic = args
+            key = get_market_keys(int64(code), int64(sic))
+            start = searchsorted(keys, key, "left")
+            return self.get_markets(cube, slice(start, searchsorted(keys, key + 1)))
+        if kind == "scan":
+            low, high = args
+            start = searchsorted(keys, get_market_keys(int64(low), int64(MISSING_CODE)))
+            end = searchsorted(
+                keys, get_market_keys(int64(high) + 1, int64(MISSING_CODE))
+            )
+            return self.get_markets(cube, slice(start, end))
+        if kind == "scan_sic":
+            low, high = args
+            sic_keys = cube["sic_keys"]
+            start = searchsorted(
+                sic_keys, get_market_keys(int64(low), int64(MISSING_CODE))
+            )
+            end = searchsorted(
+                sic_keys, get_market_keys(int64(high) + 1, int64(MISSING_CODE))
+            )
+            return self.get_markets(cube, cube["sic_rows"][start:end])
+        if kind == "top":
+            k, measure = args
+            if k < 0:
+                raise ValueError("Number of markets k must not be negative.")
+            if measure not in cube["ranks"]:
+                raise ValueError(f"Measure must be one of {list(cube['ranks'])}.")
+            return self.get_markets(cube, cube["ranks"][measure][:k])
+        raise ValueError(f"Unknown query {kind}.")
+
+    def get(
+        self, code: int, sic: int, geography: str = "CZONE", sic_digits: int = 4
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Herfindahl Index of market of geography code and SIC code, or None if there is no such market.
+        """
+        markets = self.cached_query("get", geography, sic_digits, code, sic)
+        return markets[0] if markets else None
+
+    def scan(
+        self, low: int, high: int, geography: str = "CZONE", sic_digits: int = 4
+    ) -> Tuple[Dict[str, Any], ...]:
+        """
+        Herfindahl Index of all markets with geography code from low to high inclusive, ordered by geography and SIC.
+        """
+        return self.cached_query("scan", geography, sic_digits, low, high)
+
+    def scan_sic(
+        self, low: int, high: int, geography: str = "CZONE", sic_digits: int = 4
+    ) -> Tuple[Dict[str, Any], ...]:
+        """
+        Herfindahl Index of all markets with SIC code from low to high inclusive, ordered by SIC and geography.
+        """
+        return self.cached_query("scan_sic", geography, sic_digits, low, high)
+
+    def top(
+        self,
+        k: int = 10,
+        measure: str = "HHI_EMP",
+        geography: str = "CZONE",
+        sic_digits: int = 4,
+    ) -> Tuple[Dict[str, Any], ...]:
+        """
+        k most concentrated markets by measure, in descending order.
+        """
+        return self.cached_query("top", geography, sic_digits, k, measure)
+
+
+def get_handler(service: HerfindahlQuery) -> type:
+    """
+    HTTP request handler answering GET requests with JSON from service:
+    /get?code=&sic=, /scan?low=&high=, /scan_sic?low=&high=, /top?k=&measure=,
+    each with optional geography (CZONE, FIPS or STATE) and digits (4, 3 or 2).
+    Invalid parameters get status 400, and markets of a dataset that wasn't written get status 404.
+    """
+
+    class HerfindahlHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            url = urlparse(self.path)
+            parameters = {
+                name: values[-1] for name, values in parse_qs(url.query).items()
+            }
+            try:
+                options = {
+                    "geography": parameters.get("geography", "CZONE").upper(),
+                    "sic_digits": int(parameters.get("digits", 4)),
+                }
+                if url.path == "/get":
+                    result = service.get(
+                        int(parameters["code"]), int(parameters["sic"]), **options
+                    )
+                elif url.path in ["/scan", "/scan_sic"]:
+                    result = getattr(service, url.path[1:])(
+                        int(parameters["low"]), int(parameters["high"]), **options
+                    )
+                elif url.path == "/top":
+                    result = service.top(
+                        int(parameters.get("k", 10)),
+                        parameters.get("measure", "HHI_EMP"),
+                        **options,
+                    )
+                else:
+                    self.send_json(404, {"error": f"Unknown path {url.path}."})
+                    return
+            except FileNotFoundError as error:
+                self.send_json(404, {"error": str(error)})
+                return
+            except KeyError as error:
+                self.send_json(400, {"error": f"Missing parameter {error}."})
+                return
+            except ValueError as error:
+                self.send_json(400, {"error": str(error)})
+                return
+            self.send_json(200, result)
+
+        def send_json(self, status: int, body: Any) -> None:
+            content = dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass  # don't log every request to stderr
+
+    return HerfindahlHandler
+
+
+def serve(
+    service: Optional[HerfindahlQuery] = None,
+    host: str = "127.0.0.1",
+    port: int = 8050,
+    background: bool = True,
+) -> ThreadingHTTPServer:
+    """
+    Serve queries of service on a local HTTP endpoint, with one thread per request,
+    from a background thread if background, otherwise blocking until interrupted.
+    Returns server, stopped with shutdown().
+    """
+    server = ThreadingHTTPServer(
+        (host, port), get_handler(service or HerfindahlQuery())
+    )
+    print(f"Herfindahl Index query endpoint listening on http://{host}:{port}.\n")
+    if background:
+        Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
+
+
+if __name__ == "__main__":
+
+    serve(background=False)
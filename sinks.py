@@ -0,0 +1,112 @@
+from pandas import read_parquet
+
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from os import replace, stat
+from os.path import exists, splitext
+from typing import Iterable, List, Optional
+
+from utils import format_keys
+
+# File extension of each export format, compressed .csv is written with gzip
+EXPORT_FORMATS = {"csv": ".csv", "csv.gz": ".csv.gz", "stata": ".dta"}
+
+
+def get_export_path(file_path_parquet: str, export_format: str) -> str:
+    """
+    Path of export of a Parquet dataset in export format, next to it with the extension of EXPORT_FORMATS,
+    e.g. d_and_b_herfindahl.dta for d_and_b_herfindahl.parquet.
+    """
+    return f"{splitext(file_path_parquet)[0]}{EXPORT_FORMATS[export_format]}"
+
+
+def is_export_current(file_path_parquet: str, file_path: str) -> bool:
+    """
+    An export is current if it exists and was written after its Parquet dataset.
+    """
+    return (
+        exists(file_path)
+        and stat(file_path).st_mtime_ns >= stat(file_path_parquet).st_mtime_ns
+    )
+
+
+def write_export(file_path_parquet: str, export_format: str) -> str:
+    """
+    Read Parquet dataset and write it in export format with leading zeros of keys filled.
+    The export is written to a temporary file and renamed, so a partial export is never left at its path.
+    Returns path of export.
+    This lower-level function is called by ExportSink workers.
+    """
+    file_path = get_export_path(file_path_parquet, export_format)
+    df_export = format_keys(read_parquet(file_path_parquet))
+    if export_format == "stata":
+        df_export.to_stata(f"{file_path}.tmp", write_index=False)
+    else:
+        df_export.to_csv(
+            f"{file_path}.tmp",
+            index=False,
+            compression="gzip" if export_format == "csv.gz" else None,
+        )
+    replace(f"{file_path}.tmp", file_path)
+    print(f"Export saved to {file_path}.\n")
+    return file_path
+
+
+def report_export_error(future: Future) -> None:
+    """
+    Print error of a failed export, which would otherwise only be raised when its result is read.
+    """
+    if future.exception() is not None:
+        print(f"Export failed: {future.exception()!r}.\n")
+
+
+class ExportSink:
+    """
+    Output sink writing .csv, gzip-compressed .csv and .dta exports of Parquet datasets in the background,
+    with one task per dataset and format in a pool of processes, or of threads if threads is True.
+    Slow exports such as to_stata() on text columns run while the next stages are computing,
+    and are off the critical path of the pipeline, which only reads Parquet.
+    """
+
+    def __init__(
+        self,
+        export_formats: Iterable[str] = ("csv", "stata"),
+        max_workers: Optional[int] = None,
+        threads: bool = False,
+    ) -> None:
+        self.export_formats = list(export_formats)
+        unknown = set(self.export_formats) - set(EXPORT_FORMATS)
+        if unknown:
+            raise ValueError(
+                f"Export formats {sorted(unknown)} are not in {list(EXPORT_FORMATS)}."
+            )
+        self.executor = (ThreadPoolExecutor if threads else ProcessPoolExecutor)(
+            max_workers
+        )
+        self.futures: List[Future] = []
+
+    def submit(self, file_path_parquet: str) -> None:
+        """
+        Queue exports of Parquet dataset in each format of the sink, unless the export is current.
+        """
+        for export_format in self.export_formats:
+            if is_export_current(
+                file_path_parquet, get_export_path(file_path_parquet, export_format)
+            ):
+                continue
+            future = self.executor.submit(
+                write_export, file_path_parquet, export_format
+            )
+            future.add_done_callback(report_export_error)
+            self.futures.append(future)
+
+    def close(self, wait: bool = False) -> List[Future]:
+        """
+        Stop accepting exports. Queued exports are still written, and the interpreter waits for them before exiting.
+        If wait is True, block until all exports are written and raise the error of any failed export.
+        Returns futures of exports, whose results are export paths.
+        """
+        self.executor.shutdown(wait=wait)
+        if wait:
+            for future in self.futures:
+                future.result()
+        return self.futures
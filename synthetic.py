@@ -0,0 +1,240 @@
+from pandas import DataFrame
+from numpy import (
+    arange,
+    array,
+    concatenate,
+    cumsum,
+    full,
+    int64,
+    ndarray,
+    ones,
+    uint8,
+    minimum,
+)
+from numpy.random import Generator, default_rng
+
+from os import makedirs
+from os.path import dirname
+from typing import Dict, List
+
+from utils import D_AND_B_COLUMNS
+from config import (
+    D_AND_B_TEXT,
+    CZONE_CSV,
+    ZIP_CODE_CSV,
+    MAPPING_DIR,
+    MARKET_DIR,
+)
+
+# Number of rows of synthetic D&B data by size label
+SYNTHETIC_SIZES = {"1m": 1_000_000, "10m": 10_000_000, "50m": 50_000_000}
+
+# State FIPS codes and abbreviations of the 50 states and DC
+STATES = {
+    1: "AL", 2: "AK", 4: "AZ", 5: "AR", 6: "CA", 8: "CO", 9: "CT", 10: "DE", 11: "DC",
+    12: "FL", 13: "GA", 15: "HI", 16: "ID", 17: "IL", 18: "IN", 19: "IA", 20: "KS",
+    21: "KY", 22: "LA", 23: "ME", 24: "MD", 25: "MA", 26: "MI", 27: "MN", 28: "MS",
+    29: "MO", 30: "MT", 31: "NE", 32: "NV", 33: "NH", 34: "NJ", 35: "NM", 36: "NY",
+    37: "NC", 38: "ND", 39: "OH", 40: "OK", 41: "OR", 42: "PA", 44: "RI", 45: "SC",
+    46: "SD", 47: "TN", 48: "TX", 49: "UT", 50: "VT", 51: "VA", 53: "WA", 54: "WV",
+    55: "WI", 56: "WY",
+}  # fmt: skip
+
+STREETS = ["MAIN ST", "OAK AVE", "PARK RD", "1ST ST", "ELM ST", "BROADWAY", "HWY 61"]
+CITIES = ["SPRINGFIELD", "FRANKLIN", "GREENVILLE", "BRISTOL", "CLINTON", "SALEM"]
+
+
+def get_zipf_weights(rng: Generator, num_values: int, exponent: float) -> ndarray:
+    """
+    Probabilities of num_values values following Zipf's law with exponent,
+    shuffled so frequent values are spread over the code range.
+    """
+    weights = 1 / arange(1, num_values + 1) ** exponent
+    return rng.permutation(weights / weights.sum())
+
+
+def generate_crosswalk(rng: Generator, num_counties: int = 3000) -> DataFrame:
+    """
+    Generate FIPS commuting zone crosswalk data like David Dorn's: cty_fips, czone.
+    Counties of a state have odd county codes, and consecutive counties are grouped
+    into commuting zones of about 3 counties.
+    """
+    state_codes = array(list(STATES))
+    num_state_counties = (
+        rng.multinomial(
+            num_counties - len(state_codes), ones(len(state_codes)) / len(state_codes)
+        )
+        + 1
+    )
+    fips = concatenate(
+        [
+            state_code * 1000 + 2 * arange(num) + 1
+            for state_code, num in zip(state_codes, num_state_counties)
+        ]
+    )
+    czones = 100 + cumsum(rng.random(len(fips)) < 0.3)
+    return DataFrame({"cty_fips": fips, "czone": czones})
+
+
+def generate_zip_codes(
+    rng: Generator, df_crosswalk: DataFrame, num_zips: int = 40000
+) -> DataFrame:
+    """
+    Generate ZIP code data like ZipCodesDeluxe2009: zipcode, state, statefips, countyfips,
+    where one in ten ZIPs spans a second county.
+    """
+    zips = rng.choice(arange(501, 100000), size=num_zips, replace=False)
+    zips.sort()
+    counties = df_crosswalk["cty_fips"].to_numpy()
+    spanning = zips[rng.random(num_zips) < 0.1]
+    zipcodes = concatenate([zips, spanning])
+    fips = rng.choice(counties, size=len(zipcodes))
+    df_zip = DataFrame(
+        {
+            "zipcode": zipcodes,
+            "state": [STATES[state_code] for state_code in fips // 1000],
+            "statefips": fips // 1000,
+            "countyfips": fips % 1000,
+        }
+    )
+    return df_zip.sort_values(by="zipcode", kind="stable", ignore_index=True)
+
+
+def get_digits(values: ndarray, width: int) -> ndarray:
+    """
+    Zero-filled ASCII digits of non-negative integers as array of bytes with one row per value.
+    """
+    powers = 10 ** arange(width - 1, -1, -1, dtype=int64)
+    return ((values[:, None] // powers) % 10 + ord("0")).astype(uint8)
+
+
+def get_text(choices: List[str], indices: ndarray, width: int) -> ndarray:
+    """
+    Left-justified ASCII text of choices at indices as array of bytes with one row per index.
+    """
+    text = array([choice.ljust(width)[:width] for choice in choices], dtype=f"S{width}")
+    return text.view(uint8).reshape(len(choices), width)[indices]
+
+
+def generate_records(
+    rng: Generator,
+    df_zip: DataFrame,
+    zip_weights: ndarray,
+    sic_codes: ndarray,
+    sic_weights: ndarray,
+    start: int,
+    num_rows: int,
+) -> ndarray:
+    """
+    Generate num_rows lines of fixed-width D&B data laid out according to D_AND_B_COLUMNS,
+    starting at row number start, as array of bytes with one row per line filled column by column.
+    ZIP and SIC codes follow skewed Zipf distributions and employees and sales per employee are log-normal.
+    About 1% of ZIPs are blank and 1% are not in the ZIP code data,
+    3% of employees and 5% of sales are missing. D&B IDs are unique across rows.
+    """
+    width = max(end for _, _, end in D_AND_B_COLUMNS)
+    lines = full((num_rows, width + 1), ord(" "), dtype=uint8)
+    lines[:, -1] = ord("\n")
+    columns = {name: (begin - 1, end) for name, begin, end in D_AND_B_COLUMNS}
+    rows = start + arange(num_rows, dtype=int64)
+
+    def put(name: str, values: ndarray, offset: int = 0) -> None:
+        position = columns[name][0] + offset
+        lines[:, position : position + values.shape[1]] = values
+
+    def blank(name: str, mask: ndarray) -> None:
+        lines[mask, columns[name][0] : columns[name][1]] = ord(" ")
+
+    put("DUNS", get_digits(1 + rows * 19 + rng.integers(0, 19, num_rows), 9))
+    put("DCOMP", get_text(["FIRM"], full(num_rows, 0), 5))
+    put("DCOMP", get_digits(rows, 9), offset=5)
+    put("DSTREET", get_digits(rng.integers(1000, 10000, num_rows), 4))
+    put(
+        "DSTREET",
+        get_text(STREETS, rng.integers(0, len(STREETS), num_rows), 20),
+        offset=5,
+    )
+    put("DCITY", get_text(CITIES, rng.integers(0, len(CITIES), num_rows), 20))
+
+    zip_indices = rng.choice(len(df_zip), size=num_rows, p=zip_weights)
+    zips = df_zip["zipcode"].to_numpy()[zip_indices]
+    states = list(STATES.values())
+    state_indices = (
+        df_zip["state"].map({state: i for i, state in enumerate(states)}).to_numpy()
+    )
+    put("DSTATEAB", get_text(states, state_indices[zip_indices], 2))
+    unmapped = rng.random(num_rows) < 0.01
+    zips[unmapped] = rng.integers(501, 100000, int(unmapped.sum()))
+    put("DZIP5", get_digits(zips, 5))
+    blank("DZIP5", rng.random(num_rows) < 0.01)
+
+    employees = rng.lognormal(1.5, 1.3, num_rows).astype(int64)
+    sales = minimum(
+        employees * rng.lognormal(11.5, 0.8, num_rows), 10**15 - 1
+    ).astype(int64)
+    put("DEMTLHER", get_digits(employees, 9))
+    blank("DEMTLHER", rng.random(num_rows) < 0.03)
+    put("DSALESVO", get_digits(sales, 15))
+    blank("DSALESVO", rng.random(num_rows) < 0.05)
+
+    sics = sic_codes[rng.choice(len(sic_codes), size=num_rows, p=sic_weights)]
+    put("DPRIMSI", get_digits(sics, 4))
+    return lines
+
+
+def get_synthetic_paths(directory: str) -> Dict[str, str]:
+    """
+    Paths of synthetic D&B text file, crosswalk and ZIP code data under directory, laid out as in config.py.
+    """
+    return {
+        "text": f"{directory}{D_AND_B_TEXT}",
+        "crosswalk": f"{directory}{CZONE_CSV}",
+        "zip": f"{directory}{ZIP_CODE_CSV}",
+    }
+
+
+def generate_synthetic_data(
+    directory: str, num_rows: int, seed: int = 0, chunk_size: int = 1_000_000
+) -> Dict[str, str]:
+    """
+    Write synthetic D&B text file of num_rows rows with matching commuting zone crosswalk and ZIP code data
+    under directory, laid out as in config.py so main files can be run from directory.
+    Records are generated and appended in chunks of chunk_size rows to bound memory.
+    Returns paths of D&B text file, crosswalk and ZIP code data.
+    """
+    rng = default_rng(seed)
+    paths = get_synthetic_paths(directory)
+    for path in [
+        *paths.values(),
+        f"{directory}{MAPPING_DIR}",
+        f"{directory}{MARKET_DIR}",
+    ]:
+        makedirs(dirname(path), exist_ok=True)
+
+    df_crosswalk = generate_crosswalk(rng)
+    df_crosswalk.to_csv(paths["crosswalk"], index=False)
+    df_zip = generate_zip_codes(rng, df_crosswalk)
+    df_zip.to_csv(paths["zip"], index=False)
+
+    df_unique_zip = df_zip.drop_duplicates(subset="zipcode", ignore_index=True)
+    zip_weights = get_zipf_weights(rng, len(df_unique_zip), 1.1)
+    sic_codes = rng.choice(arange(100, 10000), size=1000, replace=False)
+    sic_weights = get_zipf_weights(rng, len(sic_codes), 1.2)
+
+    with open(paths["text"], "wb") as file:
+        for start in range(0, num_rows, chunk_size):
+            file.write(
+                generate_records(
+                    rng,
+                    df_unique_zip,
+                    zip_weights,
+                    sic_codes,
+                    sic_weights,
+                    start,
+                    min(chunk_size, num_rows - start),
+                )
+            )
+    print(
+        f"Synthetic D&B data generated.\n\t{num_rows} rows, {len(df_crosswalk)} counties, {len(df_unique_zip)} ZIPs.\n"
+    )
+    return paths
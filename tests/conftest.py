@@ -0,0 +1,110 @@
+from pytest import fixture
+from pandas import read_parquet
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from synthetic import generate_synthetic_data
+from utils import (
+    REQUIRED_COLUMNS,
+    assign_commuting_zones,
+    build_zip_lookup,
+    get_zip_mapping,
+    keep_required_columns,
+    load_zip_lookup,
+    parse_data,
+    save_zip_lookup,
+)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answer GET and POST requests with the response of the server's respond function.
+    """
+
+    def handle_request(self) -> None:
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.lock:
+            self.server.requests.append((self.path, dict(self.headers), body))
+        status, headers, content = self.server.respond(self, body)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = handle_request
+
+    def log_message(self, format: str, *args) -> None:
+        pass  # don't log every request to stderr
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    Local stand-in for US Census Geocoder endpoints on a free port, answering each request with
+    respond(handler, body), which returns status, headers and content, and recording path, headers and body of requests.
+    """
+
+    def __init__(
+        self, respond: Callable[..., Tuple[int, Dict[str, str], bytes]]
+    ) -> None:
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.respond = respond
+        self.requests: List[Tuple[str, Dict[str, str], bytes]] = []
+        self.lock = Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/geocoder"
+
+
+@fixture
+def stub_server() -> Iterator[Callable[..., StubServer]]:
+    """
+    Start stub servers answering with the given respond function, shut down after the test.
+    """
+    servers = []
+
+    def start(respond: Callable[..., Tuple[int, Dict[str, str], bytes]]) -> StubServer:
+        server = StubServer(respond)
+        Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@fixture(scope="session")
+def synthetic_data(tmp_path_factory) -> Dict[str, str]:
+    """
+    Synthetic D&B text file of 20,000 rows with crosswalk and ZIP code data, parsed to Parquet,
+    and ZIP lookup index, shared by tests of the session. Returns paths by name.
+    """
+    directory = f"{tmp_path_factory.mktemp('synthetic')}/"
+    paths = generate_synthetic_data(directory, 20_000)
+    paths["parquet"] = f"{directory}d_and_b.parquet"
+    paths["lookup"] = f"{directory}zip_lookup.npy"
+    parse_data(paths["text"], paths["parquet"])
+    save_zip_lookup(
+        build_zip_lookup(get_zip_mapping(paths["zip"], paths["crosswalk"])),
+        paths["lookup"],
+    )
+    return paths
+
+
+@fixture
+def df_ready(synthetic_data):
+    """
+    Establishments of synthetic D&B data with required columns, FIPS and CZONE, as read by aggregate stages.
+    """
+    return assign_commuting_zones(
+        keep_required_columns(
+            read_parquet(synthetic_data["parquet"], columns=REQUIRED_COLUMNS)
+        ),
+        load_zip_lookup(synthetic_data["lookup"]),
+    )
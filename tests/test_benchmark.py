@@ -0,0 +1,21 @@
+from benchmark import compare_to_baseline
+
+
+def get_result(seconds, memory):
+    return {"wall_seconds": seconds, "peak_memory_mb": memory}
+
+
+def test_small_memory_differences_are_not_regressions():
+    baseline = {"write_csv": get_result(1.0, 0.0), "parse": get_result(1.0, 100.0)}
+    results = {"write_csv": get_result(1.0, 0.3), "parse": get_result(1.0, 140.0)}
+    assert compare_to_baseline(results, baseline) == []
+
+
+def test_large_memory_and_time_increases_are_regressions():
+    baseline = {"write_csv": get_result(1.0, 0.0), "parse": get_result(1.0, 100.0)}
+    results = {"write_csv": get_result(2.0, 80.0), "parse": get_result(1.0, 400.0)}
+    assert compare_to_baseline(results, baseline) == [
+        "write_csv: 2.00 s against baseline 1.00 s.",
+        "write_csv: 80.0 MB peak against baseline 0.0 MB.",
+        "parse: 400.0 MB peak against baseline 100.0 MB.",
+    ]
@@ -0,0 +1,33 @@
+from pandas import DataFrame, array
+from numpy.random import default_rng
+
+from bootstrap import bootstrap_herfindahl
+
+
+def test_bootstrap_herfindahl_is_reproducible_across_workers_and_batches():
+    rng = default_rng(0)
+    num = 5000
+    df = DataFrame(
+        {
+            "CZONE": array(rng.integers(1, 20, num), dtype="Int32"),
+            "DPRIMSI": array(rng.integers(100, 120, num), dtype="Int16"),
+            "DEMTLHER": array(rng.integers(0, 300, num), dtype="Int32"),
+            "DSALESVO": array(rng.integers(0, 10**6, num), dtype="Int64"),
+        }
+    )
+    df.loc[::40, "CZONE"] = None
+    df_herfindahl = bootstrap_herfindahl(df, num_replicates=50, seed=0, num_processes=1)
+    assert df_herfindahl.equals(
+        bootstrap_herfindahl(
+            df, num_replicates=50, seed=0, num_processes=2, max_draws=500
+        )
+    )
+    assert list(df_herfindahl.columns) == [
+        "CZONE",
+        "SIC",
+        "HHI_EMP",
+        "HHI_EMP_LOWER",
+        "HHI_EMP_UPPER",
+        "HHI_SALES",
+    ]
+    assert (df_herfindahl["HHI_EMP_LOWER"] <= df_herfindahl["HHI_EMP_UPPER"]).all()
@@ -0,0 +1,190 @@
+from pandas import DataFrame, array, concat
+from numpy import log
+from numpy.random import default_rng
+from numpy.testing import assert_allclose
+
+from concentration import (
+    apply_deltas,
+    build_incremental_state,
+    get_concentration_cube,
+    get_concentration_measures,
+    get_concentration_statistics,
+    get_herfindahl_from_statistics,
+    get_incremental_herfindahl,
+    load_incremental_state,
+    save_incremental_state,
+)
+from utils import get_herfindahl_index
+
+
+def get_establishments(rng, duns, czones=(1, 20)):
+    num = len(duns)
+    return DataFrame(
+        {
+            "DUNS": array(duns, dtype="Int64"),
+            "CZONE": array(rng.integers(*czones, num), dtype="Int32"),
+            "DPRIMSI": array(rng.choice([111, 2011, 5812, 7372], num), dtype="Int16"),
+            "DEMTLHER": array(rng.integers(0, 300, num), dtype="Int32"),
+            "DSALESVO": array(rng.integers(0, 10**8, num), dtype="Int64"),
+        }
+    )
+
+
+def get_full_herfindahl(df):
+    df_statistics, _ = get_concentration_statistics(df)
+    return get_herfindahl_from_statistics(df_statistics)
+
+
+def test_apply_deltas_matches_full_recomputation(tmp_path):
+    rng = default_rng(0)
+    df = get_establishments(rng, range(2000))
+    save_incremental_state(build_incremental_state(df), f"{tmp_path}/")
+    state = load_incremental_state(f"{tmp_path}/")
+    for i in range(4):
+        duns = df["DUNS"].to_numpy(dtype="int64")
+        df_upserts = concat(
+            [
+                get_establishments(rng, rng.choice(duns, 40, replace=False)),
+                get_establishments(rng, range(10000 + 100 * i, 10030 + 100 * i)),
+            ],
+            ignore_index=True,
+        )
+        deletes = rng.choice(duns, 30, replace=False).tolist()
+        apply_deltas(state, df_upserts, deletes)
+        df = concat(
+            [df[~df["DUNS"].isin(deletes + df_upserts["DUNS"].tolist())], df_upserts],
+            ignore_index=True,
+        )
+        assert get_incremental_herfindahl(state).equals(get_full_herfindahl(df))
+
+    # Empty a commuting zone and open a new one
+    deletes = df.loc[df["CZONE"] == 3, "DUNS"].tolist()
+    df_upserts = get_establishments(rng, range(50000, 50020), czones=(99, 100))
+    apply_deltas(state, df_upserts, deletes)
+    df = concat([df[df["CZONE"] != 3], df_upserts], ignore_index=True)
+    df_herfindahl = get_incremental_herfindahl(state)
+    assert df_herfindahl.equals(get_full_herfindahl(df))
+    assert 3 not in set(df_herfindahl["CZONE"]) and 99 in set(df_herfindahl["CZONE"])
+
+
+def test_incremental_state_skips_missing_and_duplicate_duns():
+    rng = default_rng(1)
+    df = get_establishments(rng, [1, 2, 2, 3, 4])
+    df.loc[3, "DUNS"] = None
+    state = build_incremental_state(df)
+    assert sorted(state["establishments"].index) == [1, 2, 4]
+
+    df_upserts = get_establishments(rng, [5, 5, 6])
+    df_upserts.loc[2, "DUNS"] = None
+    apply_deltas(state, df_upserts, [1])
+    df_expected = concat([df.loc[[1, 4]], df_upserts.loc[[1]]], ignore_index=True)
+    assert get_incremental_herfindahl(state).equals(get_full_herfindahl(df_expected))
+
+
+def get_legacy_herfindahl(df):
+    """
+    Herfindahl Index by the groupby and merge cascade the sufficient statistics replaced,
+    on measures as float64 as read from .csv, so shares of zero totals are NaN and drop out of sums.
+    """
+    df = df.astype({"DEMTLHER": "float64", "DSALESVO": "float64"})
+    df_firms = df.groupby(["CZONE", "DPRIMSI"]).size().reset_index(name="FIRMSTOTCZI")
+    df_complete = df.merge(df_firms, on=["CZONE", "DPRIMSI"])
+    df_complete = df_complete.merge(
+        df[["DEMTLHER", "CZONE"]].groupby("CZONE").sum().reset_index(),
+        on="CZONE",
+        suffixes=("", "TOTCZ"),
+    )
+    df_complete = df_complete.merge(
+        df[["DSALESVO", "DPRIMSI", "CZONE"]]
+        .groupby(["CZONE", "DPRIMSI"])
+        .sum()
+        .reset_index(),
+        on=["CZONE", "DPRIMSI"],
+        suffixes=("", "TOTCZI"),
+    )
+    df_complete["HHI_EMP"] = (
+        df_complete["DEMTLHER"] / df_complete["DEMTLHERTOTCZ"]
+    ) / df_complete["FIRMSTOTCZI"]
+    df_complete["HHI_SALES"] = (
+        df_complete["DSALESVO"] / df_complete["DSALESVOTOTCZI"]
+    ) / df_complete["FIRMSTOTCZI"]
+    return (
+        df_complete[["CZONE", "DPRIMSI", "HHI_EMP", "HHI_SALES"]]
+        .groupby(["CZONE", "DPRIMSI"])
+        .sum()
+        .reset_index()
+    )
+
+
+def test_herfindahl_matches_legacy_groupby_cascade():
+    rng = default_rng(2)
+    df = get_establishments(rng, range(500))
+    df_edge = DataFrame(
+        {
+            # Single-firm cell, cell with no employees or sales in an otherwise empty commuting zone,
+            # and a firm with missing employees and sales
+            "DUNS": array([1000, 1001, 1002, 1003], dtype="Int64"),
+            "CZONE": array([50, 60, 60, 1], dtype="Int32"),
+            "DPRIMSI": array([9999, 111, 111, 111], dtype="Int16"),
+            "DEMTLHER": array([7, 0, 0, None], dtype="Int32"),
+            "DSALESVO": array([100, 0, 0, None], dtype="Int64"),
+        }
+    )
+    df = concat([df, df_edge], ignore_index=True)
+    df_herfindahl = get_herfindahl_index(df)
+    df_legacy = get_legacy_herfindahl(df)
+    assert df_herfindahl[["CZONE", "SIC"]].to_numpy().tolist() == (
+        df_legacy[["CZONE", "DPRIMSI"]].to_numpy().tolist()
+    )
+    for column in ["HHI_EMP", "HHI_SALES"]:
+        assert_allclose(df_herfindahl[column], df_legacy[column], rtol=0, atol=1e-12)
+    single = df_herfindahl[df_herfindahl["CZONE"] == 50].iloc[0]
+    assert single["HHI_EMP"] == 1.0 and single["HHI_SALES"] == 1.0
+    empty = df_herfindahl[df_herfindahl["CZONE"] == 60].iloc[0]
+    assert empty["HHI_EMP"] == 0.0 and empty["HHI_SALES"] == 0.0
+
+
+def test_cube_levels_equal_direct_computation(df_ready):
+    cube = get_concentration_cube(df_ready)
+    assert cube[("CZONE", 4)].equals(get_herfindahl_index(df_ready))
+
+    # States and 2-digit industries as commuting zones and industries of a direct computation
+    df_state = df_ready.assign(
+        CZONE=df_ready["FIPS"] // 1000, DPRIMSI=df_ready["DPRIMSI"] // 100
+    )
+    df_direct = get_herfindahl_index(df_state)
+    df_rollup = cube[("STATE", 2)]
+    assert df_rollup[["STATE", "SIC"]].to_numpy().tolist() == (
+        df_direct[["CZONE", "SIC"]].to_numpy().tolist()
+    )
+    for column in ["HHI_EMP", "HHI_SALES"]:
+        assert_allclose(df_rollup[column], df_direct[column], rtol=1e-12)
+
+
+def test_concentration_measures_of_hand_computed_cells():
+    df = DataFrame(
+        {
+            # Shares (0.5, 0.3, 0.2) in commuting zone 1, and a single firm in commuting zone 2
+            "CZONE": array([1, 1, 1, 2], dtype="Int32"),
+            "DPRIMSI": array([111, 111, 111, 111], dtype="Int16"),
+            "DEMTLHER": array([30, 50, 20, 9], dtype="Int32"),
+            "DSALESVO": array([3, 5, 2, 4], dtype="Int64"),
+        }
+    )
+    measures = ["HHI_SQ", "CR1", "CR2", "CR4", "ENTROPY", "THEIL", "GINI"]
+    df_measures = get_concentration_measures(df, measures)
+    entropy = -(0.5 * log(0.5) + 0.3 * log(0.3) + 0.2 * log(0.2))
+    expected = {
+        "HHI_SQ": [0.38, 1.0],
+        "CR1": [0.5, 1.0],
+        "CR2": [0.8, 1.0],
+        "CR4": [1.0, 1.0],
+        "ENTROPY": [entropy, 0.0],
+        "THEIL": [log(3) - entropy, 0.0],
+        "GINI": [0.2, 0.0],
+    }
+    for measure, values in expected.items():
+        for variable in ["EMP", "SALES"]:
+            assert_allclose(
+                df_measures[f"{measure}_{variable}"], values, rtol=1e-12, atol=1e-15
+            )
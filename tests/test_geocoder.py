@@ -0,0 +1,247 @@
+from csv import reader
+from email.parser import BytesParser
+from io import StringIO
+from asyncio import run
+from json import dumps
+from time import monotonic
+from urllib.parse import parse_qs, urlparse
+
+from pytest import fixture
+
+import utils
+
+from geocoder import (
+    RateController,
+    async_geocode_data,
+    batch_geocode_data,
+    cached_geocode_data,
+    geocode_records,
+    stream_geocode_data,
+    extract_shards_fips,
+    iter_shards,
+)
+from utils import extract_dandbid_fips, get_data
+
+RECORDS = [
+    {
+        "DUNS": "000000001",
+        "DSTREET": "4600 SILVER HILL RD",
+        "DCITY": "WASHINGTON",
+        "DSTATEAB": "DC",
+        "DZIP5": "20233",
+    },
+    {
+        "DUNS": "000000002",
+        "DSTREET": "1 NOWHERE LN",
+        "DCITY": "NOWHERE",
+        "DSTATEAB": "KS",
+        "DZIP5": "66000",
+    },
+    {
+        "DUNS": "000000003",
+        "DSTREET": None,
+        "DCITY": "BOSTON",
+        "DSTATEAB": "MA",
+        "DZIP5": "02101",
+    },
+]
+
+
+def get_address_response(street: str) -> dict:
+    """
+    Response of geographies/address endpoint, matching only 4600 SILVER HILL RD.
+    """
+    matches = []
+    if street == "4600 SILVER HILL RD":
+        matches = [
+            {
+                "matchedAddress": "4600 SILVER HILL RD, WASHINGTON, DC, 20233",
+                "geographies": {"Counties": [{"STATE": "24", "COUNTY": "033"}]},
+            }
+        ]
+    return {"result": {"input": {}, "addressMatches": matches}}
+
+
+def respond_address(handler, body):
+    parameters = parse_qs(urlparse(handler.path).query)
+    content = dumps(get_address_response(parameters["street"][0])).encode()
+    return 200, {"Content-Type": "application/json"}, content
+
+
+def test_async_geocode_data_returns_responses_by_duns(stub_server):
+    server = stub_server(respond_address)
+    results = async_geocode_data(RECORDS, max_in_flight=2, url=server.url)
+    assert set(results) == {"000000001", "000000002"}
+    assert results["000000001"] == get_address_response("4600 SILVER HILL RD")
+    assert extract_dandbid_fips(results) == [{"DUNS": "000000001", "FIPS": "24033"}]
+    parameters = parse_qs(urlparse(server.requests[0][0]).query)
+    assert parameters["benchmark"] == ["Public_AR_Census2020"]
+    assert parameters["layers"] == ["82"]
+
+
+def get_form_fields(headers, body) -> dict:
+    """
+    Fields of multipart form uploaded to stub server, by name.
+    """
+    message = BytesParser().parsebytes(
+        f"Content-Type: {headers['Content-Type']}\r\n\r\n".encode() + body
+    )
+    return {
+        part.get_param("name", header="content-disposition"): part.get_payload(
+            decode=True
+        ).decode()
+        for part in message.get_payload()
+    }
+
+
+def respond_batch(handler, body):
+    """
+    Answer uploaded address file as the geographies/addressbatch endpoint does: one row per address,
+    without header and in any order, with state and county codes of matched addresses in the 9th and 10th columns.
+    """
+    rows = []
+    for duns, street, city, state, zip_code in reader(
+        StringIO(get_form_fields(handler.headers, body)["addressFile"])
+    ):
+        address = f"{street}, {city}, {state}, {zip_code}"
+        if street == "4600 SILVER HILL RD":
+            rows.append(
+                f'"{duns}","{address}","Match","Exact","{address}",'
+                '"-76.92748724230096,38.84601622386617","76355984","L","24","033","802405","1084"'
+            )
+        elif street == "1 NOWHERE LN":
+            rows.append(f'"{duns}","{address}","No_Match"')
+        else:
+            rows.append(f'"{duns}","{address}","Tie"')
+    content = "\n".join(reversed(rows)).encode()
+    return 200, {"Content-Type": "text/csv"}, content
+
+
+def test_batch_geocode_data_maps_duns_to_fips(stub_server):
+    server = stub_server(respond_batch)
+    records = [*RECORDS, {**RECORDS[1], "DUNS": "000000004", "DSTREET": "2 MAIN ST"}]
+    results = batch_geocode_data(records, batch_size=2, url=server.url)
+    assert set(results) == {"000000001", "000000002", "000000004"}
+    assert extract_dandbid_fips(results) == [{"DUNS": "000000001", "FIPS": "24033"}]
+    assert len(server.requests) == 2
+    _, headers, body = server.requests[0]
+    fields = get_form_fields(headers, body)
+    assert fields["benchmark"] == "Public_AR_Census2020"
+    assert fields["vintage"] == "Census2020_Census2020"
+
+
+def test_cached_batch_geocode_data_uploads_unique_misses_once(stub_server, tmp_path):
+    server = stub_server(respond_batch)
+    records = [
+        *RECORDS,
+        {**RECORDS[0], "DUNS": "000000005", "DSTREET": "4600  silver hill rd"},
+    ]
+    cache_path = str(tmp_path / "cache.sqlite")
+    for _ in range(2):
+        results = cached_geocode_data(
+            records, cache_path, geocode=batch_geocode_data, url=server.url
+        )
+        assert extract_dandbid_fips(results) == [
+            {"DUNS": "000000001", "FIPS": "24033"},
+            {"DUNS": "000000005", "FIPS": "24033"},
+        ]
+    assert len(server.requests) == 1
+    _, headers, body = server.requests[0]
+    assert len(get_form_fields(headers, body)["addressFile"].splitlines()) == 2
+
+
+@fixture
+def no_backoff(monkeypatch):
+    """
+    Retry at once, unless the server sends Retry-After.
+    """
+    monkeypatch.setattr(utils, "get_backoff", lambda attempt: 0)
+
+
+def get_throttling_responder(failures):
+    """
+    Respond with each of failures, status and headers, then answer as the address endpoint.
+    """
+    failures = list(failures)
+
+    def respond(handler, body):
+        if failures:
+            status, headers = failures.pop(0)
+            return status, headers, b"{}"
+        return respond_address(handler, body)
+
+    return respond
+
+
+def geocode_with_controller(url, controller):
+    return run(geocode_records(RECORDS[:1], controller, 30, url))
+
+
+def test_throttling_honours_retry_after_and_halves_limit(stub_server, no_backoff):
+    server = stub_server(get_throttling_responder([(429, {"Retry-After": "1"})]))
+    controller = RateController(max_in_flight=8, initial_in_flight=8)
+    start = monotonic()
+    results = geocode_with_controller(server.url, controller)
+    assert monotonic() - start >= 1
+    assert results["000000001"] == get_address_response("4600 SILVER HILL RD")
+    assert len(server.requests) == 2
+    assert controller.throttled == 1
+    assert controller.limit < 5
+
+
+def test_server_errors_are_retried(stub_server, no_backoff):
+    server = stub_server(get_throttling_responder([(503, {}), (500, {})]))
+    controller = RateController(max_in_flight=8, initial_in_flight=8)
+    results = geocode_with_controller(server.url, controller)
+    assert results["000000001"] == get_address_response("4600 SILVER HILL RD")
+    assert len(server.requests) == 3
+    assert controller.throttled == 2
+
+
+def test_client_errors_are_not_retried(stub_server, no_backoff):
+    server = stub_server(get_throttling_responder([(400, {})] * 10))
+    controller = RateController(max_in_flight=8, initial_in_flight=8)
+    results = geocode_with_controller(server.url, controller)
+    assert "error" in results["000000001"]
+    assert len(server.requests) == 1
+    assert controller.throttled == 0
+
+
+def test_get_data_retries_only_throttling_and_server_errors(stub_server, no_backoff):
+    server = stub_server(get_throttling_responder([(429, {}), (502, {}), (404, {})]))
+    url = f"{server.url}?street=4600+SILVER+HILL+RD"
+    assert "error" in get_data(url)
+    assert len(server.requests) == 3
+    assert get_data(url) == get_address_response("4600 SILVER HILL RD")
+
+
+def test_stream_geocode_data_writes_compact_records(stub_server, tmp_path):
+    server = stub_server(respond_address)
+    shard_dir = f"{tmp_path}/shards/"
+    records = [*RECORDS, {**RECORDS[0], "DUNS": ""}]
+    stream_geocode_data(records, shard_dir, chunk_size=1, url=server.url)
+    assert len(server.requests) == 2
+    assert sorted(iter_shards(shard_dir), key=lambda record: record["DUNS"]) == [
+        {"DUNS": "000000001", "FIPS": "24033", "MATCHES": 1},
+        {"DUNS": "000000002", "FIPS": None, "MATCHES": 0},
+    ]
+    df = extract_shards_fips(shard_dir).sort_values("DUNS")
+    assert df["DUNS"].tolist() == [1, 2]
+    assert df["FIPS"].tolist()[0] == 24033 and df["FIPS"].isna().tolist() == [
+        False,
+        True,
+    ]
+    assert df["MATCHES"].tolist() == [1, 0]
+
+    stream_geocode_data(records, shard_dir, url=server.url)
+    assert len(server.requests) == 2
+
+
+def test_stream_geocode_data_keeps_raw_responses_only_if_requested(
+    stub_server, tmp_path
+):
+    server = stub_server(respond_address)
+    shard_dir = f"{tmp_path}/shards/"
+    stream_geocode_data(RECORDS[:1], shard_dir, keep_raw=True, url=server.url)
+    (record,) = iter_shards(shard_dir)
+    assert record["response"] == get_address_response("4600 SILVER HILL RD")
@@ -0,0 +1,34 @@
+from multiprocessing import Pool
+from threading import active_count
+from time import sleep
+
+from instrumentation import SAMPLER, get_child_pids, get_metrics, measure
+
+
+def allocate(num_bytes):
+    block = bytearray(num_bytes)
+    sleep(0.2)
+    return len(block)
+
+
+def test_nested_scopes_share_one_sampler_thread():
+    with measure("outer"):
+        threads = active_count()
+        sampler = SAMPLER["thread"]
+        for _ in range(20):
+            with measure("inner"):
+                pass
+        assert active_count() == threads
+        assert SAMPLER["thread"] is sampler
+    with measure("outer"):
+        assert SAMPLER["thread"] is sampler
+    records = get_metrics()["functions"]["inner"]
+    assert all(record["peak_memory_mb"] is not None for record in records)
+
+
+def test_peak_memory_counts_pool_workers():
+    with Pool(1) as pool:
+        assert len(get_child_pids()) == 1
+        with measure("allocate") as record:
+            pool.apply(allocate, (200 * 2**20,))
+    assert record["peak_memory_mb"] > 100
@@ -0,0 +1,28 @@
+from pytest import raises
+
+from utils import get_panel_files, multi_get_panel_herfindahl
+
+
+def test_get_panel_files_keys_files_by_year(tmp_path):
+    for name in ["MGNTFIS3.I9Q5VOQI.DMI.1990.TXT", "MGNTFIS3.I9Q5VOQI.DMI.1991.TXT"]:
+        (tmp_path / name).touch()
+    files = get_panel_files(f"{tmp_path}/*.DMI.*.TXT")
+    assert sorted(files) == [1990, 1991]
+
+
+def test_get_panel_files_raises_if_nothing_matches(tmp_path):
+    with raises(FileNotFoundError, match="No D&B files"):
+        get_panel_files(f"{tmp_path}/*.DMI.*.TXT")
+
+
+def test_get_panel_files_raises_on_duplicate_years(tmp_path):
+    for name in ["MGNTFIS3.I9Q5VOQI.DMI.1990.TXT", "MGNTFIS3.RERUN.DMI.1990.TXT"]:
+        (tmp_path / name).touch()
+    with raises(ValueError, match="both of year 1990") as error:
+        get_panel_files(f"{tmp_path}/*.DMI.*.TXT")
+    assert "I9Q5VOQI" in str(error.value) and "RERUN" in str(error.value)
+
+
+def test_multi_get_panel_herfindahl_raises_without_files():
+    with raises(ValueError, match="No D&B files"):
+        multi_get_panel_herfindahl({}, "zip_czone_lookup.npy")
@@ -0,0 +1,29 @@
+from pytest import mark
+
+from utils import get_record_array, parse_fixed_width
+
+COLUMNS = [("A", 1, 2), ("B", 3, 4)]
+
+
+@mark.parametrize(
+    "buffer",
+    [
+        b"aaa\nb\nc\n",  # ragged, length divisible by stride of first line
+        b"ab\ncd\nef\n",  # uniform
+        b"ab\r\ncd\r\n",  # CRLF
+        b"abcd\nef",  # no trailing newline
+        b"ab\ncdef\ng\n",  # ragged
+    ],
+)
+def test_get_record_array_matches_lines(buffer):
+    records = get_record_array(buffer, 4)
+    lines = buffer.splitlines()
+    assert records.shape == (len(lines), 4)
+    for record, line in zip(records, lines):
+        assert bytes(record).rstrip(b"\0") == line[:4]
+
+
+def test_parse_fixed_width_ragged_crlf_and_no_trailing_newline():
+    df = parse_fixed_width(b"abcd\r\nef\ng", COLUMNS)
+    assert df["A"].tolist() == ["ab", "ef", "g"]
+    assert df["B"].tolist() == ["cd", "", ""]
@@ -0,0 +1,35 @@
+from warnings import catch_warnings, simplefilter
+
+from pandas import read_parquet
+
+from partition import multi_get_partitioned_herfindahl, partition_data
+from utils import get_herfindahl_index
+
+
+def test_partitioned_herfindahl_equals_in_memory(synthetic_data, df_ready, tmp_path):
+    directory = f"{tmp_path}/partitions/"
+    complete_directory = f"{tmp_path}/complete/"
+    counts = partition_data(
+        synthetic_data["text"],
+        synthetic_data["lookup"],
+        directory,
+        num_partitions=4,
+        chunk_bytes=1 << 20,
+    )
+    assert sum(counts.values()) == len(df_ready)
+    with catch_warnings():
+        simplefilter("error")
+        df_herfindahl = multi_get_partitioned_herfindahl(directory, complete_directory)
+    assert df_herfindahl.equals(get_herfindahl_index(df_ready))
+    assert len(read_parquet(complete_directory)) == len(df_ready)
+
+
+def test_partitioned_herfindahl_without_partitions(tmp_path):
+    df_herfindahl = multi_get_partitioned_herfindahl(f"{tmp_path}/")
+    assert df_herfindahl.empty
+    assert df_herfindahl.dtypes.to_dict() == {
+        "CZONE": "Int32",
+        "SIC": "Int16",
+        "HHI_EMP": "float64",
+        "HHI_SALES": "float64",
+    }
@@ -0,0 +1,41 @@
+from importlib.util import module_from_spec, spec_from_file_location
+from sys import modules
+
+import pipeline
+from pipeline import Stage, get_stage_fingerprint
+
+
+def load_module(name, file_path):
+    spec = spec_from_file_location(name, file_path)
+    module = module_from_spec(spec)
+    modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_fingerprint(module):
+    return get_stage_fingerprint(Stage("stage", module.stage, [], []), {})
+
+
+def test_stage_fingerprint_follows_project_code(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, "PROJECT_DIRECTORY", str(tmp_path))
+    monkeypatch.setitem(modules, "__main__", modules["__main__"])
+    (tmp_path / "helpers.py").write_text("SCALE = 1\n")
+    (tmp_path / "stages.py").write_text(
+        "from helpers import SCALE\n\n\ndef stage():\n    return SCALE\n"
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    helpers = load_module("helpers", tmp_path / "helpers.py")
+    fingerprint = get_fingerprint(load_module("stages", tmp_path / "stages.py"))
+
+    # Same module launched as a script
+    assert (
+        get_fingerprint(load_module("__main__", tmp_path / "stages.py")) == fingerprint
+    )
+
+    # Editing a project module the stage uses changes its fingerprint
+    (tmp_path / "helpers.py").write_text("SCALE = 10\n")
+    assert helpers.__file__ == str(tmp_path / "helpers.py")
+    assert get_fingerprint(modules["stages"]) != fingerprint
+    modules.pop("helpers")
+    modules.pop("stages")
@@ -0,0 +1,64 @@
+from json import loads
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from pandas import DataFrame, array
+from pytest import fixture, mark
+
+import query
+from query import HerfindahlQuery, serve
+
+
+@fixture
+def endpoint(tmp_path, monkeypatch):
+    DataFrame(
+        {
+            "CZONE": array([1, 1, 2], dtype="Int32"),
+            "SIC": array([111, 2011, 111], dtype="Int16"),
+            "HHI_EMP": [0.5, 0.25, 1.0],
+            "HHI_SALES": [0.5, 0.5, 1.0],
+        }
+    ).to_parquet(tmp_path / "czone_4.parquet")
+    monkeypatch.setattr(
+        query,
+        "get_cube_file_path",
+        lambda geography, sic_digits: f"{tmp_path}/{geography.lower()}_{sic_digits}.parquet",
+    )
+    server = serve(HerfindahlQuery(), port=0)
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def get_json(url):
+    try:
+        with urlopen(url) as response:
+            return response.status, loads(response.read())
+    except HTTPError as error:
+        return error.code, loads(error.read())
+
+
+def test_top_returns_most_concentrated_markets(endpoint):
+    status, body = get_json(f"{endpoint}/top?k=2")
+    assert status == 200
+    assert [market["HHI_EMP"] for market in body] == [1.0, 0.5]
+
+
+@mark.parametrize(
+    "path, status",
+    [
+        ("/top?k=-1", 400),
+        ("/top?digits=four", 400),
+        ("/get?code=1", 400),
+        ("/get?code=1&sic=99999999999999999999", 400),
+        ("/scan?low=0&high=9223372036854775807", 400),
+        ("/top?k=99999999999999999999", 200),
+        ("/top?digits=99999999999999999999", 400),
+        ("/scan?low=1&high=2&geography=STATE", 404),
+        ("/missing", 404),
+    ],
+)
+def test_queries_get_status(endpoint, path, status):
+    code, body = get_json(f"{endpoint}{path}")
+    assert code == status
+    assert status == 200 or "error" in body
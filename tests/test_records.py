@@ -0,0 +1,57 @@
+from pandas import read_parquet
+from pytest import fixture
+
+from utils import (
+    load_record_store,
+    lookup_duns,
+    lookup_zip_sic,
+    parse_data,
+    records_to_df,
+)
+
+
+@fixture(scope="module", params=[False, True], ids=["in_memory", "memory_map"])
+def record_store(request, synthetic_data, tmp_path_factory):
+    """
+    Record store and Parquet data of synthetic D&B text file, written by parse_data() in memory
+    or from Parquet parts of memory-mapped byte ranges.
+    """
+    tmp_path = tmp_path_factory.mktemp("records")
+    parquet_path = f"{tmp_path}/d_and_b.parquet"
+    directory = f"{tmp_path}/records/"
+    parse_data(
+        synthetic_data["text"],
+        parquet_path,
+        memory_map=request.param,
+        write_directory_records=directory,
+        chunk_bytes=1 << 20,
+    )
+    return load_record_store(directory), read_parquet(parquet_path)
+
+
+def test_records_equal_parsed_data(record_store):
+    store, df = record_store
+    assert records_to_df(store["records"]).equals(df)
+
+
+def test_lookup_duns(record_store):
+    store, df = record_store
+    duns = df["DUNS"].dropna().sample(20, random_state=0).tolist()
+    missing = int(df["DUNS"].max()) + 1
+    df_found = records_to_df(lookup_duns(store, [duns[0], missing, *duns[1:]]))
+    assert df_found["DUNS"].tolist() == duns
+    assert df_found.equals(
+        df.set_index("DUNS", drop=False).loc[duns].reset_index(drop=True)
+    )
+    assert len(lookup_duns(store, [missing])) == 0
+
+
+def test_lookup_zip_sic(record_store):
+    store, df = record_store
+    zip_code, sic = df[["DZIP5", "DPRIMSI"]].dropna().iloc[0].tolist()
+    df_zip = df[df["DZIP5"] == zip_code].sort_values("DPRIMSI", kind="stable")
+    df_found = records_to_df(lookup_zip_sic(store, zip_code))
+    assert df_found.equals(df_zip.reset_index(drop=True))
+    df_found = records_to_df(lookup_zip_sic(store, zip_code, sic))
+    assert df_found.equals(df_zip[df_zip["DPRIMSI"] == sic].reset_index(drop=True))
+    assert len(lookup_zip_sic(store, 99999, 1)) == 0
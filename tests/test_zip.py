@@ -0,0 +1,62 @@
+from pandas import DataFrame, array, concat, read_parquet
+
+from instrumentation import get_metrics
+from utils import (
+    REQUIRED_COLUMNS,
+    apply_schema,
+    assign_commuting_zones,
+    build_county_lookup,
+    build_zip_lookup,
+    get_zip_mapping,
+    keep_required_columns,
+    resolve_single_county_zips,
+)
+
+
+def test_resolve_single_county_zips(tmp_path):
+    # ZIP 1001 lies within county 36001, listed twice, and ZIP 2001 spans counties 36003 and 36005
+    zip_file_path = tmp_path / "zips.csv"
+    DataFrame(
+        {
+            "zipcode": [1001, 1001, 2001, 2001],
+            "statefips": [36, 36, 36, 36],
+            "countyfips": [1, 1, 3, 5],
+        }
+    ).to_csv(zip_file_path, index=False)
+    lookup = build_county_lookup(str(zip_file_path))
+
+    # ZIP 3001 isn't in ZIP code data, and one establishment has no ZIP
+    df = DataFrame(
+        {
+            "DUNS": array([1, 2, 3, 4, 5], dtype="Int64"),
+            "DZIP5": array([1001, 2001, 1001, 3001, None], dtype="Int32"),
+        }
+    )
+    counts = dict(get_metrics()["counts"])
+    df_resolved, df_remaining = resolve_single_county_zips(df, lookup)
+
+    assert df_resolved["DUNS"].tolist() == [1, 3]
+    assert df_resolved["FIPS"].tolist() == [36001, 36001]
+    assert df_remaining["DUNS"].tolist() == [2, 4, 5]
+    metrics = get_metrics()["counts"]
+    for name, count in [("resolved_by_zip", 2), ("sent_to_geocoder", 3)]:
+        assert metrics[name] - counts.get(name, 0) == count
+
+
+def test_assign_commuting_zones_matches_merge(synthetic_data):
+    df_mapped = get_zip_mapping(synthetic_data["zip"], synthetic_data["crosswalk"])
+    df = keep_required_columns(
+        read_parquet(synthetic_data["parquet"], columns=REQUIRED_COLUMNS)
+    )
+    # Establishments in ZIPs of the mapping, in a ZIP that isn't, beyond 5 digits and without ZIP
+    mapped_zips = set(df_mapped["DZIP5"].tolist())
+    unmatched_zip = next(code for code in range(100000) if code not in mapped_zips)
+    df_unmatched = df.head(3).assign(
+        DZIP5=array([unmatched_zip, 100000, None], dtype="Int32")
+    )
+    df = concat([df, df_unmatched], ignore_index=True)
+
+    df_ready = assign_commuting_zones(df, build_zip_lookup(df_mapped))
+    df_merged = apply_schema(df.merge(df_mapped, how="inner", on=["DZIP5"]))
+    assert df_ready.reset_index(drop=True).equals(df_merged)
+    assert len(df_ready) < len(df) - len(df_unmatched)
@@ -1,15 +1,168 @@
-from pandas import DataFrame, read_stata
-from requests import HTTPError, Timeout, JSONDecodeError
-from numpy import ceil
+from pandas import DataFrame, read_csv, read_parquet, read_stata, concat, to_numeric
+from pandas.arrays import IntegerArray
+from requests import ConnectionError, HTTPError, Timeout, JSONDecodeError
+from numpy import (
+    ceil,
+    array,
+    arange,
+    zeros,
+    uint8,
+    uint32,
+    char,
+    ndarray,
+    frombuffer,
+    flatnonzero,
+    ascontiguousarray,
+    concatenate,
+    int16,
+    int32,
+    int64,
+    full,
+    save,
+    load,
+    argsort,
+    asarray,
+    dtype,
+    searchsorted,
+)
+from numpy.lib.format import open_memmap
+from pyarrow.parquet import ParquetWriter, read_table
 import requests
 
 from multiprocessing import Pool, cpu_count
-from typing import Dict, List
-from time import sleep
-import warnings
+from mmap import mmap, ACCESS_READ
+from os import fstat, makedirs
+from os.path import basename
+from shutil import rmtree
+from glob import glob
+from re import findall
+from typing import Dict, List, Optional, Tuple
+from time import sleep, perf_counter
+from random import uniform
 from json import dump, dumps
 import traceback
 
+from concentration import (
+    get_concentration_statistics,
+    get_market_shares,
+    get_herfindahl_from_statistics,
+)
+from instrumentation import (
+    instrument,
+    record_latency,
+    record_count,
+)
+
+# D&B fixed-width layout: column name, 1-based start and inclusive end character index
+D_AND_B_COLUMNS = [
+    ("DUNS", 1, 9),
+    ("DCOMP", 10, 39),
+    ("DTRADE", 40, 69),
+    ("DSTREET", 70, 94),
+    ("DCITY", 95, 114),
+    ("DSTATEAB", 115, 116),
+    ("DZIP5", 117, 121),
+    ("DZIP4EXT", 122, 125),
+    ("DMAILADD", 126, 150),
+    ("DMAILCIT", 151, 170),
+    ("DMAILSTA", 171, 172),
+    ("DMAILZIP", 173, 177),
+    ("DMAILZP4", 178, 181),
+    ("DCARRRTC", 182, 185),
+    ("FILLER0", 186, 187),
+    ("DNATLCOD", 188, 190),
+    ("DSTATECO", 191, 192),
+    ("DCOUNTYC", 193, 195),
+    ("DCITYCOD", 196, 199),
+    ("DSMSACOD", 200, 202),
+    ("DTELEPHO", 203, 212),
+    ("DCEONAME", 213, 242),
+    ("DCEOTITT", 243, 272),
+    ("DSALESVO", 273, 287),
+    ("DSLSVOLC", 288, 288),
+    ("DEMTLTOT", 289, 297),
+    ("DEMTOTC", 298, 298),
+    ("DEMTLHER", 299, 307),
+    ("DEMPHRCDC", 308, 308),
+    ("DYRSTART", 309, 312),
+    ("DSTATUSI", 313, 313),
+    ("DSUBSIDI", 314, 314),
+    ("DMANUFIN", 315, 315),
+    ("DULTDUN", 316, 324),
+    ("DHDQDUN", 325, 333),
+    ("DPARDUN", 334, 342),
+    ("DPRHQCT", 343, 362),
+    ("DPRHQST", 363, 364),
+    ("FILLER1", 365, 372),
+    ("FILLER2", 373, 382),
+    ("DHIER", 383, 384),
+    ("DDIAS", 385, 393),
+    ("DPOPLCD", 394, 394),
+    ("DTRANCD", 395, 395),
+    ("DRPTDAT", 396, 401),
+    ("FILLER3", 402, 420),
+    ("DRCRDCL", 421, 421),
+    ("DLINEBU", 422, 440),
+    ("DPRIMSI", 441, 444),
+    ("DSICEXT1", 445, 448),
+    ("DSICEXT2", 449, 452),
+    ("DSICEXT3", 453, 456),
+    ("DSICEXT4", 457, 460),
+    ("DSIC2", 461, 480),
+    ("DSIC3", 481, 500),
+    ("DSIC4", 501, 520),
+    ("DSIC5", 521, 540),
+    ("DSIC6", 541, 560),
+]
+
+# Columns of D&B dataset used downstream of parsing, read by column projection from Parquet
+REQUIRED_COLUMNS = [
+    "DUNS",
+    "DCOMP",
+    "DSTREET",
+    "DCITY",
+    "DSTATEAB",
+    "DZIP5",
+    "DSALESVO",
+    "DEMTLHER",
+    "DPRIMSI",
+]
+
+# Compact dtypes for keys and measures of D&B columns and the geographies matched to them,
+# all other columns of D_AND_B_COLUMNS are kept as parsed text
+D_AND_B_SCHEMA = {
+    "DUNS": "Int64",
+    "DZIP5": "Int32",
+    "FIPS": "Int32",
+    "CZONE": "Int32",
+    "DPRIMSI": "Int16",
+    "DSALESVO": "Int64",
+    "DEMTLHER": "Int32",
+}
+
+# Sentinel of missing keys and measures in the record store, whose integer fields aren't nullable
+RECORD_MISSING = -1
+
+# Arrays of record store saved by save_record_store() as .npy files: records,
+# and keys and record numbers of the DUNS index and the ZIP and SIC index, sorted by key
+RECORD_STORE_FILES = [
+    "records",
+    "duns_keys",
+    "duns_rows",
+    "zip_sic_keys",
+    "zip_sic_rows",
+]
+
+# Widths of integer-encoded keys, leading zeros are only restored when writing outputs
+KEY_WIDTHS = {
+    "DUNS": 9,
+    "DZIP5": 5,
+    "FIPS": 5,
+    "CZONE": 5,
+    "DPRIMSI": 4,
+    "SIC": 4,
+}
+
 
 def read_file(file_path: str, num_lines: int) -> List[str]:
     """
@@ -51,228 +204,642 @@ def convert_stata_to_csv(file_path: str) -> None:
     print("Data saved.\n")
 
 
-def parse_line(args) -> Dict[str, str]:
+def parse_fixed_width(
+    buffer: bytes, columns: List[Tuple[str, int, int]] = D_AND_B_COLUMNS
+) -> DataFrame:
+    """
+    Parse fixed-width bytes according to columns object without building a dictionary per line.
+    Lines are laid out as rows of a 2D byte array and each column is sliced out of it as a fixed-width byte view,
+    so every DataFrame column is built directly from one vectorized slice.
+    This lower-level function is called in parse_data().
+    """
+    width = max(end for _, _, end in columns)
+    records = get_record_array(buffer, width)
+    data = {}
+    for name, start, end in columns:
+        field = ascontiguousarray(records[:, start - 1 : end]).view(
+            f"S{end - start + 1}"
+        )
+        data[name] = char.decode(char.strip(field.ravel()), "latin-1")
+    return DataFrame(data)
+
+
+def get_record_array(buffer: bytes, width: int) -> ndarray:
+    """
+    Lay out lines of fixed-width bytes as a 2D uint8 array with one row per line and width columns.
+    If every line has the same length the buffer is viewed in place, otherwise lines are padded
+    with null bytes, which are dropped when fields are read as fixed-width byte strings.
+    This lower-level function is called by parse_fixed_width().
+    """
+    data = frombuffer(buffer, dtype=uint8)
+    newlines = flatnonzero(data == ord("\n"))
+    stride = int(newlines[0]) + 1 if len(newlines) else 0
+    uniform = (
+        stride > 1
+        and len(data) % stride == 0
+        and data[stride - 2] != ord("\r")
+        and len(newlines) == len(data) // stride
+        and (newlines == arange(stride - 1, len(data), stride)).all()
+    )
+    if uniform:
+        records = data.reshape(-1, stride)[:, : stride - 1]
+        if records.shape[1] < width:
+            padded = zeros((records.shape[0], width), dtype=uint8)
+            padded[:, : records.shape[1]] = records
+            records = padded
+        return records[:, :width]
+    lines = array(bytes(buffer).splitlines(), dtype=f"S{width}")
+    return lines.view(uint8).reshape(-1, width)
+
+
+def get_byte_ranges(file_path: str, num_partitions: int) -> List[Tuple[int, int]]:
+    """
+    Split file into num_partitions line-aligned byte ranges of roughly equal size.
+    Each boundary is moved forward to just after the next newline, so no line is split between ranges.
+    This lower-level function is called in parse_data().
+    """
+    with open(file_path, "rb") as file:
+        size = fstat(file.fileno()).st_size
+        if size == 0:
+            return []
+        with mmap(file.fileno(), 0, access=ACCESS_READ) as mapped:
+            boundaries = [0]
+            for i in range(1, num_partitions):
+                position = mapped.find(
+                    b"\n", max(i * size // num_partitions, boundaries[-1])
+                )
+                boundaries.append(size if position == -1 else position + 1)
+            boundaries.append(size)
+    return [
+        (start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start
+    ]
+
+
+def parse_byte_range(args) -> int:
+    """
+    Memory-map file and parse a line-aligned byte range of it, cast to compact dtypes, into a Parquet part file.
+    Only the bytes of the range are read and only the number of rows is returned,
+    so each worker's memory is bounded by the size of its range and chunks aren't sent back to the parent.
+    This lower-level function is called in parse_data().
+    """
+    file_path, start, end, part_file_path = args
+    with open(file_path, "rb") as file, mmap(
+        file.fileno(), 0, access=ACCESS_READ
+    ) as mapped:
+        df = apply_schema(parse_fixed_width(mapped[start:end]))
+    df.to_parquet(part_file_path, index=False, compression="zstd")
+    return len(df)
+
+
+@instrument
+def save_parts(
+    part_file_paths: List[str],
+    num_rows: int,
+    file_path_parquet: str,
+    directory_records: Optional[str] = None,
+) -> None:
     """
-    Parse line of .txt file according to character indices.
+    Concatenate Parquet part files written by parse_byte_range() into one Parquet file, part by part,
+    and write each part into the record store under directory_records if given,
+    so only one part is in memory at a time.
     This lower-level function is called in parse_data().
     """
-    line, columns = args
-    result = {name: line[start - 1 : end].strip() for (name, start, end) in columns}
-    return result
+    records = (
+        None
+        if directory_records is None
+        else open_record_store(directory_records, num_rows)
+    )
+    writer = None
+    offset = 0
+    for part_file_path in part_file_paths:
+        table = read_table(part_file_path)
+        if writer is None:
+            writer = ParquetWriter(file_path_parquet, table.schema, compression="zstd")
+        writer.write_table(table)
+        if records is not None:
+            write_records(records, table.to_pandas(), offset)
+        offset += table.num_rows
+    if writer is None:
+        DataFrame().to_parquet(file_path_parquet, index=False, compression="zstd")
+    else:
+        writer.close()
+    if records is not None:
+        index_record_store(records, directory_records)
+    print("Data saved.\n")
 
 
+@instrument
 def parse_data(
-    read_file_path: str, write_file_path_csv: str, write_file_path_stata: str
+    read_file_path: str,
+    write_file_path_parquet: str,
+    write_file_path_csv: Optional[str] = None,
+    write_file_path_stata: Optional[str] = None,
+    memory_map: bool = False,
+    export: bool = False,
+    write_directory_records: Optional[str] = None,
+    chunk_bytes: int = 1 << 28,
 ) -> None:
     """
-    Parses D&B text file according to columns object,
+    Parses D&B text file according to D_AND_B_COLUMNS object,
     which is a list of tuples where first element is the name of the column,
     the second element is the starting line index and last is the ending line index.
 
-    This function uses all available cores and each worker in the pool processes a batch of lines.
-    """
-    columns = [
-        ("DUNS", 1, 9),
-        ("DCOMP", 10, 39),
-        ("DTRADE", 40, 69),
-        ("DSTREET", 70, 94),
-        ("DCITY", 95, 114),
-        ("DSTATEAB", 115, 116),
-        ("DZIP5", 117, 121),
-        ("DZIP4EXT", 122, 125),
-        ("DMAILADD", 126, 150),
-        ("DMAILCIT", 151, 170),
-        ("DMAILSTA", 171, 172),
-        ("DMAILZIP", 173, 177),
-        ("DMAILZP4", 178, 181),
-        ("DCARRRTC", 182, 185),
-        ("FILLER0", 186, 187),
-        ("DNATLCOD", 188, 190),
-        ("DSTATECO", 191, 192),
-        ("DCOUNTYC", 193, 195),
-        ("DCITYCOD", 196, 199),
-        ("DSMSACOD", 200, 202),
-        ("DTELEPHO", 203, 212),
-        ("DCEONAME", 213, 242),
-        ("DCEOTITT", 243, 272),
-        ("DSALESVO", 273, 287),
-        ("DSLSVOLC", 288, 288),
-        ("DEMTLTOT", 289, 297),
-        ("DEMTOTC", 298, 298),
-        ("DEMTLHER", 299, 307),
-        ("DEMPHRCDC", 308, 308),
-        ("DYRSTART", 309, 312),
-        ("DSTATUSI", 313, 313),
-        ("DSUBSIDI", 314, 314),
-        ("DMANUFIN", 315, 315),
-        ("DULTDUN", 316, 324),
-        ("DHDQDUN", 325, 333),
-        ("DPARDUN", 334, 342),
-        ("DPRHQCT", 343, 362),
-        ("DPRHQST", 363, 364),
-        ("FILLER1", 365, 372),
-        ("FILLER2", 373, 382),
-        ("DHIER", 383, 384),
-        ("DDIAS", 385, 393),
-        ("DPOPLCD", 394, 394),
-        ("DTRANCD", 395, 395),
-        ("DRPTDAT", 396, 401),
-        ("FILLER3", 402, 420),
-        ("DRCRDCL", 421, 421),
-        ("DLINEBU", 422, 440),
-        ("DPRIMSI", 441, 444),
-        ("DSICEXT1", 445, 448),
-        ("DSICEXT2", 449, 452),
-        ("DSICEXT3", 453, 456),
-        ("DSICEXT4", 457, 460),
-        ("DSIC2", 461, 480),
-        ("DSIC3", 481, 500),
-        ("DSIC4", 501, 520),
-        ("DSIC5", 521, 540),
-        ("DSIC6", 541, 560),
-    ]
+    The file is read as bytes and each column is sliced out in a single vectorized pass.
+    If memory_map is True, the file is memory-mapped instead and split into line-aligned byte ranges
+    of at most about chunk_bytes, where each worker in a pool using all available cores parses its own range
+    into a Parquet part file, and parts are then concatenated one at a time, so peak memory is bounded
+    by the size of a range rather than the whole file.
+
+    Keys and measures are cast to the compact dtypes of D_AND_B_SCHEMA,
+    then parsed data is saved to Parquet, and to .csv and .dta only if export is True.
+    If write_directory_records is given, parsed data is also saved as memory-mapped record store
+    with DUNS and ZIP and SIC indexes, see save_record_store().
+    """
+    if not memory_map:
+        with open(read_file_path, "rb") as file:
+            df = apply_schema(parse_fixed_width(file.read()))
+        print("Data parsed.\n")
+        save_data(
+            df,
+            write_file_path_parquet,
+            write_file_path_csv,
+            write_file_path_stata,
+            export,
+        )
+        if write_directory_records is not None:
+            save_record_store(df, write_directory_records)
+        return
 
-    with open(read_file_path, "r") as file, Pool(cpu_count()) as pool:
-        lines = [line.rstrip("\n") for line in file.readlines()]
-        results = pool.map(parse_line, [(line, columns) for line in lines])
+    with open(read_file_path, "rb") as file:
+        size = fstat(file.fileno()).st_size
+    num_processes = cpu_count()
+    byte_ranges = get_byte_ranges(
+        read_file_path, max(num_processes, int(ceil(size / chunk_bytes)))
+    )
+    parts_directory = f"{write_file_path_parquet}.parts/"
+    rmtree(parts_directory, ignore_errors=True)
+    makedirs(parts_directory)
+    part_file_paths = [
+        f"{parts_directory}part_{i:05d}.parquet" for i in range(len(byte_ranges))
+    ]
+    with Pool(num_processes) as pool:
+        num_rows = sum(
+            pool.map(
+                parse_byte_range,
+                [
+                    (read_file_path, start, end, part_file_path)
+                    for (start, end), part_file_path in zip(
+                        byte_ranges, part_file_paths
+                    )
+                ],
+            )
+        )
 
     print("Data parsed.\n")
 
-    df = DataFrame(results)
+    save_parts(
+        part_file_paths, num_rows, write_file_path_parquet, write_directory_records
+    )
+    rmtree(parts_directory)
+    if export:
+        save_exports(
+            read_parquet(write_file_path_parquet),
+            write_file_path_csv,
+            write_file_path_stata,
+        )
 
-    df.to_csv(write_file_path_csv, index=False)
-    df.to_stata(write_file_path_stata, write_index=False)
 
+@instrument
+def save_data(
+    df: DataFrame,
+    file_path_parquet: str,
+    file_path_csv: Optional[str] = None,
+    file_path_stata: Optional[str] = None,
+    export: bool = False,
+) -> None:
+    """
+    Write DataFrame to zstd-compressed Parquet, the main storage between stages of the pipeline,
+    which keeps dtypes and allows reading only the columns needed.
+    Slower .csv and .dta exports are only written if export is True, with leading zeros of keys filled.
+    Pipeline stages only write Parquet, and leave exports to an ExportSink in the background, see sinks.py.
+    """
+    df.to_parquet(file_path_parquet, index=False, compression="zstd")
+    if export:
+        save_exports(df, file_path_csv, file_path_stata)
     print("Data saved.\n")
 
 
-def fill_leading_zeros(df: DataFrame) -> DataFrame:
-    """
-    Fills leading zeros for D&B ID, ZIP code, and SIC code.
-    This is necessary since leading zeros are dropped once the data is imported,
-    since the columns are treated as integers, which can't have leading zeros.
-    """
-    column_to_length = {
-        "DUNS": 9,
-        "DZIP5": 5,
-        # "DZIP4EXT": 4,
-        # "DMAILZIP": 5,
-        # "DMAILZP4": 4,
-        # "DNATLCOD": 3,
-        # "DSTATECO": 2,
-        # "DCOUNTYC": 3,
-        # "DCITYCOD": 4,
-        # "DSMSACOD": 3,
-        # "DTELEPHO": 10,
-        # "DULTDUN": 9,
-        # "DHDQDUN": 9,
-        # "DPARDUN": 9,
-        # "DHIER": 2,
-        # "DDIAS": 9,
-        # "DPOPLCD": 1,
-        # "DTRANCD": 1,
-        # "DRPTDAT": 6,
-        "DPRIMSI": 4,
-        # "DSICEXT1": 4,
-        # "DSICEXT2": 4,
-        # "DSICEXT3": 4,
-        # "DSICEXT4": 4,
-        # "DSIC2": 20,
-        # "DSIC3": 20,
-        # "DSIC4": 20,
-        # "DSIC5": 20,
-        # "DSIC6": 20,
-    }
-    with warnings.catch_warnings():  # NB: Could not cast to string type from list of dicts. Suppressing warnings instead.
-        warnings.simplefilter("ignore")
-        for column, length in column_to_length.items():
-            df.loc[:, column] = df.loc[:, column].astype(str)
-            mask = (
-                (df.loc[:, column].notna())
-                & (df.loc[:, column] != "nan")
-                & (df.loc[:, column] != 0)
-            )
-            df.loc[mask, column] = df.loc[mask, column].str.zfill(length)
+def save_exports(df: DataFrame, file_path_csv: str, file_path_stata: str) -> None:
+    """
+    Write DataFrame to .csv and .dta with leading zeros of keys filled.
+    """
+    df_export = format_keys(df)
+    df_export.to_csv(file_path_csv, index=False)
+    df_export.to_stata(file_path_stata, write_index=False)
 
-    print("Filled leading zeros.\n")
 
+def apply_schema(df: DataFrame) -> DataFrame:
+    """
+    Cast columns of DataFrame found in D_AND_B_SCHEMA to their compact dtypes.
+    Keys such as D&B ID, ZIP, FIPS, commuting zone and SIC code are stored as nullable integers,
+    so leading zeros don't need to be kept and groupbys and merges run on fixed-width integers.
+    """
+    for column, dtype in D_AND_B_SCHEMA.items():
+        if column in df.columns:
+            df[column] = to_numeric(df[column], errors="coerce").astype(dtype)
     return df
 
 
-def fill_leading_zeros_zip(df: DataFrame) -> DataFrame:
+@instrument
+def format_keys(df: DataFrame) -> DataFrame:
     """
-    Fills leading zeros for ZIP code, and FIPS code.
-    This is necessary since leading zeros are dropped once the data is imported,
-    since the columns are treated as integers, which can't have leading zeros.
+    Format integer-encoded keys of DataFrame as text with leading zeros filled according to KEY_WIDTHS.
+    Missing keys are written as empty strings. Called when writing outputs and geocoding addresses.
     """
-    column_to_length = {
-        "zipcode": 5,
-        "statefips": 2,
-        "countyfips": 3,
-    }
-    with warnings.catch_warnings():  # NB: Could not cast to string type from list of dicts. Suppressing warnings instead.
-        warnings.simplefilter("ignore")
-        for column, length in column_to_length.items():
-            df.loc[:, column] = df.loc[:, column].fillna(0).astype(int).astype(str)
-            mask = (df.loc[:, column].notna()) & (df.loc[:, column] != "nan")
-            df.loc[mask, column] = df.loc[mask, column].str.zfill(length)
-
-    print("Filled leading zeros.\n")
-
+    df = df.copy()
+    for column, length in KEY_WIDTHS.items():
+        if column in df.columns:
+            df[column] = (
+                df[column].astype("string").str.zfill(length).fillna("").astype(object)
+            )
     return df
 
 
 def zip_combine_state_and_county(df: DataFrame) -> DataFrame:
     """
     Combine state and county codes into 5 digit FIPS code for ZIP data.
-    Rename zipcode to DZIP5 for matching.
+    Rename zipcode to DZIP5 for matching and drop ZIPs without a ZIP or FIPS code.
     """
-    df["FIPS"] = df["statefips"] + df["countyfips"]
-    return df.drop(columns=["statefips", "countyfips"]).rename(
+    df["FIPS"] = df["statefips"] * 1000 + df["countyfips"]
+    df = df.drop(columns=["statefips", "countyfips"]).rename(
         columns={"zipcode": "DZIP5"}
     )
+    return apply_schema(df).dropna(subset=["DZIP5", "FIPS"])
+
+
+@instrument
+def get_zip_mapping(zip_file_path: str, crosswalk_file_path: str) -> DataFrame:
+    """
+    Read ZIP code data and FIPS commuting zone crosswalk data, and merge them on FIPS
+    into ZIP to commuting zone mapping with one row per ZIP: DZIP5, FIPS, CZONE.
+    """
+    df_zip = read_csv(zip_file_path, usecols=["zipcode", "statefips", "countyfips"])
+    df_zip_processed = zip_combine_state_and_county(df_zip)
+    df_crosswalk_processed = process_crosswalk(read_csv(crosswalk_file_path))
+    df_mapped = df_zip_processed.merge(df_crosswalk_processed, how="inner", on=["FIPS"])
+    # Drop duplicate rows using key DZIP5, multiple ZIPs in FIPS and CZONE
+    return df_mapped.drop_duplicates(subset="DZIP5")
+
+
+@instrument
+def build_zip_lookup(df: DataFrame) -> ndarray:
+    """
+    Build dense lookup index from ZIP to commuting zone mapping with one row per possible 5 digit ZIP code,
+    where row at integer ZIP holds its FIPS and CZONE codes, or -1 if ZIP isn't mapped.
+    """
+    lookup = full((100000, 2), -1, dtype=int32)
+    zips = df["DZIP5"].to_numpy(dtype=int64)
+    lookup[zips, 0] = df["FIPS"].to_numpy(dtype=int32)
+    lookup[zips, 1] = df["CZONE"].to_numpy(dtype=int32)
+    print(f"Built ZIP lookup index.\n\t{(lookup[:, 0] >= 0).sum()} ZIPs mapped.\n")
+    return lookup
+
+
+@instrument
+def build_county_lookup(zip_file_path: str) -> ndarray:
+    """
+    Build dense lookup index of ZIP codes lying entirely within one county from ZIP code data,
+    where a ZIP spanning several counties has one row per county. Row at integer ZIP holds its FIPS code,
+    or -1 if ZIP spans several counties or isn't in ZIP code data, so its establishments need geocoding.
+    """
+    df_zip = zip_combine_state_and_county(
+        read_csv(zip_file_path, usecols=["zipcode", "statefips", "countyfips"])
+    ).drop_duplicates(subset=["DZIP5", "FIPS"])
+    df_single = df_zip[~df_zip["DZIP5"].duplicated(keep=False)]
+    lookup = full(100000, -1, dtype=int32)
+    lookup[df_single["DZIP5"].to_numpy(dtype=int64)] = df_single["FIPS"].to_numpy(
+        dtype=int32
+    )
+    print(
+        f"Built single-county ZIP lookup index.\n\t{len(df_single)} of {df_zip['DZIP5'].nunique()} ZIPs lie within one county.\n"
+    )
+    return lookup
+
+
+def save_zip_lookup(lookup: ndarray, file_path: str) -> None:
+    """
+    Save ZIP lookup index as .npy file, which can be memory-mapped at startup.
+    """
+    save(file_path, lookup)
+
+
+def load_zip_lookup(file_path: str) -> ndarray:
+    """
+    Memory-map ZIP lookup index saved by save_zip_lookup(), so only pages gathered from are read.
+    """
+    return load(file_path, mmap_mode="r")
+
+
+def get_record_dtype(columns: List[Tuple[str, int, int]] = D_AND_B_COLUMNS) -> dtype:
+    """
+    Structured dtype of records laid out from columns object, with fields in the order of the fixed-width layout.
+    Columns of D_AND_B_SCHEMA are fixed-width integers of their compact dtype,
+    all other columns are byte strings of their width in the layout.
+    """
+    return dtype(
+        [
+            (
+                (name, D_AND_B_SCHEMA[name].lower())
+                if name in D_AND_B_SCHEMA
+                else (name, f"S{end - start + 1}")
+            )
+            for name, start, end in columns
+        ]
+    )
+
+
+def get_zip_sic_keys(zips: ndarray, sics: ndarray) -> ndarray:
+    """
+    Encode ZIP and SIC codes into one integer key sorted by ZIP then SIC, where missing codes sort first.
+    """
+    return (asarray(zips, dtype=int64) + 1) * 100000 + asarray(sics, dtype=int64) + 1
+
+
+def encode_latin1(values: ndarray, width: int) -> ndarray:
+    """
+    Encode text as latin-1 byte strings of width in one vectorized pass, instead of encoding each string:
+    text is laid out as fixed-width UCS-4 code points, which are latin-1 bytes for text decoded from latin-1.
+    This lower-level function is called in save_record_store().
+    """
+    text = values.astype(f"U{width}")
+    return (
+        text.view(uint32).reshape(len(text), width).astype(uint8).view(f"S{width}")
+    ).ravel()
+
+
+def open_record_store(
+    directory: str,
+    num_records: int,
+    columns: List[Tuple[str, int, int]] = D_AND_B_COLUMNS,
+) -> ndarray:
+    """
+    Create memory-mapped .npy file of num_records records of dtype get_record_dtype() under directory,
+    to be written with write_records() and indexed with index_record_store().
+    This lower-level function is called in save_record_store() and save_parts().
+    """
+    makedirs(directory, exist_ok=True)
+    return open_memmap(
+        f"{directory}records.npy",
+        mode="w+",
+        dtype=get_record_dtype(columns),
+        shape=(num_records,),
+    )
+
+
+def write_records(records: ndarray, df: DataFrame, offset: int = 0) -> None:
+    """
+    Write rows of parsed D&B data field by field into records starting at record offset,
+    with missing keys and measures as RECORD_MISSING and text as latin-1 bytes.
+    This lower-level function is called in save_record_store() and save_parts().
+    """
+    rows = slice(offset, offset + len(df))
+    for name in records.dtype.names:
+        if name in D_AND_B_SCHEMA:
+            records[name][rows] = df[name].to_numpy(
+                dtype=records.dtype[name], na_value=RECORD_MISSING
+            )
+        else:
+            records[name][rows] = encode_latin1(
+                df[name].to_numpy(), records.dtype[name].itemsize
+            )
+
+
+def index_record_store(records: ndarray, directory: str) -> None:
+    """
+    Flush records and save DUNS index and ZIP and SIC index of record store under directory,
+    each a pair of .npy files of sorted keys and record numbers.
+    This lower-level function is called in save_record_store() and save_parts().
+    """
+    records.flush()
+    duns_order = argsort(records["DUNS"], kind="stable")
+    save(f"{directory}duns_keys.npy", records["DUNS"][duns_order].astype(int64))
+    save(f"{directory}duns_rows.npy", duns_order)
+    zip_sic_keys = get_zip_sic_keys(records["DZIP5"], records["DPRIMSI"])
+    zip_sic_order = argsort(zip_sic_keys, kind="stable")
+    save(f"{directory}zip_sic_keys.npy", zip_sic_keys[zip_sic_order])
+    save(f"{directory}zip_sic_rows.npy", zip_sic_order)
+    print(
+        f"Record store saved.\n\t{len(records)} records of {records.dtype.itemsize} bytes.\n"
+    )
+
+
+@instrument
+def save_record_store(
+    df: DataFrame,
+    directory: str,
+    columns: List[Tuple[str, int, int]] = D_AND_B_COLUMNS,
+) -> None:
+    """
+    Save parsed D&B data as binary record store under directory: a NumPy structured array of dtype get_record_dtype(),
+    with one record per establishment, a DUNS index, and a secondary index by ZIP and SIC code.
+    Each index is a pair of .npy files of sorted keys and record numbers, searched by binary search.
+    Missing keys and measures are stored as RECORD_MISSING and text as latin-1 bytes.
+    Records are written field by field into a memory-mapped .npy file, so the store isn't built in memory first.
+    Arrays of the store are memory-mapped with load_record_store().
+    """
+    records = open_record_store(directory, len(df), columns)
+    write_records(records, df)
+    index_record_store(records, directory)
+
+
+def load_record_store(directory: str) -> Dict[str, ndarray]:
+    """
+    Memory-map arrays of record store saved by save_record_store(), keyed as in RECORD_STORE_FILES,
+    so columns are field views and lookups only read the pages of the records they gather.
+    """
+    return {
+        name: load(f"{directory}{name}.npy", mmap_mode="r")
+        for name in RECORD_STORE_FILES
+    }
+
+
+def get_index_rows(keys: ndarray, rows: ndarray, low: int, high: int) -> ndarray:
+    """
+    Record numbers of index entries with keys from low up to but excluding high, found by binary search on sorted keys.
+    This lower-level function is called in lookup_duns() and lookup_zip_sic().
+    """
+    return rows[searchsorted(keys, low, "left") : searchsorted(keys, high, "left")]
+
+
+def lookup_duns(store: Dict[str, ndarray], duns: List[int]) -> ndarray:
+    """
+    Look up records of D&B IDs in record store with the DUNS index, in the order of duns.
+    Returns structured array of records found.
+    """
+    rows = [
+        get_index_rows(store["duns_keys"], store["duns_rows"], key, key + 1)
+        for key in map(int, duns)
+    ]
+    return store["records"][concatenate(rows) if rows else zeros(0, dtype=int64)]
+
+
+def lookup_zip_sic(
+    store: Dict[str, ndarray], zip_code: int, sic: Optional[int] = None
+) -> ndarray:
+    """
+    Look up records of a ZIP code in record store with the ZIP and SIC index, only of industry sic if given,
+    ordered by SIC code. Returns structured array of records found.
+    """
+    if sic is None:
+        low = get_zip_sic_keys(zip_code, RECORD_MISSING)
+        high = get_zip_sic_keys(zip_code + 1, RECORD_MISSING)
+    else:
+        low = get_zip_sic_keys(zip_code, sic)
+        high = low + 1
+    return store["records"][
+        get_index_rows(store["zip_sic_keys"], store["zip_sic_rows"], low, high)
+    ]
+
+
+def records_to_df(records: ndarray) -> DataFrame:
+    """
+    Convert structured array of records, such as from lookup_duns() or the memory-mapped records themselves,
+    to DataFrame as parsed by parse_data(), with keys and measures of compact nullable dtypes
+    where RECORD_MISSING is missing, and text decoded.
+    """
+    data = {}
+    for name in records.dtype.names:
+        values = ascontiguousarray(records[name])
+        if name in D_AND_B_SCHEMA:
+            data[name] = IntegerArray(values, values == RECORD_MISSING)
+        else:
+            data[name] = char.decode(values, "latin-1")
+    return DataFrame(data)
+
+
+@instrument
+def assign_commuting_zones(df: DataFrame, lookup: ndarray) -> DataFrame:
+    """
+    Assign FIPS and CZONE codes to D&B data by ZIP code with one vectorized gather from ZIP lookup index,
+    instead of merging string keys. As with an inner merge, establishments with unmapped ZIPs are dropped.
+    """
+    zips = df["DZIP5"].to_numpy(dtype=int64, na_value=-1)
+    valid = (zips >= 0) & (zips < len(lookup))
+    codes = full((len(zips), 2), -1, dtype=int32)
+    codes[valid] = lookup[zips[valid]]
+    mapped = codes[:, 0] >= 0
+    df_ready = df[mapped].copy()
+    df_ready["FIPS"] = codes[mapped, 0]
+    df_ready["CZONE"] = codes[mapped, 1]
+    print(f"Assigned commuting zones by ZIP.\n\tDataFrame shape:{df_ready.shape}.\n")
+    return apply_schema(df_ready)
+
+
+@instrument
+def resolve_single_county_zips(
+    df: DataFrame, lookup: ndarray
+) -> Tuple[DataFrame, DataFrame]:
+    """
+    Assign FIPS codes to establishments in ZIPs lying within one county with one vectorized gather
+    from lookup index built by build_county_lookup(), without geocoding them.
+    Counts of establishments resolved locally and left for the geocoder are recorded in metrics.
+    Returns DataFrame of DUNS and FIPS of establishments resolved locally, and DataFrame of remaining establishments,
+    in ZIPs spanning several counties, unknown or missing ZIPs, to be geocoded.
+    """
+    zips = df["DZIP5"].to_numpy(dtype=int64, na_value=-1)
+    valid = (zips >= 0) & (zips < len(lookup))
+    fips = full(len(zips), -1, dtype=int32)
+    fips[valid] = lookup[zips[valid]]
+    resolved = fips >= 0
+    df_resolved = df.loc[resolved, ["DUNS"]].reset_index(drop=True)
+    df_resolved["FIPS"] = fips[resolved]
+    record_count("resolved_by_zip", resolved.sum())
+    record_count("sent_to_geocoder", (~resolved).sum())
+    print(
+        f"Resolved counties by ZIP.\n\t{resolved.sum()} observations resolved locally, {(~resolved).sum()} sent to geocoder.\n"
+    )
+    return apply_schema(df_resolved), df[~resolved]
 
 
+@instrument
 def keep_required_columns(df: DataFrame) -> DataFrame:
     """
     Keep only required columns from D&B dataset.
     """
-    columns_to_keep = [
-        "DUNS",
-        "DCOMP",
-        "DSTREET",
-        "DCITY",
-        "DSTATEAB",
-        "DZIP5",
-        "DSALESVO",
-        "DEMTLHER",
-        "DPRIMSI",
-    ]
     print("Kept required columns.\n")
-    return df[columns_to_keep]
+    return df[REQUIRED_COLUMNS]
 
 
+@instrument
 def df_to_dict(df: DataFrame) -> List[Dict[str, str]]:
     """
-    Convert DataFrame to dictionary to be used as input for geocoding.
+    Convert DataFrame to dictionary to be used as input for geocoding,
+    with leading zeros of D&B IDs and ZIP codes filled.
     """
     print("Converted processed DataFrame to dictionary for geocoding.\n")
-    return df.to_dict(orient="records")
+    return format_keys(df).to_dict(orient="records")
+
+
+def get_backoff(attempt: int, base: float = 1, cap: float = 60) -> float:
+    """
+    Jittered exponential backoff in seconds before retrying after attempt failed,
+    drawn uniformly up to base * 2 ** attempt capped at cap, so workers don't retry in lockstep.
+    """
+    return uniform(0, min(cap, base * 2**attempt))
 
 
-def get_data(url: str) -> List[Dict[str, str]]:
+def is_retryable_status(status: int) -> bool:
     """
-    Send HTTP GET request.
+    Whether a request answered with HTTP status should be retried: on throttling (429) and server errors (5xx).
+    Other client errors, such as a bad request (400) for a malformed address, are permanent.
+    """
+    return status == 429 or status >= 500
+
+
+def get_retry_backoff(attempt: int, retry_after: Optional[str]) -> float:
+    """
+    Jittered exponential backoff in seconds before retrying after attempt failed,
+    at least Retry-After seconds if the server sent it.
+    """
+    backoff = get_backoff(attempt)
+    if retry_after is not None and retry_after.isdigit():
+        backoff = max(backoff, float(retry_after))
+    return backoff
+
+
+def get_data(url: str, timeout: float = 30) -> List[Dict[str, str]]:
+    """
+    Send HTTP GET request, which times out after timeout seconds instead of blocking a worker forever.
+    Throttled requests, server errors, timeouts, connection errors and malformed JSON are retried
+    after jittered exponential backoff, honouring Retry-After, while other client errors fail at once.
     This lower-level function is called by geocode_data().
     """
-    for _ in range(10):
+    for attempt in range(10):
+        start = perf_counter()
+        retry_after = None
         try:
-            response = requests.get(url)
+            response = requests.get(url, timeout=timeout)
+            retry_after = response.headers.get("Retry-After")
             response.raise_for_status()
             return response.json()
-        except (HTTPError, Timeout, JSONDecodeError) as e:  # Catch JSONDecodeError
+        except HTTPError as e:
+            if not is_retryable_status(e.response.status_code):
+                print(f"Request failed with exception: {str(e)}. Not retrying.\n")
+                return {
+                    "error": f"Request failed with status {e.response.status_code}."
+                }
+            print(f"Attempt failed with exception: {str(e)}. Retrying...\n")
+        except (
+            ConnectionError,
+            Timeout,
+            JSONDecodeError,
+        ) as e:  # Catch JSONDecodeError
             print(f"Attempt failed with exception: {str(e)}. Retrying...\n")
-            sleep(1)  # wait for 1 second before trying again
+        finally:
+            record_latency("geocoder_request", perf_counter() - start)
+        sleep(
+            get_retry_backoff(attempt, retry_after)
+        )  # wait with jittered backoff before trying again
     return {"error": "Unable to fetch data after 10 attempts."}
 
 
@@ -308,10 +875,9 @@ def get_chunks(data: List[Dict[str, str]], n):
 def multi_geocode_data(data: List[Dict[str, str]]) -> Dict[str, Dict[str, str]]:
     """
     Initilizes pool of workers which each send a batch of requests to geocoding endpoint.
-    Uses all available cores, but not at a 100% processing power.
-    --------------------------------
-    TODO: In future adding multithreading may significantly speed up processes,
+    Uses all available cores, but not at a 100% processing power,
     since each core only uses from around 3 to 10% at any given time.
+    See async_geocode_data() in geocoder.py for a drop-in alternative keeping many requests in flight.
     """
     num_processes = cpu_count()
     data_chunks = list(get_chunks(data, int(ceil(len(data) / num_processes))))
@@ -346,7 +912,7 @@ def save_geocoded_responses(
         )
         try:
             with open(file_txt, "w") as file:
-                file.write(responses)
+                file.write(str(responses))
             print("Saved geocoded responses as text.\n")
         except Exception as txt_error:
             print(
@@ -354,6 +920,19 @@ def save_geocoded_responses(
             )
 
 
+def extract_fips(result: Dict[str, Dict[str, str]]) -> Optional[str]:
+    """
+    Extract 5 digit FIPS code combining state and county code of first address match of geocoder response,
+    or None if address wasn't matched.
+    This lower-level function is called in extract_dandbid_fips().
+    """
+    if "result" in result:
+        if result["result"]["addressMatches"]:
+            county = result["result"]["addressMatches"][0]["geographies"]["Counties"][0]
+            return f"{county['STATE']}{county['COUNTY']}"
+    return None
+
+
 def extract_dandbid_fips(results: Dict[str, Dict[str, str]]) -> List[Dict[str, str]]:
     """
     Extract D&B IDs and state and county FIPS codes into list of dictonaries,
@@ -361,28 +940,34 @@ def extract_dandbid_fips(results: Dict[str, Dict[str, str]]) -> List[Dict[str, s
     """
     outer_results = []
     for id, result in results.items():
-        if "result" in result:
-            if result["result"]["addressMatches"]:
-                inner_results = {}
-                inner_results["DUNS"] = id
-                inner_results["FIPS"] = (
-                    f"{result['result']['addressMatches'][0]['geographies']['Counties'][0]['STATE']}{result['result']['addressMatches'][0]['geographies']['Counties'][0]['COUNTY']}"
-                )
-                outer_results.append(inner_results)
+        fips = extract_fips(result)
+        if fips is not None:
+            outer_results.append({"DUNS": id, "FIPS": fips})
     print(
         f"Extracting complete.\n\t{len(outer_results)} observations mapped to FIPS.\n"
     )
     return outer_results
 
 
+def get_match_count(result: Dict[str, Dict[str, str]]) -> int:
+    """
+    Match quality of geocoder response: number of address matches, capped at 127,
+    or -1 if request failed after all attempts.
+    This lower-level function is called in get_shard_record() of geocoder.py.
+    """
+    if "result" in result:
+        return min(len(result["result"]["addressMatches"]), 127)
+    return -1
+
+
+@instrument
 def process_crosswalk(df: DataFrame) -> DataFrame:
     """
-    Process crosswalk data by first filling leading zeros and then renaming columns.
+    Process crosswalk data by first renaming columns and then casting FIPS and commuting zone codes to integers.
     """
-    df["cty_fips"] = df["cty_fips"].astype(int).astype(str).str.zfill(5)
-    df["czone"] = df["czone"].astype(int).astype(str).str.zfill(5)
+    df = apply_schema(df.rename(columns={"cty_fips": "FIPS", "czone": "CZONE"}))
     print(f"Crosswalk processing complete.\n\tDataFrame shape:{df.shape}.\n")
-    return df.rename(columns={"cty_fips": "FIPS", "czone": "CZONE"})
+    return df
 
 
 def get_aggregates_and_market_share(df: DataFrame) -> DataFrame:
@@ -397,73 +982,93 @@ def get_aggregates_and_market_share(df: DataFrame) -> DataFrame:
     -----------------------------
     NB: DEMTLHER, employees here on location, variable is used instead of DEMPLTOT, total employees of market participant,
         since interest in labour market share of employees in commuting zone not firms total employees.
+
+    Computed from sufficient statistics accumulated in a single pass, see concentration.py.
     """
-    aggregate_columns, mkt_share_emp_columns, mkt_share_sales_columns = (
-        [
-            "DUNS",
-            "DPRIMSI",
-            "CZONE",
-        ],
-        [
-            "DEMTLHER",
-            "CZONE",
-        ],
-        [
-            "DSALESVO",
-            "DPRIMSI",
-            "CZONE",
-        ],
-    )
-    df_groupby_dprimsi_czone = (
-        df[aggregate_columns]
-        .groupby(by=["CZONE", "DPRIMSI"])
-        .size()
-        .reset_index(name="FIRMSTOTCZI")
-    )
-    df_aggregate = df.merge(df_groupby_dprimsi_czone, on=["CZONE", "DPRIMSI"])
-    df_groupby_emps = (
-        df[mkt_share_emp_columns].groupby(by=["CZONE"]).sum().reset_index()
-    )
-    df_mkt_share_emps = df_aggregate.merge(
-        df_groupby_emps, on="CZONE", suffixes=("", "TOTCZ")
-    )
-    df_groupby_sales = (
-        df[mkt_share_sales_columns].groupby(by=["CZONE", "DPRIMSI"]).sum().reset_index()
-    )
-    df_complete = df_mkt_share_emps.merge(
-        df_groupby_sales, on=["CZONE", "DPRIMSI"], suffixes=("", "TOTCZI")
-    )
-    df_complete["EMPMKTSHAREZ"] = df_complete["DEMTLHER"] / df_complete["DEMTLHERTOTCZ"]
-    df_complete["SALESMKTSHAREZI"] = (
-        df_complete["DSALESVO"] / df_complete["DSALESVOTOTCZI"]
-    )
-    print(
-        f"Computing aggregates and market shares complete.\n\tDataFrame shape:{df_complete.shape}.\n"
-    )
-    return df_complete
+    df_statistics, cell_codes = get_concentration_statistics(df)
+    return get_market_shares(df, df_statistics, cell_codes)
 
 
 def get_herfindahl_index(df: DataFrame) -> DataFrame:
     """
     1. Compute weighted Herfindahl Index for labour market concentration by commuting zone and industry.
     2. Compute weighted Herfindahl Index for sales concentration by commuting zone and industry.
+
+    Computed from sufficient statistics accumulated in a single pass, see concentration.py.
     """
-    herfindahl_columns = [
-        "DPRIMSI",
-        "CZONE",
-        "HHI_EMP",
-        "HHI_SALES",
-    ]
-    df["HHI_EMP"] = df["EMPMKTSHAREZ"] * (1 / df["FIRMSTOTCZI"])
-    df["HHI_SALES"] = df["SALESMKTSHAREZI"] * (1 / df["FIRMSTOTCZI"])
-    df_herfindahl = (
-        df[herfindahl_columns]
-        .groupby(by=["CZONE", "DPRIMSI"])
-        .sum()
-        .reset_index()
-        .rename(columns={"DPRIMSI": "SIC"})
+    df_statistics, _ = get_concentration_statistics(df)
+    return get_herfindahl_from_statistics(df_statistics)
+
+
+def get_panel_files(pattern: str) -> Dict[int, str]:
+    """
+    Find D&B files matching glob pattern and key them by year, taken from the last 4 digit part of the file name,
+    e.g. 1990 for MGNTFIS3.I9Q5VOQI.DMI.1990.TXT.
+    Raises FileNotFoundError if no file with a year in its name matches pattern,
+    and ValueError if two files have the same year.
+    """
+    files = {}
+    for file_path in sorted(glob(pattern)):
+        years = findall(r"(?<!\d)(\d{4})(?!\d)", basename(file_path))
+        if not years:
+            continue
+        year = int(years[-1])
+        if year in files:
+            raise ValueError(
+                f"D&B files {files[year]} and {file_path} are both of year {year}."
+            )
+        files[year] = file_path
+    if not files:
+        raise FileNotFoundError(
+            f"No D&B files with a year in their name match {pattern}."
+        )
+    return files
+
+
+def get_year_herfindahl(args) -> DataFrame:
+    """
+    Compute Herfindahl Index by commuting zone and industry for one year of D&B data,
+    from a D&B text file, parsing only required columns, or from Parquet parsed by parse_data().
+    ZIP lookup index is memory-mapped, so workers share its pages read-only instead of each loading a copy.
+    This lower-level function is called in multi_get_panel_herfindahl().
+    """
+    year, file_path, lookup_path = args
+    if file_path.endswith(".parquet"):
+        df = read_parquet(file_path, columns=REQUIRED_COLUMNS)
+    else:
+        columns = [
+            column for column in D_AND_B_COLUMNS if column[0] in REQUIRED_COLUMNS
+        ]
+        with open(file_path, "rb") as file:
+            df = apply_schema(parse_fixed_width(file.read(), columns))
+    df_ready = assign_commuting_zones(
+        keep_required_columns(df), load_zip_lookup(lookup_path)
     )
+    df_statistics, _ = get_concentration_statistics(df_ready)
+    df_herfindahl = get_herfindahl_from_statistics(df_statistics)
+    df_herfindahl.insert(0, "YEAR", int16(year))
+    return df_herfindahl
+
+
+@instrument
+def multi_get_panel_herfindahl(files: Dict[int, str], lookup_path: str) -> DataFrame:
+    """
+    Compute Herfindahl Index for many years of D&B data concurrently, with one year per worker in a pool,
+    into one long panel: YEAR, CZONE, SIC, HHI_EMP, HHI_SALES.
+    """
+    if not files:
+        raise ValueError("No D&B files given to compute Herfindahl Index panel.")
+    num_processes = max(1, min(cpu_count(), len(files)))
+    with Pool(num_processes) as pool:
+        results = pool.map(
+            get_year_herfindahl,
+            [
+                (year, file_path, lookup_path)
+                for year, file_path in sorted(files.items())
+            ],
+        )
+    df_panel = concat(results, ignore_index=True)
     print(
-        f"Computing Herfindahl Index by commuting zone and industry complete.\n\tDataFrame shape:{df_herfindahl.shape}.\n"
+        f"Computing Herfindahl Index panel complete for {len(files)} years.\n\tDataFrame shape:{df_panel.shape}.\n"
     )
-    return df_herfindahl
+    return df_panel